@@ -0,0 +1,81 @@
+"""
+Times the flair rollup queries (see flair_rollup.py) on a synthetic history: several subreddits with a few years
+of posts each, synced into the rollup the way the collector does it.
+
+Usage: python benchmarks/bench_flair_rollup.py [--subreddits 10] [--years 3] [--posts-per-day 300]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from collections import namedtuple
+from datetime import date, datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from flair_rollup import FlairRollup
+
+Post = namedtuple('Post', ['fullname', 'created_utc', 'link_flair_text'])
+
+FLAIRS = ['Discussion', 'Question', 'Workout', 'Nutrition', 'Progress', 'Gear', 'Meme', None]
+
+
+class SyntheticSubreddit:
+    """
+    Stands in for a praw Subreddit: new() lists the synthetic posts newest first
+    """
+
+    def __init__(self, display_name, start, end, posts_per_day):
+        self.display_name = display_name
+        self.start = start
+        self.spacing = 86400 / posts_per_day
+        self.count = int((end - start) / self.spacing)
+
+    def new(self, limit=None):
+        for index in range(self.count - 1, -1, -1):
+            yield Post(f"t3_{self.display_name}{index}", self.start + index * self.spacing, FLAIRS[(index * 7) % len(FLAIRS)])
+
+
+def best_time(function, repeat=20):
+    """
+    Returns the fastest of repeat calls of function, in milliseconds
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times) * 1000
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--subreddits', type=int, default=10)
+    parser.add_argument('--years', type=int, default=3)
+    parser.add_argument('--posts-per-day', type=int, default=300)
+    args = parser.parse_args()
+
+    end = datetime(2022, 12, 31).timestamp()
+    start = end - args.years * 365 * 86400
+    with tempfile.TemporaryDirectory() as run_dir:
+        rollup = FlairRollup(os.path.join(run_dir, 'flair_rollup.db'))
+        sync_start = time.perf_counter()
+        posts = 0
+        for index in range(args.subreddits):
+            posts += rollup.sync(SyntheticSubreddit(f"sub{index}", start, end, args.posts_per_day))
+        sync_time = time.perf_counter() - sync_start
+        rows = rollup.conn.execute('SELECT COUNT(*) FROM flair_counts').fetchone()[0]
+        print(f"Synced {posts} posts into {rows} rollup rows in {sync_time:.2f}s ({posts / sync_time:,.0f} posts/s)")
+        print(f"Rollup file size: {os.path.getsize(rollup.db_file) / (1024 * 1024):.1f}MB")
+
+        first_day = date.fromtimestamp(start).isoformat()
+        queries = {
+            'counts, one month': lambda: rollup.counts('sub0', '2022-07-01', '2022-07-31'),
+            'counts, whole history': lambda: rollup.counts('sub0', first_day, '2022-12-31'),
+            'top 5 flairs, one year': lambda: rollup.top_flairs('sub0', '2022-01-01', '2022-12-31', 5),
+            'monthly trend, whole history': lambda: rollup.monthly_counts('sub0', first_day, '2022-12-31'),
+        }
+        for name, query in queries.items():
+            print(f"{name:<30} {best_time(query):8.3f}ms")
+        rollup.close()
@@ -0,0 +1,81 @@
+"""
+Compares parsing a large ICS calendar with ics.Calendar (then filtering its timeline) against the windowed
+streaming parser in ics_window.py, on the same synthetic calendar the mock Reddit server serves.
+
+The ics package does not expand recurring events, so the markdown of both is compared on a copy of the
+calendar without RRULEs. The windowed parser is then timed with the recurrences, cold and with memoized expansions.
+
+Usage: python benchmarks/bench_ics_parser.py [--events 10000] [--days 30]
+"""
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import arrow
+from ics import Calendar
+from ics_window import WindowedCalendarParser
+import mock_reddit
+
+
+def render_md(events, start, stop):
+    md = ''
+    for begin, end, name in events:
+        if start <= begin and start <= end <= stop:
+            md += f"{begin.format(fmt='MMMM Do')}  \n**{name}**\n\n---\n\n"
+    return md
+
+
+def ics_md(ical_text, start, stop):
+    cal = Calendar(ical_text)
+    return render_md(((event.begin, event.end, event.name) for event in cal.timeline.included(start, stop)), start, stop)
+
+
+def windowed_md(ical_text, start, stop, expansions=None):
+    parser = WindowedCalendarParser(start.datetime, stop.datetime, expansions)
+    events = parser.parse(ical_text.splitlines())
+    return render_md(((arrow.get(begin), arrow.get(end), name) for begin, end, name in events), start, stop), parser
+
+
+def measure(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    function(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak / (1024 * 1024)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    mock_reddit.add_arguments(parser)
+    parser.add_argument('--days', type=int, default=30)
+    args = parser.parse_args()
+    if '--events' not in sys.argv:
+        args.events = 10_000
+
+    ical_text = mock_reddit.MockReddit(args).calendar
+    plain_text = '\r\n'.join(line for line in ical_text.split('\r\n') if not line.startswith('RRULE:'))
+    start = arrow.get(datetime.utcnow())
+    stop = start + timedelta(days=args.days)
+    print(f"{args.events} events, {len(ical_text) / (1024 * 1024):.1f}MB of ICS, {args.days}-day window")
+
+    ics_result, ics_time, ics_peak = measure(ics_md, plain_text, start, stop)
+    print(f"ics.Calendar:            {ics_time:7.2f}s, peak {ics_peak:7.1f}MB")
+    (windowed_result, _), windowed_time, windowed_peak = measure(windowed_md, plain_text, start, stop)
+    print(f"windowed parser:         {windowed_time:7.2f}s, peak {windowed_peak:7.1f}MB")
+    print('Markdown output is identical' if ics_result == windowed_result else 'Markdown output DIFFERS')
+
+    expansions = {}
+    (_, cold), cold_time, _ = measure(windowed_md, ical_text, start, stop, {})
+    windowed_md(ical_text, start, stop, expansions)
+    (_, warm), warm_time, _ = measure(windowed_md, ical_text, start, stop, expansions)
+    print(f"with RRULEs, cold:       {cold_time:7.2f}s ({cold.stats()})")
+    print(f"with RRULEs, memoized:   {warm_time:7.2f}s ({warm.stats()})")
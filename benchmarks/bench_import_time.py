@@ -0,0 +1,83 @@
+"""
+Tracks the startup cost of the scripts: how long importing each one takes (python -X importtime), and which heavy
+libraries it pulls in before main() runs.
+
+Each module is imported in an empty directory, so an import that reads the config file or starts work fails here.
+The time is the module's cumulative import time (the best of several runs, since it is noisy), checked against
+STARTUP_BUDGET_MS. The script exits with status 1 if an import fails or a module goes over its budget.
+
+Usage: python benchmarks/bench_import_time.py [--runs 5] [--modules report_deleted_posts,flair_report]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Import time budget (in milliseconds) of each script run from cron or by hand
+STARTUP_BUDGET_MS = {
+    'calendar_widget': 50,
+    'flair_report': 50,
+    'flair_rollup': 50,
+    'mod_transparency_report': 50,
+    'modlog_archive': 10,
+    'migrate_posts': 20,
+    'reddit_auth': 50,
+    'report_deleted_posts': 80
+}
+
+# Libraries that should only be imported by the code that needs them
+HEAVY_MODULES = ('praw', 'asyncpraw', 'requests', 'arrow', 'pandas', 'flask', 'aiohttp', 'asyncio')
+
+
+def import_times(module_name, run_dir):
+    """
+    Returns {module: cumulative microseconds} for everything imported by "import module_name"
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f"import {module_name}"],
+        cwd=run_dir,
+        env=dict(os.environ, PYTHONPATH=REPO_DIR),
+        capture_output=True,
+        text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Measure the import time of the scripts')
+    parser.add_argument('--runs', type=int, default=5, help='Imports per module; the fastest one counts')
+    parser.add_argument('--modules', default=','.join(STARTUP_BUDGET_MS), help='Comma-separated list of modules')
+    args = parser.parse_args()
+
+    failed = False
+    print(f"{'module':<25} {'import':>9} {'budget':>8}  heavy imports")
+    with tempfile.TemporaryDirectory() as run_dir:
+        for module_name in args.modules.split(','):
+            try:
+                runs = [import_times(module_name, run_dir) for _ in range(args.runs)]
+            except RuntimeError as e:
+                print(f"{module_name:<25} import failed: {str(e)}")
+                failed = True
+                continue
+            import_ms = min(times[module_name] for times in runs) / 1000
+            budget_ms = STARTUP_BUDGET_MS.get(module_name)
+            heavy = [name for name in HEAVY_MODULES if name in runs[0]]
+            over_budget = budget_ms is not None and import_ms > budget_ms
+            failed = failed or over_budget
+            print(
+                f"{module_name:<25} {import_ms:>7.1f}ms {budget_ms or '-':>6}ms  {', '.join(heavy) or '-'}"
+                + ('  OVER BUDGET' if over_budget else '')
+            )
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,74 @@
+"""
+Compares the JSON file layout with the SQLite post store for the operations report_deleted_posts.py performs:
+inserting new posts, building the newest-first list of saved posts, and marking posts as notified.
+
+Usage: python benchmarks/bench_post_store.py [--posts 20000] [--updates 500]
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from post_store import JsonPostStore, SQLitePostStore
+
+SUBREDDIT_NAME = 'benchsub'
+
+
+def make_posts(num_posts):
+    now = int(time.time())
+    for i in range(num_posts):
+        fullname = f"t3_{i + 36 ** 5:x}"
+        yield fullname, {
+            'title': f"Post number {i}",
+            'author': f"user{i % 500}",
+            'permalink': f"/r/{SUBREDDIT_NAME}/comments/{fullname[3:]}/post_number_{i}/",
+            'body': 'lorem ipsum ' * 40,
+            'created_utc': now - num_posts + i
+        }
+
+
+def timed(label, num_ops, func):
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    print(f"  {label:<10} {elapsed:8.3f}s  {num_ops / elapsed:12,.0f} ops/s")
+
+
+def run(store, posts, num_updates):
+    def insert():
+        for fullname, payload in posts:
+            store.save(SUBREDDIT_NAME, fullname, payload)
+
+    def scan():
+        store.recent_fullnames(SUBREDDIT_NAME)
+
+    to_update = random.sample([fullname for fullname, _ in posts], num_updates)
+
+    def update():
+        for fullname in to_update:
+            store.mark_notified(SUBREDDIT_NAME, fullname)
+
+    timed('insert', len(posts), insert)
+    timed('scan', len(posts), scan)
+    timed('update', num_updates, update)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--posts', type=int, default=20000)
+    parser.add_argument('--updates', type=int, default=500)
+    args = parser.parse_args()
+
+    posts = list(make_posts(args.posts))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        print(f"JSON files ({args.posts} posts)")
+        run(JsonPostStore(os.path.join(tmp_dir, 'json')), posts, args.updates)
+
+        print(f"SQLite ({args.posts} posts)")
+        store = SQLitePostStore(os.path.join(tmp_dir, 'posts.db'))
+        run(store, posts, args.updates)
+        store.close()
@@ -0,0 +1,76 @@
+"""
+Simulates the deletion checks of report_deleted_posts.py for archives of different sizes and reports the number
+of info() requests per cycle, comparing the age-tiered scheduler with re-checking every saved post on every cycle.
+
+It also reports the longest gap between two checks of a post submitted during the run while it is less than
+an hour old, which bounds how long it takes to notice that a fresh post was deleted.
+
+Usage: python benchmarks/bench_recheck_scheduler.py [--hours 2] [--cycle 10] [--new-post-every 30]
+"""
+
+import argparse
+import math
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from recheck_scheduler import RecheckScheduler, INFO_BATCH_SIZE
+
+ARCHIVE_DAYS = 90
+
+
+def simulate(archive_size, hours, cycle, new_post_every):
+    random.seed(archive_size)
+    now = 1_700_000_000.0
+    scheduler = RecheckScheduler()
+    created = {}
+    for i in range(archive_size):
+        fullname = f"t3_old{i}"
+        created[fullname] = now - random.uniform(0, ARCHIVE_DAYS * 24 * 60 * 60)
+        scheduler.add(fullname, 'benchsub', created[fullname], now=now)
+
+    requests = []
+    naive_requests = []
+    last_checked = {}
+    max_fresh_gap = 0
+    next_post = now
+    post_number = 0
+    end = now + hours * 60 * 60
+    while now < end:
+        now += cycle
+        while next_post <= now:
+            fullname = f"t3_new{post_number}"
+            created[fullname] = next_post
+            scheduler.add(fullname, 'benchsub', next_post, now=now)
+            post_number += 1
+            next_post += new_post_every
+
+        batches = scheduler.due_batches(now=now)
+        requests.append(len(batches))
+        naive_requests.append(math.ceil(len(created) / INFO_BATCH_SIZE))
+        for batch in batches:
+            for entry in batch:
+                if entry.fullname.startswith('t3_new') and now - entry.created_utc < 60 * 60:
+                    previous = last_checked.get(entry.fullname, entry.created_utc)
+                    max_fresh_gap = max(max_fresh_gap, now - previous)
+                last_checked[entry.fullname] = now
+                scheduler.reschedule(entry, now=now)
+
+    return requests, naive_requests, max_fresh_gap
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--hours', type=float, default=2)
+    parser.add_argument('--cycle', type=float, default=10)
+    parser.add_argument('--new-post-every', type=float, default=30)
+    args = parser.parse_args()
+
+    print(f"{'archive':>9} | {'req/cycle (all posts)':>22} | {'req/cycle (scheduler)':>22} | {'max req':>7} | {'fresh post max gap':>18}")
+    for archive_size in (1_000, 10_000, 100_000):
+        requests, naive_requests, max_fresh_gap = simulate(archive_size, args.hours, args.cycle, args.new_post_every)
+        print(
+            f"{archive_size:>9,} | {sum(naive_requests) / len(naive_requests):>22.1f} | "
+            f"{sum(requests) / len(requests):>22.2f} | {max(requests):>7} | {max_fresh_gap:>17.0f}s"
+        )
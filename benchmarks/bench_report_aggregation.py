@@ -0,0 +1,154 @@
+"""
+Compares the pandas pivot-table report code that mod_transparency_report.py used to run with the streaming
+ModActionAggregator on a synthetic modlog, checking that both produce the same markdown.
+
+Time is measured on a plain run, peak memory on a second run under tracemalloc (which is slower).
+
+Usage: python benchmarks/bench_report_aggregation.py [--entries 1000000] [--skip-pandas]
+"""
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from dateutil.tz import tzutc
+from modlog_archive import ModlogEntry
+from report_aggregator import ModActionAggregator
+import mock_reddit
+
+POSTS_TEXT = 'posts were reviewed by the moderators'
+COMMENTS_TEXT = 'comments were reported to the moderators by community users or by SplatBot'
+
+
+def synthetic_modlog(num_entries):
+    """
+    Yields modlog entries newest first, with the same mix of actions as the mock Reddit server
+    """
+    newest = time.time()
+    actions = mock_reddit.MODLOG_ACTIONS
+    for index in range(num_entries):
+        action = actions[(index * 7) % len(actions)]
+        target_kind = 't3' if action.endswith('link') or index % 3 == 0 else 't1'
+        description = None
+        details = None
+        if action == 'addremovalreason':
+            description = mock_reddit.REMOVAL_REASONS[index % len(mock_reddit.REMOVAL_REASONS)]
+        elif action == 'banuser':
+            description = mock_reddit.BAN_REASONS[index % len(mock_reddit.BAN_REASONS)]
+            details = mock_reddit.BAN_DURATIONS[index % len(mock_reddit.BAN_DURATIONS)]
+        yield ModlogEntry(
+            f"ModAction_{index}",
+            newest - index * 2,
+            action,
+            f"{target_kind}_{index // 3:x}",
+            description,
+            details,
+            f"mod{index % 5}"
+        )
+
+
+def pandas_report(entries):
+    """
+    The report code as it was before the streaming aggregator
+    """
+    import pandas as pd
+
+    report_data = {}
+    bans = []
+    for item in entries:
+        item_created_dt = datetime.fromtimestamp(item.created_utc, tz=tzutc())
+        target_item_dict = report_data.get(item.target_fullname, {})
+        if item.action == 'addremovalreason':
+            target_item_dict['removal_reason'] = item.description
+            report_data[item.target_fullname] = target_item_dict
+        elif item.action in ['approvelink', 'approvecomment', 'removelink', 'removecomment']:
+            if target_item_dict.get('type') is None:
+                target_item_dict['type'] = 'comment' if item.target_fullname.split('_')[0] == 't1' else 'post'
+                target_item_dict['mod_action'] = 'approve' if item.action.startswith('approve') else 'remove'
+                target_item_dict['date_time'] = item_created_dt.strftime('%Y/%m/%d')
+                report_data[item.target_fullname] = target_item_dict
+        elif item.action == 'banuser':
+            bans.append({'timestamp': item.created_utc, 'reason': item.description.split(':')[0], 'duration': item.details})
+
+    df_report = pd.DataFrame(report_data).transpose()
+    summary_data = pd.pivot_table(data=df_report, index=['type', 'mod_action'], values='date_time', aggfunc='count', fill_value=0)
+    removal_reason_data = pd.pivot_table(
+        data=df_report, index=['type', 'mod_action', 'removal_reason'], values='date_time', aggfunc='count', fill_value=0
+    )
+    md = ''
+    for item_type, heading, text in (('post', 'Post Removals', POSTS_TEXT), ('comment', 'Comment Removals', COMMENTS_TEXT)):
+        if item_type in summary_data['date_time']:
+            approved = summary_data['date_time'][item_type].get('approve', 0)
+            removed = summary_data['date_time'][item_type].get('remove', 0)
+            total = approved + removed
+            md += (
+                f"## {heading}\n"
+                f"A total of **{total}** {text}, of which **{removed}** "
+                f"({int(round(removed / total * 100, 0))}%) were removed for the following reasons:  \n"
+            )
+            for removal_reason, count in removal_reason_data['date_time'][item_type]['remove'].sort_values(ascending=False, kind='stable').items():
+                md += f"- {removal_reason}: **{count}** ({int(round(count / removed * 100, 0))}%)  \n"
+    if bans:
+        for ban in bans:
+            if '/u/' in ban['reason']:
+                ban['reason'] = 'Unauthorized bot'
+        bans_summary_data = pd.pivot_table(
+            data=pd.DataFrame(bans), index=['reason'], columns=['duration'], values='timestamp', aggfunc='count', fill_value=0
+        )
+        md += (
+            '## Bans\n'
+            f"A total of **{len(bans)}** bans were issued by the moderators. The table below breaks them down by reason and duration:  \n\n"
+        )
+        md += bans_summary_data.to_markdown()
+    return md
+
+
+def aggregator_report(entries):
+    aggregator = ModActionAggregator()
+    for item in entries:
+        aggregator.add(item)
+    return (
+        aggregator.removals_md('post', 'Post Removals', POSTS_TEXT)
+        + aggregator.removals_md('comment', 'Comment Removals', COMMENTS_TEXT)
+        + aggregator.bans_md()
+    )
+
+
+def measure(report_function, num_entries):
+    start = time.perf_counter()
+    md = report_function(synthetic_modlog(num_entries))
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    report_function(synthetic_modlog(num_entries))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return md, elapsed, peak / (1024 * 1024)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--entries', type=int, default=1_000_000)
+    parser.add_argument('--skip-pandas', action='store_true', help='Only measure the streaming aggregator')
+    args = parser.parse_args()
+
+    streaming_md, streaming_time, streaming_peak = measure(aggregator_report, args.entries)
+    print(
+        f"streaming aggregator: {streaming_time:6.2f}s ({args.entries / streaming_time:,.0f} entries/s), "
+        f"peak {streaming_peak:8.1f}MB"
+    )
+    if not args.skip_pandas:
+        start = time.perf_counter()
+        import pandas  # noqa: F401
+        print(f"Importing pandas: {time.perf_counter() - start:.2f}s")
+
+        pandas_md, pandas_time, pandas_peak = measure(pandas_report, args.entries)
+        print(
+            f"pandas pivot tables: {pandas_time:7.2f}s ({args.entries / pandas_time:,.0f} entries/s), "
+            f"peak {pandas_peak:8.1f}MB"
+        )
+        print('Markdown output is identical' if pandas_md == streaming_md else 'Markdown output DIFFERS')
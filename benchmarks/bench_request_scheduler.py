@@ -0,0 +1,103 @@
+"""
+Runs a mix of work against the mock Reddit API with a tight rate limit, once with asyncpraw's own rate limiter and
+once through request_scheduler.py, and reports per kind of work: requests sent, failures and (for modmail
+notifications) how long each one took.
+
+The mix: 4 backfill workers paging through listings, 2 recheck workers looking up 100 posts at a time,
+1 ingestion worker fetching new posts and 1 notification every second.
+
+Usage: python benchmarks/bench_request_scheduler.py [--duration 30] [--ratelimit 60 --ratelimit-window 10]
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import asyncpraw
+import request_scheduler
+from request_scheduler import BACKFILL, INGESTION, NOTIFICATION, RECHECK, request_priority
+import mock_reddit
+from run_benchmarks import fetch_stats
+
+SUBREDDIT_NAME = 'benchsub'
+
+
+async def worker(reddit, kind, priority, stop_at, results):
+    subreddit = await reddit.subreddit(SUBREDDIT_NAME)
+    with request_priority(priority):
+        while time.time() < stop_at:
+            start = time.perf_counter()
+            try:
+                if kind == 'notification':
+                    await subreddit.message('Deleted Post Notification', 'Benchmark')
+                elif kind == 'recheck':
+                    fullnames = [f"t3_{mock_reddit.to_base36(key)}" for key in range(1_000_000, 1_000_100)]
+                    [post async for post in reddit.info(fullnames)]
+                else:
+                    [post async for post in subreddit.new(limit=100)]
+                results[kind + ' sent'] += 1
+                if kind == 'notification':
+                    results.setdefault('latencies', []).append(time.perf_counter() - start)
+            except Exception:
+                results[kind + ' failed'] += 1
+            if kind == 'notification':
+                await asyncio.sleep(max(0, 1 - (time.perf_counter() - start)))
+
+
+async def run(port, duration, use_scheduler):
+    base_url = f"http://127.0.0.1:{port}"
+    results = Counter()
+    async with asyncpraw.Reddit(
+        client_id='mock-client-id',
+        client_secret='mock-client-secret',
+        user_agent='benchmark by u/mock',
+        username='mock',
+        password='mock',
+        oauth_url=base_url,
+        reddit_url=base_url,
+        check_for_updates=False
+    ) as reddit:
+        if use_scheduler:
+            request_scheduler.attach(reddit, request_scheduler.RequestScheduler())
+        stop_at = time.time() + duration
+        workers = (
+            [('backfill', BACKFILL)] * 4 + [('recheck', RECHECK)] * 2 + [('ingestion', INGESTION), ('notification', NOTIFICATION)]
+        )
+        await asyncio.gather(*(worker(reddit, kind, priority, stop_at, results) for kind, priority in workers))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    mock_reddit.add_arguments(parser)
+    parser.add_argument('--duration', type=float, default=30)
+    args = parser.parse_args()
+    if '--ratelimit' not in sys.argv:
+        args.ratelimit = 60
+    if '--ratelimit-window' not in sys.argv:
+        args.ratelimit_window = 10
+
+    server = mock_reddit.start_server(args)
+    print(f"Rate limit: {args.ratelimit} requests per {args.ratelimit_window}s, {args.duration:.0f}s per run")
+    try:
+        for name, use_scheduler in (('asyncpraw rate limiter', False), ('request scheduler', True)):
+            time.sleep(args.ratelimit_window)  # start each run on a fresh window
+            fetch_stats(args.port, reset=True)
+            results = asyncio.run(run(args.port, args.duration, use_scheduler))
+            stats = fetch_stats(args.port)
+            latencies = results.pop('latencies', [])
+            print(f"{name}:")
+            for kind in ('notification', 'ingestion', 'recheck', 'backfill'):
+                print(f"  {kind:<13} {results[kind + ' sent']:>5} sent {results[kind + ' failed']:>5} failed")
+            if latencies:
+                print(
+                    f"  notification latency: median {statistics.median(latencies):.2f}s, max {max(latencies):.2f}s; "
+                    f"429 responses: {stats.get('429', 0)}"
+                )
+    finally:
+        server.shutdown()
@@ -0,0 +1,480 @@
+"""
+Local stand-in for the parts of the Reddit API our scripts use, so they can be measured without a network.
+
+It serves synthetic data:
+- submission listings (/r/<sub>/new, including "a+b+c" multireddits) with posts arriving in real time
+- /api/info lookups, with a share of the posts reported as deleted
+- modlog pages (/r/<sub>/about/log)
+- wiki pages and their latest revision, sidebar widgets, modmail, submitting and distinguishing posts
+- an ICS calendar feed (/calendar.ics) that honors ETag / If-None-Match and Last-Modified / If-Modified-Since
+
+Every response carries Reddit's X-Ratelimit-* headers, and requests over the limit get a 429.
+GET /__stats returns the number of calls per endpoint (and the wiki_bytes_read / wiki_bytes_written by the wiki
+requests) and POST /__reset clears them.
+
+Usage: python benchmarks/mock_reddit.py [--port 8765] [--latency-ms 0] [--posts-per-minute 60] ...
+Point praw / asyncpraw at it with a praw.ini in the working directory (see run_benchmarks.py).
+"""
+
+import argparse
+import hashlib
+import json
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Each subreddit gets a slot in the post ids so that the ids of every sub sort in creation order
+MAX_SUBREDDITS = 64
+ID_OFFSET = 36 ** 4
+
+FLAIRS = ['Discussion', 'Question', 'Meme', 'News', 'Workout', None]
+REMOVAL_REASONS = ['Rule 1: Be nice', 'Rule 2: No spam', 'Rule 3: Stay on topic', 'Rule 4: No medical advice']
+BAN_REASONS = ['Harassment: repeated', 'Spam: links', 'Ban evasion: alt account', 'Bot /u/BotDefense: spam bot']
+BAN_DURATIONS = ['permanent', '3 days', '7 days', '30 days']
+MODLOG_ACTIONS = [
+    'removelink', 'approvelink', 'removecomment', 'removecomment', 'approvecomment',
+    'addremovalreason', 'addremovalreason', 'banuser', 'editflair', 'sticky'
+]
+
+
+def to_base36(number):
+    digits = '0123456789abcdefghijklmnopqrstuvwxyz'
+    result = ''
+    while number:
+        number, remainder = divmod(number, 36)
+        result = digits[remainder] + result
+    return result or '0'
+
+
+class MockReddit:
+    """
+    The synthetic data set and the counters shared by all request handlers
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.start = time.time()
+        self.subreddits = {}
+        self.stats = Counter()
+        self.lock = threading.Lock()
+        self.window_start = time.time()
+        self.window_used = 0
+        self.wiki = {}
+        self.wiki_revisions = {}
+        self.widget_text = {}
+        self.modlog_end = args.modlog_end or self.start
+        self.calendar = self._make_calendar()
+        self.calendar_etag = hashlib.sha1(self.calendar.encode()).hexdigest()
+        self.calendar_modified = formatdate(self.start, usegmt=True)
+
+    ###############
+    # Rate limits #
+    ###############
+    def take_request(self):
+        """
+        Returns (allowed, remaining, used, reset) for the Reddit rate limit window
+        """
+        with self.lock:
+            now = time.time()
+            if now - self.window_start >= self.args.ratelimit_window:
+                self.window_start = now
+                self.window_used = 0
+            self.window_used += 1
+            reset = max(0, int(self.window_start + self.args.ratelimit_window - now))
+            remaining = max(0, self.args.ratelimit - self.window_used)
+            return self.window_used <= self.args.ratelimit, remaining, self.window_used, reset
+
+    #########
+    # Posts #
+    #########
+    def subreddit_index(self, name):
+        with self.lock:
+            return self.subreddits.setdefault(name.lower(), (len(self.subreddits) % MAX_SUBREDDITS, name))[0]
+
+    def subreddit_name(self, index):
+        for name, (sub_index, display_name) in self.subreddits.items():
+            if sub_index == index:
+                return display_name
+        return f"sub{index}"
+
+    def post_count(self):
+        """
+        Number of posts every subreddit has right now: the backlog plus the posts that arrived since the server started
+        """
+        return self.args.backlog + int((time.time() - self.start) * self.args.posts_per_minute / 60)
+
+    def post_created(self, sequence):
+        if sequence < self.args.backlog:
+            return self.start - (self.args.backlog - sequence) * self.args.backlog_spacing
+        return self.start + (sequence - self.args.backlog) * 60 / self.args.posts_per_minute
+
+    def post_key(self, sequence, sub_index):
+        return sequence * MAX_SUBREDDITS + sub_index + ID_OFFSET
+
+    def post(self, key):
+        sequence, sub_index = divmod(key - ID_OFFSET, MAX_SUBREDDITS)
+        post_id = to_base36(key)
+        subreddit_name = self.subreddit_name(sub_index)
+        deleted = self.args.deleted_ratio and (key % 1000) < self.args.deleted_ratio * 1000
+        return {
+            'kind': 't3',
+            'data': {
+                'id': post_id,
+                'name': f"t3_{post_id}",
+                'title': f"Synthetic post {sequence} in r/{subreddit_name}",
+                'author': f"user{sequence % 997}",
+                'permalink': f"/r/{subreddit_name}/comments/{post_id}/synthetic_post_{sequence}/",
+                'url': f"https://www.reddit.com/r/{subreddit_name}/comments/{post_id}/",
+                'selftext': f"Body of synthetic post {sequence}. " * 8,
+                'created_utc': self.post_created(sequence),
+                'subreddit': subreddit_name,
+                'link_flair_text': FLAIRS[sequence % len(FLAIRS)],
+                'removed_by_category': 'deleted' if deleted else None,
+                'is_self': True,
+                'num_comments': 0,
+                'score': 1
+            }
+        }
+
+    def new_listing(self, subreddit_names, limit, before=None, after=None):
+        count = self.post_count()
+        sub_indexes = sorted(self.subreddit_index(name) for name in subreddit_names)
+        newest = self.post_key(count - 1, max(sub_indexes))
+        oldest = self.post_key(0, min(sub_indexes))
+
+        def keys_descending(start):
+            key = start
+            while key >= oldest:
+                if (key - ID_OFFSET) % MAX_SUBREDDITS in sub_indexes:
+                    yield key
+                key -= 1
+
+        if before is not None:
+            before_key = int(before.split('_')[-1], 36)
+            keys = []
+            key = before_key + 1
+            while key <= newest and len(keys) < limit:
+                if (key - ID_OFFSET) % MAX_SUBREDDITS in sub_indexes:
+                    keys.append(key)
+                key += 1
+            keys.reverse()
+        else:
+            start = int(after.split('_')[-1], 36) - 1 if after is not None else newest
+            keys = []
+            for key in keys_descending(start):
+                keys.append(key)
+                if len(keys) >= limit:
+                    break
+        children = [self.post(key) for key in keys]
+        last = children[-1]['data']['name'] if len(children) == limit else None
+        return listing(children, after=last)
+
+    ##########
+    # Modlog #
+    ##########
+    def modlog_entry(self, index, subreddit_name):
+        action = MODLOG_ACTIONS[(index * 7) % len(MODLOG_ACTIONS)]
+        target_kind = 't3' if action.endswith('link') or index % 3 == 0 else 't1'
+        entry = {
+            'id': f"ModAction_{subreddit_name}_{index:08d}",
+            'action': action,
+            'created_utc': self.modlog_end - index * self.args.modlog_spacing,
+            'mod': f"mod{index % 5}",
+            'mod_id36': to_base36(index % 5 + 1000),
+            'subreddit': subreddit_name,
+            'target_fullname': f"{target_kind}_{to_base36(ID_OFFSET + index // 3)}",
+            'target_author': f"user{index % 997}",
+            'description': None,
+            'details': None
+        }
+        if action == 'addremovalreason':
+            entry['description'] = REMOVAL_REASONS[index % len(REMOVAL_REASONS)]
+        elif action == 'banuser':
+            entry['description'] = BAN_REASONS[index % len(BAN_REASONS)]
+            entry['details'] = BAN_DURATIONS[index % len(BAN_DURATIONS)]
+        return {'kind': 'modaction', 'data': entry}
+
+    def modlog_listing(self, subreddit_name, limit, after=None, action=None):
+        index = int(after.split('_')[-1]) + 1 if after else 0
+        children = []
+        while index < self.args.modlog_entries and len(children) < limit:
+            if action is None or MODLOG_ACTIONS[(index * 7) % len(MODLOG_ACTIONS)] == action:
+                children.append(self.modlog_entry(index, subreddit_name))
+            index += 1
+        last = children[-1]['data']['id'] if children and index < self.args.modlog_entries else None
+        return listing(children, after=last)
+
+    ########
+    # Wiki #
+    ########
+    def wiki_page(self, subreddit_name, page_name):
+        """
+        Returns (content, latest revision ID) of a wiki page. Pages never edited have some placeholder content.
+        """
+        key = (subreddit_name.lower(), page_name)
+        content = self.wiki.get(key, f"# {page_name}\n\nExisting content.\n")
+        return content, self.wiki_revisions.get(key, hashlib.md5(content.encode()).hexdigest())
+
+    ############
+    # Calendar #
+    ############
+    def _make_calendar(self):
+        today = datetime.now(timezone.utc).replace(hour=18, minute=0, second=0, microsecond=0)
+        lines = ['BEGIN:VCALENDAR', 'VERSION:2.0', 'PRODID:-//mock_reddit//EN']
+        for i in range(self.args.events):
+            begin = today - timedelta(days=self.args.events - i - 30)
+            lines += [
+                'BEGIN:VEVENT',
+                f"UID:event-{i}@mock_reddit",
+                f"DTSTAMP:{begin.strftime('%Y%m%dT%H%M%SZ')}",
+                f"DTSTART:{begin.strftime('%Y%m%dT%H%M%SZ')}",
+                f"DTEND:{(begin + timedelta(hours=1)).strftime('%Y%m%dT%H%M%SZ')}",
+                f"SUMMARY:Synthetic event {i}"
+            ]
+            if i % 50 == 0:
+                lines.append('RRULE:FREQ=WEEKLY;COUNT=52')
+            lines.append('END:VEVENT')
+        lines.append('END:VCALENDAR')
+        return '\r\n'.join(lines) + '\r\n'
+
+
+def listing(children, after=None):
+    return {'kind': 'Listing', 'data': {'after': after, 'before': None, 'dist': len(children), 'children': children}}
+
+
+class MockRedditHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    mock = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_PUT(self):
+        self._handle('PUT')
+
+    def _handle(self, method):
+        url = urlparse(self.path)
+        path = url.path.rstrip('/') or '/'
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length).decode() if length else ''
+        form = {key: values[-1] for key, values in parse_qs(body).items()}
+
+        if path == '/__stats':
+            return self._send_json(200, dict(self.mock.stats))
+        if path == '/__reset':
+            self.mock.stats.clear()
+            return self._send_json(200, {})
+
+        if self.mock.args.latency_ms:
+            time.sleep(self.mock.args.latency_ms / 1000)
+
+        if path == '/calendar.ics':
+            return self._send_calendar()
+
+        allowed, remaining, used, reset = self.mock.take_request()
+        headers = {
+            'x-ratelimit-remaining': f"{remaining:.1f}",
+            'x-ratelimit-used': str(used),
+            'x-ratelimit-reset': str(reset)
+        }
+        if not allowed:
+            self.mock.stats['429'] += 1
+            return self._send_json(429, {'message': 'Too Many Requests', 'error': 429}, headers)
+
+        endpoint, payload = self._route(method, path, query, form)
+        self.mock.stats[endpoint] += 1
+        if payload is None:
+            return self._send_json(404, {'message': 'Not Found', 'error': 404}, headers)
+        self._send_json(200, payload, headers)
+
+    def _route(self, method, path, query, form):
+        mock = self.mock
+        # Like Reddit, never return more than 100 items per listing page
+        limit = min(int(query.get('limit', 25)), 100)
+
+        if path == '/api/v1/access_token':
+            return 'access_token', {'access_token': 'mock-token', 'token_type': 'bearer', 'expires_in': 86400, 'scope': '*'}
+
+        if path == '/api/info':
+            keys = [int(fullname.split('_')[-1], 36) for fullname in query.get('id', '').split(',') if fullname]
+            return 'info', listing([mock.post(key) for key in keys])
+
+        match = re.fullmatch(r'/r/([^/]+)/new', path)
+        if match:
+            return 'new', mock.new_listing(match.group(1).split('+'), limit, query.get('before'), query.get('after'))
+
+        match = re.fullmatch(r'/r/([^/]+)/about/log', path)
+        if match:
+            return 'modlog', mock.modlog_listing(match.group(1), limit, query.get('after'), query.get('type'))
+
+        match = re.fullmatch(r'/r/([^/]+)/api/wiki/edit', path)
+        if match:
+            key = (match.group(1).lower(), form.get('page'))
+            mock.wiki[key] = form.get('content', '')
+            mock.wiki_revisions[key] = str(uuid.uuid4())
+            mock.stats['wiki_bytes_written'] += len(mock.wiki[key].encode())
+            return 'wiki_edit', {}
+
+        match = re.fullmatch(r'/r/([^/]+)/wiki/revisions/(.+)', path)
+        if match:
+            content, revision_id = mock.wiki_page(match.group(1), match.group(2))
+            return 'wiki_revisions', listing([{
+                'id': revision_id,
+                'page': match.group(2),
+                'reason': None,
+                'timestamp': int(time.time()),
+                'revision_hidden': False,
+                'author': {'kind': 't2', 'data': {'name': 'mod0'}}
+            }])
+
+        match = re.fullmatch(r'/r/([^/]+)/wiki/(.+)', path)
+        if match:
+            content, revision_id = mock.wiki_page(match.group(1), match.group(2))
+            mock.stats['wiki_bytes_read'] += len(content.encode())
+            return 'wiki_page', {
+                'kind': 'wikipage',
+                'data': {
+                    'content_md': content,
+                    'content_html': '',
+                    'may_revise': True,
+                    'revision_by': {'kind': 't2', 'data': {'name': 'mod0'}},
+                    'revision_date': int(time.time()),
+                    'revision_id': revision_id
+                }
+            }
+
+        match = re.fullmatch(r'/r/([^/]+)/api/widgets', path)
+        if match:
+            return 'widgets', self._widgets(match.group(1))
+
+        match = re.fullmatch(r'/r/([^/]+)/api/widget/([^/]+)', path)
+        if match:
+            widget = json.loads(form.get('json', '{}'))
+            mock.widget_text[(match.group(1).lower(), match.group(2))] = widget.get('text', '')
+            return 'widget_update', dict(widget, id=match.group(2), kind='textarea')
+
+        if path == '/api/compose':
+            return 'modmail', {'json': {'errors': []}}
+
+        if path == '/api/submit':
+            post_id = to_base36(ID_OFFSET * 36 + mock.stats['submit'])
+            return 'submit', {'json': {'errors': [], 'data': {
+                'id': post_id, 'name': f"t3_{post_id}", 'url': f"https://www.reddit.com/comments/{post_id}/"
+            }}}
+
+        if path.startswith('/api/distinguish'):
+            return 'distinguish', {'json': {'errors': [], 'data': {'things': []}}}
+
+        match = re.fullmatch(r'/comments/([^/]+)', path)
+        if match:
+            post = mock.post(int(match.group(1), 36))
+            post['data']['id'] = match.group(1)
+            post['data']['name'] = f"t3_{match.group(1)}"
+            post['data']['permalink'] = f"/comments/{match.group(1)}/"
+            return 'comments', [listing([post]), listing([])]
+
+        match = re.fullmatch(r'/r/([^/]+)/about', path)
+        if match:
+            return 'about', {'kind': 't5', 'data': {'display_name': match.group(1), 'name': 't5_mock', 'id': 'mock'}}
+
+        return path, None
+
+    def _widgets(self, subreddit_name):
+        items = {}
+        order = []
+        for i, title in enumerate(['Rules', 'Links', 'Upcoming Events']):
+            widget_id = f"widget_{i}{subreddit_name.lower()}"
+            items[widget_id] = {
+                'id': widget_id,
+                'kind': 'textarea',
+                'shortName': title,
+                'text': self.mock.widget_text.get((subreddit_name.lower(), widget_id), ''),
+                'styles': {'backgroundColor': '', 'headerColor': ''}
+            }
+            order.append(widget_id)
+        return {
+            'items': items,
+            'layout': {'idCardWidget': None, 'moderatorWidget': None, 'sidebar': {'order': order}, 'topbar': {'order': []}}
+        }
+
+    def _send_calendar(self):
+        self.mock.stats['calendar'] += 1
+        if (
+            self.headers.get('If-None-Match') == self.mock.calendar_etag
+            or self.headers.get('If-Modified-Since') == self.mock.calendar_modified
+        ):
+            self.mock.stats['calendar_304'] += 1
+            self.send_response(304)
+            self.send_header('ETag', self.mock.calendar_etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = self.mock.calendar.encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/calendar')
+        self.send_header('ETag', self.mock.calendar_etag)
+        self.send_header('Last-Modified', self.mock.calendar_modified)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def add_arguments(parser):
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency-ms', type=float, default=0, help='Delay added to every response')
+    parser.add_argument('--ratelimit', type=int, default=600, help='Requests allowed per rate limit window')
+    parser.add_argument('--ratelimit-window', type=int, default=600, help='Length of the rate limit window in seconds')
+    parser.add_argument('--posts-per-minute', type=float, default=60, help='New posts per subreddit per minute')
+    parser.add_argument('--backlog', type=int, default=2000, help='Posts per subreddit that exist before the server starts')
+    parser.add_argument('--backlog-spacing', type=float, default=600, help='Seconds between backlog posts')
+    parser.add_argument('--deleted-ratio', type=float, default=0.02, help='Share of posts that /api/info reports as deleted')
+    parser.add_argument('--modlog-entries', type=int, default=20000)
+    parser.add_argument('--modlog-spacing', type=float, default=300, help='Seconds between modlog entries')
+    parser.add_argument('--modlog-end', type=float, default=None, help='Timestamp of the newest modlog entry (default: now)')
+    parser.add_argument('--events', type=int, default=1000, help='Events in the ICS calendar')
+
+
+def start_server(args):
+    """
+    Starts the mock server on a background thread and returns it. Call shutdown() to stop it.
+    """
+    handler = type('Handler', (MockRedditHandler,), {'mock': MockReddit(args)})
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Local mock of the Reddit API')
+    add_arguments(parser)
+    args = parser.parse_args()
+    server = start_server(args)
+    print(f"Mock Reddit API listening on http://127.0.0.1:{args.port}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,397 @@
+"""
+Runs each script against the local mock Reddit API (mock_reddit.py) and reports, per script:
+wall time, peak RSS, API calls made, units of work done, throughput and API calls per unit of work.
+
+Each script runs in its own temporary directory holding a local_config.json / bot_config.json with fake
+credentials and a praw.ini that points praw and asyncpraw at the mock server.
+
+Usage: python benchmarks/run_benchmarks.py [--scripts report_deleted_posts,flair_report] [--duration 20] [mock options]
+
+praw and asyncpraw pace their requests by the X-Ratelimit-* headers, so with the default (Reddit-like) limit of
+600 requests per 600 seconds, long modlog walks take about as long as they would against Reddit.
+Pass e.g. --ratelimit 1000000 to measure the scripts without that pacing.
+"""
+
+import argparse
+import json
+import os
+import signal
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.parse
+import urllib.request
+from datetime import datetime
+
+import mock_reddit
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SUBREDDIT_NAME = 'benchsub'
+
+# How many backlog posts the gap benchmark moves the checkpoint back, i.e. posts missed while the bot was down
+GAP_POSTS = 250
+
+
+def write_config(run_dir, port, extra_config):
+    base_url = f"http://127.0.0.1:{port}"
+    config = {
+        'reddit_client_id': 'mock-client-id',
+        'reddit_client_secret': 'mock-client-secret',
+        'reddit_user_agent': 'benchmark by u/mock',
+        'reddit_username': 'mock',
+        'reddit_password': 'mock',
+        'app_client_id': 'mock-client-id',
+        'app_client_secret': 'mock-client-secret',
+        'app_user_agent': 'benchmark by u/mock',
+        'app_token': 'mock-refresh-token',
+        'monitored_subreddit': SUBREDDIT_NAME,
+        'subreddit_name': SUBREDDIT_NAME,
+        'subreddits': [SUBREDDIT_NAME],
+        'post_limit': 1000,
+        'wiki_page': 'flair-report',
+        'ical_url': f"{base_url}/calendar.ics",
+        'check_interval': 1
+    }
+    config.update(extra_config)
+    for file_name in ('local_config.json', 'bot_config.json'):
+        with open(os.path.join(run_dir, file_name), 'w') as config_file:
+            json.dump(config, config_file)
+    with open(os.path.join(run_dir, 'praw.ini'), 'w') as ini_file:
+        ini_file.write(
+            '[DEFAULT]\n'
+            f"oauth_url={base_url}\n"
+            f"reddit_url={base_url}\n"
+            f"short_url={base_url}\n"
+            'check_for_updates=False\n'
+        )
+
+
+def fetch_stats(port, reset=False):
+    url = f"http://127.0.0.1:{port}/{'__reset' if reset else '__stats'}"
+    with urllib.request.urlopen(urllib.request.Request(url, method='POST' if reset else 'GET')) as response:
+        return json.loads(response.read())
+
+
+class ScriptFailed(Exception):
+
+    def __init__(self, script, returncode, output):
+        super().__init__(f"{script} exited with status {returncode}")
+        self.output = output
+
+
+def run_script(script, run_dir, stdin_text=None, duration=None, script_args=()):
+    """
+    Runs a script to completion (or for duration seconds, then sends CTRL-C). Returns (wall time, peak RSS in MB, output).
+    Raises ScriptFailed if the script exits with an error (before the CTRL-C, for a timed run).
+    """
+    env = dict(os.environ, PYTHONPATH=REPO_DIR, PYTHONUNBUFFERED='1')
+    log_path = os.path.join(run_dir, 'output.log')
+    with open(log_path, 'w') as log_file:
+        start = time.perf_counter()
+        process = subprocess.Popen(
+            [sys.executable, os.path.join(REPO_DIR, script), *script_args],
+            cwd=run_dir,
+            env=env,
+            stdin=subprocess.PIPE,
+            stdout=log_file,
+            stderr=subprocess.STDOUT
+        )
+        if stdin_text:
+            process.stdin.write(stdin_text.encode())
+        process.stdin.close()
+        interrupted = False
+        if duration is not None:
+            time.sleep(duration)
+
+            # A script that already exited was not stopped by us, so its exit status counts
+            interrupted = os.waitid(os.P_PID, process.pid, os.WEXITED | os.WNOHANG | os.WNOWAIT) is None
+            if interrupted:
+                process.send_signal(signal.SIGINT)
+        _, status, rusage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        wall_time = time.perf_counter() - start
+    with open(log_path) as log_file:
+        output = log_file.read()
+    if process.returncode != 0 and not interrupted:
+        raise ScriptFailed(script, process.returncode, output)
+
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak_rss_mb = rusage.ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+    return wall_time, peak_rss_mb, output
+
+
+def count_saved_posts(run_dir):
+    db_file = os.path.join(run_dir, 'posts.db')
+    if not os.path.exists(db_file):
+        return 0
+    conn = sqlite3.connect(db_file)
+    count = conn.execute('SELECT COUNT(*) FROM posts').fetchone()[0]
+    conn.close()
+    return count
+
+
+##############
+# Benchmarks #
+##############
+def bench_report_deleted_posts(run_dir, args):
+    wall_time, peak_rss_mb, output = run_script('report_deleted_posts.py', run_dir, duration=args.duration)
+    return wall_time, peak_rss_mb, count_saved_posts(run_dir), 'posts saved', output
+
+
+def bench_report_deleted_posts_restart(run_dir, args):
+    """
+    Runs report_deleted_posts.py, stops it for as long as it ran, then starts it again. The API calls and the posts
+    saved are those of the second run, which should only fetch what was submitted while the bot was down.
+    """
+    run_script('report_deleted_posts.py', run_dir, duration=args.duration / 2)
+    saved_before = count_saved_posts(run_dir)
+    time.sleep(args.duration / 2)
+    fetch_stats(args.port, reset=True)
+    wall_time, peak_rss_mb, output = run_script('report_deleted_posts.py', run_dir, duration=args.duration / 2)
+    return wall_time, peak_rss_mb, count_saved_posts(run_dir) - saved_before, 'posts saved', output
+
+
+def bench_report_deleted_posts_gap(run_dir, args):
+    """
+    Same as report_deleted_posts_restart, with the bot down for longer than its first listing covers: the checkpoint
+    is moved GAP_POSTS backlog posts back between the runs, so the second run has to page through the gap
+    """
+    run_script('report_deleted_posts.py', run_dir, duration=args.duration / 2)
+    saved_before = count_saved_posts(run_dir)
+    checkpoint_path = os.path.join(run_dir, 'stream_checkpoints.json')
+    with open(checkpoint_path) as checkpoint_file:
+        checkpoints = json.load(checkpoint_file)
+    for checkpoint in checkpoints.values():
+        checkpoint['created_utc'] -= GAP_POSTS * args.backlog_spacing
+    with open(checkpoint_path, 'w') as checkpoint_file:
+        json.dump(checkpoints, checkpoint_file)
+    fetch_stats(args.port, reset=True)
+    wall_time, peak_rss_mb, output = run_script('report_deleted_posts.py', run_dir, duration=args.duration / 2)
+    return wall_time, peak_rss_mb, count_saved_posts(run_dir) - saved_before, 'posts saved', output
+
+
+def bench_report_deleted_posts_workers(run_dir, args):
+    """
+    Runs report_deleted_posts.py as a supervisor with 4 worker processes, monitoring 8 subreddits
+    """
+    config_path = os.path.join(run_dir, 'local_config.json')
+    with open(config_path) as config_file:
+        config = json.load(config_file)
+    config['subreddits'] = [f"{SUBREDDIT_NAME}{index}" for index in range(8)]
+    config.setdefault('worker_processes', 4)
+    with open(config_path, 'w') as config_file:
+        json.dump(config, config_file)
+    wall_time, peak_rss_mb, output = run_script('report_deleted_posts.py', run_dir, duration=args.duration)
+    return wall_time, peak_rss_mb, count_saved_posts(run_dir), 'posts saved', output
+
+
+def bench_mod_transparency_report(run_dir, args):
+    wall_time, peak_rss_mb, output = run_script('mod_transparency_report.py', run_dir)
+    return wall_time, peak_rss_mb, args.modlog_entries, 'modlog entries', output
+
+
+def bench_mod_transparency_report_scan(run_dir, args):
+
+    # Straight from Reddit (no archive), compared with the two full walks of the log (all actions, then bans) the
+    # report used to make
+    config_path = os.path.join(run_dir, 'local_config.json')
+    with open(config_path) as config_file:
+        config = json.load(config_file)
+    config['modlog_archive_file'] = None
+    with open(config_path, 'w') as config_file:
+        json.dump(config, config_file)
+    wall_time, peak_rss_mb, output = run_script('mod_transparency_report.py', run_dir)
+    bans = sum(
+        1 for index in range(args.modlog_entries)
+        if mock_reddit.MODLOG_ACTIONS[(index * 7) % len(mock_reddit.MODLOG_ACTIONS)] == 'banuser'
+    )
+    full_walks = -(-args.modlog_entries // 100) + -(-bans // 100)
+    print(f"mod_transparency_report_scan: {fetch_stats(args.port).get('modlog', 0)} modlog requests, {full_walks} for two full walks")
+    return wall_time, peak_rss_mb, args.modlog_entries, 'modlog entries', output
+
+
+def bench_mod_transparency_report_batch(run_dir, args):
+
+    # Monthly and quarterly reports for 4 subreddits, each modlog read once
+    config_path = os.path.join(run_dir, 'local_config.json')
+    with open(config_path) as config_file:
+        config = json.load(config_file)
+    config.setdefault('transparency_report_jobs', [
+        {'subreddit': f"{SUBREDDIT_NAME}{index}", 'periods': ['2022-06', '2022-07', '2022-Q3']}
+        for index in range(4)
+    ])
+    with open(config_path, 'w') as config_file:
+        json.dump(config, config_file)
+    wall_time, peak_rss_mb, output = run_script('mod_transparency_report.py', run_dir, script_args=['--batch'])
+    reports = sum(len(job['periods']) for job in config['transparency_report_jobs'])
+    return wall_time, peak_rss_mb, reports, 'reports', output
+
+
+def bench_flair_report(run_dir, args):
+    year_month = datetime.now().strftime('%Y-%m')
+    wall_time, peak_rss_mb, output = run_script('flair_report.py', run_dir, stdin_text=f"{year_month}\nn\n")
+    return wall_time, peak_rss_mb, 1000, 'posts scanned', output
+
+
+def bench_flair_report_batch(run_dir, args):
+
+    # One job per subreddit, written into the config before the run
+    year_month = datetime.now().strftime('%Y-%m')
+    subreddits = [f"{SUBREDDIT_NAME}{index}" for index in range(8)]
+    config_path = os.path.join(run_dir, 'bot_config.json')
+    with open(config_path) as config_file:
+        config = json.load(config_file)
+    config.setdefault('flair_report_jobs', [
+        {'subreddit': subreddit, 'months': [year_month], 'wiki_page': 'flair-report', 'overwrite': False}
+        for subreddit in subreddits
+    ])
+    with open(config_path, 'w') as config_file:
+        json.dump(config, config_file)
+    wall_time, peak_rss_mb, output = run_script('flair_report.py', run_dir, script_args=['--batch'])
+    return wall_time, peak_rss_mb, len(config['flair_report_jobs']), 'jobs', output
+
+
+def bench_flair_report_batch_rollup(run_dir, args):
+
+    # The first run fills the flair rollup and writes the wiki pages, the second one is measured: it only reads the
+    # posts submitted since, and leaves the wiki pages alone unless the counts changed
+    bench_flair_report_batch(run_dir, args)
+    fetch_stats(args.port, reset=True)
+    return bench_flair_report_batch(run_dir, args)
+
+
+def seed_wiki(port, subreddit_name, page_name, content):
+    data = urllib.parse.urlencode({'page': page_name, 'content': content}).encode()
+    url = f"http://127.0.0.1:{port}/r/{subreddit_name}/api/wiki/edit"
+    urllib.request.urlopen(urllib.request.Request(url, data=data)).close()
+
+
+def bench_flair_report_batch_history(run_dir, args):
+
+    # Each flair report page starts with 5 years of monthly reports on it. The first run moves them to their year
+    # pages, the second one is measured: only this year's page changed (new posts came in), so it is the only edit.
+    today = datetime.now()
+    subreddits = [f"{SUBREDDIT_NAME}history{index}" for index in range(8)]
+    history_md = '\n---\n'.join(
+        f"# Posts by flair for {datetime(year, month, 1).strftime('%B, %Y')}\n**Total posts**: 2000  \n\n"
+        '| **Flair** | **Posts** |\n|:--|:--:|\n' + ''.join(f"|Flair {flair}|100|\n" for flair in range(20))
+        for year in range(today.year - 1, today.year - 6, -1) for month in range(12, 0, -1)
+    )
+    for subreddit in subreddits:
+        seed_wiki(args.port, subreddit, 'flair-report', history_md)
+
+    config_path = os.path.join(run_dir, 'bot_config.json')
+    with open(config_path) as config_file:
+        config = json.load(config_file)
+    config['flair_report_jobs'] = [
+        {'subreddit': subreddit, 'months': [today.strftime('%Y-%m')], 'wiki_page': 'flair-report'}
+        for subreddit in subreddits
+    ]
+    with open(config_path, 'w') as config_file:
+        json.dump(config, config_file)
+    run_script('flair_report.py', run_dir, script_args=['--batch'])
+    time.sleep(2)
+    fetch_stats(args.port, reset=True)
+    wall_time, peak_rss_mb, output = run_script('flair_report.py', run_dir, script_args=['--batch'])
+    return wall_time, peak_rss_mb, len(subreddits), 'jobs', output
+
+
+def bench_calendar_widget(run_dir, args):
+    wall_time, peak_rss_mb, output = run_script('calendar_widget.py', run_dir)
+    return wall_time, peak_rss_mb, args.events, 'calendar events', output
+
+
+def bench_calendar_widget_cached(run_dir, args):
+
+    # The first run fills the cache, the second one is measured
+    run_script('calendar_widget.py', run_dir)
+    wall_time, peak_rss_mb, output = run_script('calendar_widget.py', run_dir)
+    return wall_time, peak_rss_mb, args.events, 'calendar events', output
+
+
+def bench_calendar_widget_daemon(run_dir, args):
+
+    # 8 subreddits sharing 2 calendars, checked every second
+    base_url = f"http://127.0.0.1:{args.port}"
+    config_path = os.path.join(run_dir, 'local_config.json')
+    with open(config_path) as config_file:
+        config = json.load(config_file)
+    config.setdefault('calendar_widgets', [
+        {'subreddit': f"{SUBREDDIT_NAME}{index}", 'widget_title': 'Upcoming Events', 'ical_url': f"{base_url}/calendar.ics?calendar={index % 2}", 'days': 30}
+        for index in range(8)
+    ])
+    config.setdefault('calendar_widget_interval', 1)
+    with open(config_path, 'w') as config_file:
+        json.dump(config, config_file)
+    wall_time, peak_rss_mb, output = run_script('calendar_widget.py', run_dir, duration=args.duration, script_args=['--daemon'])
+    return wall_time, peak_rss_mb, output.count('Cycle done'), 'update cycles', output
+
+
+BENCHMARKS = {
+    'report_deleted_posts': bench_report_deleted_posts,
+    'report_deleted_posts_restart': bench_report_deleted_posts_restart,
+    'report_deleted_posts_gap': bench_report_deleted_posts_gap,
+    'report_deleted_posts_workers': bench_report_deleted_posts_workers,
+    'mod_transparency_report': bench_mod_transparency_report,
+    'mod_transparency_report_scan': bench_mod_transparency_report_scan,
+    'mod_transparency_report_batch': bench_mod_transparency_report_batch,
+    'flair_report': bench_flair_report,
+    'flair_report_batch': bench_flair_report_batch,
+    'flair_report_batch_rollup': bench_flair_report_batch_rollup,
+    'flair_report_batch_history': bench_flair_report_batch_history,
+    'calendar_widget': bench_calendar_widget,
+    'calendar_widget_cached': bench_calendar_widget_cached,
+    'calendar_widget_daemon': bench_calendar_widget_daemon
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the scripts against the mock Reddit API')
+    mock_reddit.add_arguments(parser)
+    parser.add_argument('--scripts', default=','.join(BENCHMARKS), help='Comma-separated list of scripts to run')
+    parser.add_argument('--duration', type=float, default=20, help='Seconds to run the long-running scripts for')
+    parser.add_argument('--config', default='{}', help='JSON object merged into the generated config files')
+    parser.add_argument('--verbose', action='store_true', help='Print the output of each script')
+    args = parser.parse_args()
+    if args.modlog_end is None:
+
+        # mod_transparency_report.py reports on July 2022, so make the modlog cover it
+        args.modlog_end = datetime(2022, 8, 15).timestamp()
+
+    server = mock_reddit.start_server(args)
+    results = []
+    failures = []
+    try:
+        for name in args.scripts.split(','):
+            with tempfile.TemporaryDirectory() as run_dir:
+                write_config(run_dir, args.port, json.loads(args.config))
+                fetch_stats(args.port, reset=True)
+                try:
+                    wall_time, peak_rss_mb, units, unit_name, output = BENCHMARKS[name](run_dir, args)
+                except ScriptFailed as e:
+                    print(f"===== {name} FAILED: {str(e)} =====\n{e.output}")
+                    failures.append(name)
+                    continue
+                stats = fetch_stats(args.port)
+                api_calls = sum(
+                    count for endpoint, count in stats.items()
+                    if endpoint not in ('calendar', 'calendar_304') and not endpoint.startswith('wiki_bytes')
+                )
+                if args.verbose:
+                    print(f"===== {name} =====\n{output}")
+                results.append((name, wall_time, peak_rss_mb, api_calls, units, unit_name, stats))
+    finally:
+        server.shutdown()
+
+    print(f"{'script':<25} {'wall':>8} {'peak RSS':>9} {'API calls':>9} {'work':>22} {'work/s':>9} {'calls/unit':>10}")
+    for name, wall_time, peak_rss_mb, api_calls, units, unit_name, stats in results:
+        print(
+            f"{name:<25} {wall_time:>7.2f}s {peak_rss_mb:>7.1f}MB {api_calls:>9} {f'{units} {unit_name}':>22} "
+            f"{units / wall_time:>9.1f} {api_calls / max(units, 1):>10.4f}"
+        )
+        print(f"{'':<25} {json.dumps(stats, sort_keys=True)}")
+    for name in failures:
+        print(f"{name:<25} FAILED")
+    sys.exit(1 if failures else 0)
@@ -1,19 +1,170 @@
+"""
+Logging for the bots and report scripts.
+
+get_bot_logger() sets the logger up once per process, however many times it is called. Records go through a
+QueueHandler to a QueueListener thread that formats and writes them, so logging never blocks the event loop
+on a slow stdout. The thread is only started by the first record, so importing a module that gets the logger
+has no side effects. Lines are JSON by default; set BOT_LOG_FORMAT=text for the old human-readable format, and
+BOT_LOG_LEVEL=DEBUG to see every timing span.
+
+span() times a block of code, as a context manager or a decorator, sync or async:
+
+    with span('save_post', subreddit=subreddit_name):
+        POST_STORE.save(...)
+
+    @span('notify')
+    async def notify_deleted_post(...):
+
+Each span is logged at DEBUG level with its duration, and added to per-name totals that span_summary() reports.
+"""
+
+import atexit
+import functools
+import inspect
+import json
 import logging
+import logging.handlers
+import os
+import queue
+import time
+
 LOGGER_NAME = 'elizabot'
+LOG_FORMAT = os.environ.get('BOT_LOG_FORMAT', 'json')
+LOG_LEVEL = os.environ.get('BOT_LOG_LEVEL', 'INFO')
 
-def get_bot_logger():
+# Span name -> [count, total seconds, max seconds]
+SPAN_STATS = {}
 
-    # Define logger format string
-    logger_format_string = '[%(funcName)s] [%(lineno)d] [%(levelname)s]: %(message)s'
+_listener = None
 
-    # Initialize the logger
-    logger_handler = logging.StreamHandler()
-    logger_handler.setLevel(logging.DEBUG)
-    logger_formatter = logging.Formatter(logger_format_string)
-    logger_handler.setFormatter(logger_formatter) 
+
+class _StartingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Starts the listener thread when the first record is logged
+    """
+
+    def emit(self, record):
+        if _listener._thread is None:
+            _listener.start()
+            atexit.register(_listener.stop)
+        super().emit(record)
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line, with the span fields (or any other extra=... fields) included
+    """
+
+    STANDARD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+
+    def format(self, record):
+        line = {
+            'time': round(record.created, 3),
+            'level': record.levelname,
+            'func': record.funcName,
+            'line': record.lineno,
+            'message': record.getMessage()
+        }
+        for key, value in vars(record).items():
+            if key not in self.STANDARD_ATTRIBUTES:
+                line[key] = value
+        if record.exc_info:
+            line['exception'] = self.formatException(record.exc_info)
+        return json.dumps(line, default=str)
+
+
+def get_bot_logger():
+    """
+    Returns the bot logger, setting it up on the first call only
+    """
+    global _listener
     logger = logging.getLogger(LOGGER_NAME)
-    logger.addHandler(logger_handler)
-    logger.setLevel(logging.DEBUG)
+    if _listener is not None:
+        return logger
+
+    # Define logger format
+    logger_handler = logging.StreamHandler()
+    if LOG_FORMAT == 'text':
+        logger_handler.setFormatter(logging.Formatter('[%(funcName)s] [%(lineno)d] [%(levelname)s]: %(message)s'))
+    else:
+        logger_handler.setFormatter(JsonFormatter())
+
+    # The listener thread does the formatting and writing, the callers only put records on the queue
+    log_queue = queue.SimpleQueue()
+    _listener = logging.handlers.QueueListener(log_queue, logger_handler)
+    logger.addHandler(_StartingQueueHandler(log_queue))
+    logger.setLevel(LOG_LEVEL)
+    logger.propagate = False
 
     return logger
 
+
+class span:
+    """
+    Times a block of code or a function (sync or async) and records the duration under the given name
+
+    Parameters
+    ----------
+    name : str
+        What is being timed, e.g. 'reddit_request' or 'save_post'
+    fields : (optional)
+        Extra fields to log with the duration, e.g. subreddit='orangetheory'
+    """
+
+    def __init__(self, name: str, **fields):
+        self.name = name
+        self.fields = fields
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        record_span(self.name, time.perf_counter() - self.start, failed=exc_type is not None, **self.fields)
+        return False
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        return self.__exit__(exc_type, exc_value, traceback)
+
+    def __call__(self, function):
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def timed(*args, **kwargs):
+                with span(self.name, **self.fields):
+                    return await function(*args, **kwargs)
+        else:
+            @functools.wraps(function)
+            def timed(*args, **kwargs):
+                with span(self.name, **self.fields):
+                    return function(*args, **kwargs)
+        return timed
+
+
+def record_span(name: str, seconds: float, failed: bool = False, **fields):
+    stats = SPAN_STATS.get(name)
+    if stats is None:
+        stats = SPAN_STATS[name] = [0, 0.0, 0.0]
+    stats[0] += 1
+    stats[1] += seconds
+    stats[2] = max(stats[2], seconds)
+    logger = logging.getLogger(LOGGER_NAME)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(
+            f"{name} took {seconds * 1000:.1f}ms",
+            extra=dict(fields, span=name, duration_ms=round(seconds * 1000, 3), failed=failed),
+            stacklevel=3
+        )
+
+
+def span_summary() -> str:
+    """
+    Returns the count, mean and max duration of each span name recorded so far
+    """
+    return '; '.join(
+        f"{name}: {count} x {total / count * 1000:.1f}ms (max {longest * 1000:.1f}ms)"
+        for name, (count, total, longest) in sorted(SPAN_STATS.items())
+    )
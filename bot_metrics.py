@@ -0,0 +1,185 @@
+"""
+Prometheus-style metrics for the long-running bots, served over HTTP from the bot's own event loop.
+
+Metrics are registered on a MetricsRegistry, updated by the bot as it works, and rendered in the Prometheus text
+format when /metrics is requested:
+
+    METRICS = MetricsRegistry()
+    INGESTION_LAG = METRICS.histogram('ingestion_lag_seconds', 'Time from a post being created to it being saved')
+    METRICS.gauge('recheck_queue_depth', 'Posts waiting to be re-checked', lambda: len(scheduler))
+    ...
+    INGESTION_LAG.observe(time.time() - post.created_utc)
+    ...
+    await serve_metrics(METRICS, port=9100)
+
+Gauges take a function that is called on every scrape, so values that are cheap to read but change all the time
+(queue lengths, the size of the post store) do not have to be pushed from the hot path.
+"""
+
+import asyncio
+from bisect import bisect_left
+
+from bot_logger import get_bot_logger
+
+# Upper bounds (in seconds) of the histogram buckets: from one second to a day
+DEFAULT_BUCKETS = (1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600, 3 * 3600, 6 * 3600, 24 * 3600)
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in labels.items()) + '}'
+
+
+def _format_value(value) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+
+    def samples(self):
+        """
+        Yields (sample name, labels, value) for each line of the metric
+        """
+        raise NotImplementedError
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        for sample_name, labels, value in self.samples():
+            lines.append(f"{sample_name}{_format_labels(labels)} {_format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name: str, help_text: str):
+        super().__init__(name, help_text)
+        self.value = 0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def samples(self):
+        yield self.name, {}, self.value
+
+
+class Gauge(Metric):
+    """
+    A value read from a function on every scrape. The function may also return a {label value: value} dict,
+    which is rendered as one sample per label value (with the label named by the label parameter).
+    """
+    kind = 'gauge'
+
+    def __init__(self, name: str, help_text: str, function, label: str = None):
+        super().__init__(name, help_text)
+        self.function = function
+        self.label = label
+
+    def samples(self):
+        value = self.function()
+        if isinstance(value, dict):
+            for label_value, sample_value in value.items():
+                yield self.name, {self.label: label_value}, sample_value
+        elif value is not None:
+            yield self.name, {}, value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, help_text: str, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text)
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)  # the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self):
+        cumulative = 0
+        for upper_bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            cumulative += count
+            yield self.name + '_bucket', {'le': _format_value(upper_bound)}, cumulative
+        yield self.name + '_sum', {}, self.sum
+        yield self.name + '_count', {}, self.count
+
+
+class MetricsRegistry:
+
+    def __init__(self, prefix: str = ''):
+        self.prefix = prefix
+        self.metrics = {}
+
+    def _register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help_text: str) -> Counter:
+        return self._register(Counter(self.prefix + name, help_text))
+
+    def gauge(self, name: str, help_text: str, function, label: str = None) -> Gauge:
+        return self._register(Gauge(self.prefix + name, help_text, function, label))
+
+    def histogram(self, name: str, help_text: str, buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(self.prefix + name, help_text, buckets))
+
+    def render(self) -> str:
+        """
+        Returns every metric in the Prometheus text format. A gauge that fails to read is left out.
+        """
+        lines = []
+        for metric in self.metrics.values():
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                get_bot_logger().error(f"Error reading metric {metric.name}: {str(e)}")
+        return '\n'.join(lines) + '\n'
+
+
+async def serve_metrics(registry: MetricsRegistry, port: int, host: str = '127.0.0.1', executor=None):
+    """
+    Serves the registry's metrics at http://host:port/metrics until cancelled.
+    Pass an executor to read the metrics there, if some gauges do blocking I/O.
+    """
+
+    async def handle(reader, writer):
+        try:
+            request_line = await reader.readline()
+
+            # Skip the request headers
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+            parts = request_line.decode('latin-1').split()
+            if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] == '/metrics':
+                if executor is None:
+                    body = registry.render()
+                else:
+                    body = await asyncio.get_running_loop().run_in_executor(executor, registry.render)
+                status, content_type = '200 OK', 'text/plain; version=0.0.4'
+            else:
+                status, content_type, body = '404 Not Found', 'text/plain', 'Not found\n'
+            body = body.encode()
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\nContent-Length: {len(body)}\r\n"
+                'Connection: close\r\n\r\n'.encode() + body
+            )
+            await writer.drain()
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    get_bot_logger().info(f"Serving metrics at http://{host}:{port}/metrics")
+    async with server:
+        await server.serve_forever()
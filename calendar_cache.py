@@ -0,0 +1,133 @@
+"""
+On-disk cache for calendar_widget.py.
+
+ICS feeds are fetched with conditional GETs (If-None-Match / If-Modified-Since). When the server answers
+304 Not Modified, the events parsed on the previous run are reused, so the feed is neither downloaded nor
+parsed again. Recurring event expansions (see ics_window.py) are kept here too, per feed, so they survive feed changes.
+The cache also remembers a hash of the markdown last written to each widget, so a widget is only updated when
+its text actually changes, and the widgets it has already found by title.
+"""
+
+import hashlib
+import json
+import os
+
+
+class CalendarCache:
+
+    def __init__(self, cache_file: str = 'calendar_cache.json'):
+        self.cache_file = cache_file
+        self.feed_hits = 0
+        self.feed_misses = 0
+        self.widget_hits = 0
+        self.widget_misses = 0
+        try:
+            with open(cache_file) as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            cache = {}
+        self.feeds = cache.get('feeds', {})
+        self.widgets = cache.get('widgets', {})
+        self.widget_ids = cache.get('widget_ids', {})
+
+        # {feed url: {expansion key: expansion}}. Caches written before expansions were kept per feed are dropped.
+        self.expansions = {
+            url: expansions for url, expansions in cache.get('expansions', {}).items() if 'begins' not in expansions
+        }
+
+    def feed_expansions(self, ical_url: str) -> dict:
+        """
+        Returns the memoized RRULE expansions of a feed, for WindowedCalendarParser to read and update
+        """
+        return self.expansions.setdefault(ical_url, {})
+
+    def fetch_events(self, ical_url: str, parse, needed_until: float = None, parsed_until: float = None) -> list:
+        """
+        Returns the events of the feed, parsing it only if it changed since the last fetch
+
+        Parameters
+        ----------
+        ical_url : str
+            The url of the ical calendar
+        parse : function
+            Turns the lines of the feed into a JSON-serializable list of events
+        needed_until : float (optional)
+            Only reuse the cached events if they were parsed up to at least this timestamp
+        parsed_until : float (optional)
+            How far ahead parse() reads events, recorded for needed_until on later runs
+        """
+        feed = self.feeds.get(ical_url)
+        if feed is not None and needed_until is not None and (feed.get('parsed_until') or 0) < needed_until:
+            feed = None
+        headers = {}
+        if feed is not None:
+            if feed.get('etag'):
+                headers['If-None-Match'] = feed['etag']
+            if feed.get('last_modified'):
+                headers['If-Modified-Since'] = feed['last_modified']
+        import requests
+
+        with requests.get(ical_url, headers=headers, stream=True) as response:
+            if response.status_code == 304 and feed is not None:
+                self.feed_hits += 1
+                return feed['events']
+            response.raise_for_status()
+
+            self.feed_misses += 1
+            if response.encoding is None:
+                response.encoding = 'utf-8'
+            events = parse(response.iter_lines(decode_unicode=True))
+        self.feeds[ical_url] = {
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'parsed_until': parsed_until,
+            'events': events
+        }
+        self.save()
+        return events
+
+    def widget_changed(self, widget_key: str, md: str) -> bool:
+        """
+        Returns True if md differs from the text last recorded for the widget with remember_widget()
+        """
+        if self.widgets.get(widget_key) == self._hash(md):
+            self.widget_hits += 1
+            return False
+        self.widget_misses += 1
+        return True
+
+    def remember_widget(self, widget_key: str, md: str):
+        """
+        Records the text written to the widget. Call this only once the update went through.
+        """
+        self.widgets[widget_key] = self._hash(md)
+        self.save()
+
+    def remember_widget_id(self, widget_key: str, widget_data: dict):
+        """
+        Records a widget found by title (its id, kind, shortName and styles), so it does not have to be looked up again
+        """
+        self.widget_ids[widget_key] = widget_data
+        self.save()
+
+    def forget_widget_id(self, widget_key: str):
+        if self.widget_ids.pop(widget_key, None) is not None:
+            self.save()
+
+    def stats(self) -> str:
+        return (
+            f"feed cache: {self.feed_hits} hits, {self.feed_misses} misses; "
+            f"widget cache: {self.widget_hits} unchanged, {self.widget_misses} changed"
+        )
+
+    def save(self):
+
+        # Write to a temporary file first so an interrupted run cannot leave a truncated cache behind
+        temp_file = self.cache_file + '.tmp'
+        with open(temp_file, 'w') as f:
+            json.dump({'feeds': self.feeds, 'widgets': self.widgets, 'expansions': self.expansions, 'widget_ids': self.widget_ids}, f)
+        os.replace(temp_file, self.cache_file)
+
+    @staticmethod
+    def _hash(md: str) -> str:
+        return hashlib.sha256(md.encode()).hexdigest()
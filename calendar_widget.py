@@ -1,11 +1,18 @@
-from ics import Calendar
-import requests
 from datetime import datetime, timedelta
-import arrow
-import praw
-import json
+from token_cache import asyncpraw_reddit, praw_reddit
+import sys
+import time
+from calendar_cache import CalendarCache
+from config_loader import load_config, script_credentials
+from ics_window import WindowedCalendarParser
 
-def get_calendar_events(ical_url: str, num_days: int, footer_md='') -> str: 
+# arrow, requests and asyncio are imported by the functions that use them: when the calendar has not changed,
+# a cron run only has to read the cache, so it should not pay for importing them at startup
+
+# Events are parsed this many days past the end of the window, so a cached parse stays usable for a while as the window moves
+PARSE_HORIZON_DAYS = 7
+
+def get_calendar_events(ical_url: str, num_days: int, footer_md='', cache=None) -> str: 
     """
     Returns a markdown-formatted string of upcoming events from the provided ical calendar
 
@@ -17,17 +24,52 @@ def get_calendar_events(ical_url: str, num_days: int, footer_md='') -> str:
         The number of days, starting today, for which to retrieve upcoming events
     footer : str (optional)
         A footer markdown-formatted string to add after the list of events
+    cache : CalendarCache (optional)
+        Reuses the events parsed on the previous run if the calendar has not changed since
     """    
-    # Get data from the ics calendar
-    data = requests.get(ical_url)
-    cal = Calendar(data.text)
-    
-    # Create a markdown document of upcoming events
+    return calendar_events_md(fetch_calendar_events(ical_url, num_days, cache), num_days, footer_md)
+
+
+def fetch_calendar_events(ical_url: str, num_days: int, cache=None) -> list:
+    """
+    Returns [begin, end, name] of the events of the calendar that can fall in the next num_days days, in chronological order
+    """
+    import arrow
+
+    start = arrow.get(datetime.utcnow())
+    stop = arrow.get(start + timedelta(days=num_days))
+
+    # Get data from the ics calendar, only reading the events that can fall in the window
+    parse_until = stop + timedelta(days=PARSE_HORIZON_DAYS)
+    parser = WindowedCalendarParser(start.datetime, parse_until.datetime, cache.feed_expansions(ical_url) if cache is not None else None)
+    if cache is not None:
+        events = cache.fetch_events(ical_url, parser.parse, stop.timestamp(), parse_until.timestamp())
+    else:
+        import requests
+
+        events = parser.parse(requests.get(ical_url).text.splitlines())
+    if parser.events_seen:
+        print(f"Parsed calendar: {parser.stats()}")
+    return events
+
+
+def calendar_events_md(events: list, num_days: int, footer_md='') -> str:
+    """
+    Returns a markdown-formatted string of the events (as returned by fetch_calendar_events) in the next num_days days
+    """
+    import arrow
+
     start = arrow.get(datetime.utcnow())
     stop = arrow.get(start + timedelta(days=num_days))
+
+    # Create a markdown document of upcoming events
     upcoming_events_md = ''
-    for event in cal.timeline.included(start, stop):
-        upcoming_events_md += f"{event.begin.format(fmt='MMMM Do')}  \n**{event.name}**\n\n---\n\n"
+    for begin, end, name in events:
+        begin = arrow.get(begin)
+        if begin > stop:
+            break
+        if start <= begin and start <= arrow.get(end) <= stop:
+            upcoming_events_md += f"{begin.format(fmt='MMMM Do')}  \n**{name}**\n\n---\n\n"
 
     # Add footer text if any
     upcoming_events_md += footer_md
@@ -35,40 +77,189 @@ def get_calendar_events(ical_url: str, num_days: int, footer_md='') -> str:
     # Return markdown
     return upcoming_events_md
 
-################
-# MAIN PROGRAM #
-################
-# This code assumes that all the secrets are in a json file located in the same directory as this script.
-# You can just enter these secrets here, but keep in mind that they are called "secrets" for a reason.
-LOCAL_CONFIG_FILE='local_config.json'
-with open(LOCAL_CONFIG_FILE) as local_config_file:
-    local_config = json.load(local_config_file)
-REDDIT_CLIENT_ID = local_config['reddit_client_id']
-REDDIT_CLIENT_SECRET = local_config['reddit_client_secret']
-REDDIT_USER_AGENT = local_config['reddit_user_agent']
-REDDIT_USERNAME = local_config['reddit_username'],
-REDDIT_PASSWORD = local_config['reddit_password']
-
-# Create the text for the calendar widget
-ICAL_URL = 'https://calendar.google.com/calendar/ical/otfreddit%40gmail.com/public/basic.ics' # replace with your ics link
-md = get_calendar_events(ICAL_URL, 30)
-
-# Connect to Reddit and update the widget
-SUBREDDIT_NAME = 'orangetheory' # replace with your subreddit name (do not include r/)
-WIDGET_TITLE = 'Upcoming Events' # Create a textarea widget in your subreddit "community appearance" section and provide the title here
-with praw.Reddit(
-    client_id=REDDIT_CLIENT_ID,
-    client_secret=REDDIT_CLIENT_SECRET,
-    user_agent=REDDIT_USER_AGENT,
-    username=REDDIT_USERNAME,
-    password=REDDIT_PASSWORD
-) as prawddit:
-    widgets = prawddit.subreddit(SUBREDDIT_NAME).widgets
-    calendar_widget = None
-    for widget in widgets.sidebar:
-        if widget.shortName.lower() == WIDGET_TITLE.lower():
-            calendar_widget = widget
-            break
+############
+# Settings #
+############
+NUM_DAYS = 30
+
+# The defaults for the single widget updated by a normal run. Set "ical_url", "subreddit_name" (do not include r/) and
+# "widget_title" in the config file: create a textarea widget in your subreddit "community appearance" section and
+# provide its title there.
+DEFAULT_ICAL_URL = 'https://calendar.google.com/calendar/ical/otfreddit%40gmail.com/public/basic.ics'
+DEFAULT_SUBREDDIT_NAME = 'orangetheory'
+DEFAULT_WIDGET_TITLE = 'Upcoming Events'
+
+
+def calendar_cache(config, default_file=None):
+    """
+    Returns the CalendarCache set in the config file, or None if it is disabled
+
+    The cache skips downloading and parsing an unchanged calendar, and updating an unchanged widget. Set
+    "calendar_cache_file" to null to disable it.
+    """
+    cache_file = config.get('calendar_cache_file', 'calendar_cache.json') or default_file
+    return CalendarCache(cache_file) if cache_file else None
+
+
+def calendar_widgets(config) -> list:
+    """
+    Returns the widgets to keep up to date in daemon mode, e.g.
+    [{"subreddit": "orangetheory", "widget_title": "Upcoming Events", "ical_url": "https://...", "days": 30}]
+    ("calendar_widgets" in the config file). Defaults to the single widget of a normal run.
+    """
+    return config.get('calendar_widgets') or [{
+        'subreddit': config.get('subreddit_name', DEFAULT_SUBREDDIT_NAME),
+        'widget_title': config.get('widget_title', DEFAULT_WIDGET_TITLE),
+        'ical_url': config.get('ical_url', DEFAULT_ICAL_URL),
+        'days': NUM_DAYS
+    }]
+
+
+def widget_key(subreddit_name: str, widget_title: str) -> str:
+    return f"{subreddit_name.lower()}/{widget_title.lower()}"
+
+
+def update_widget(config):
+    """
+    Updates the configured widget once
+    """
+    cache = calendar_cache(config)
+    subreddit_name = config.get('subreddit_name', DEFAULT_SUBREDDIT_NAME)
+    widget_title = config.get('widget_title', DEFAULT_WIDGET_TITLE)
+
+    # Create the text for the calendar widget
+    md = get_calendar_events(config.get('ical_url', DEFAULT_ICAL_URL), NUM_DAYS, cache=cache)
+
+    # Connect to Reddit and update the widget
+    key = widget_key(subreddit_name, widget_title)
+    if cache is not None and not cache.widget_changed(key, md):
+        print(f"Calendar widget is up to date ({cache.stats()})")
+        return
+
+    with praw_reddit(**script_credentials(config)) as prawddit:
+        widgets = prawddit.subreddit(subreddit_name).widgets
+        calendar_widget = None
+        for widget in widgets.sidebar:
+            if widget.shortName.lower() == widget_title.lower():
+                calendar_widget = widget
+                break
+
+        calendar_widget.mod.update(text=md)        
+
+    if cache is not None:
+        cache.remember_widget(key, md)
+        print(f"Calendar widget updated ({cache.stats()})")
+
+
+###############
+# Daemon mode #
+###############
+async def find_widget(reddit, cache, subreddit_name: str, widget_title: str):
+    """
+    Returns the sidebar widget with the given title, using the widget cached by a previous lookup if there is one
+    """
+    from asyncpraw.models import TextArea
+
+    subreddit = await reddit.subreddit(subreddit_name)
+    key = widget_key(subreddit_name, widget_title)
+    widget_data = cache.widget_ids.get(key)
+    if widget_data is None:
+        async for widget in subreddit.widgets.sidebar():
+            if widget.shortName.lower() == widget_title.lower():
+
+                # Keep what the update request needs besides the text, so the next cycles can skip the lookup
+                widget_data = {'id': widget.id, 'kind': widget.kind, 'shortName': widget.shortName, 'styles': widget.styles}
+                cache.remember_widget_id(key, widget_data)
+                break
+        else:
+            return None
+    return TextArea(reddit, _data=dict(widget_data, subreddit=subreddit))
+
+
+async def update_daemon_widget(reddit, cache, target, md, semaphore):
+    key = widget_key(target['subreddit'], target['widget_title'])
+    async with semaphore:
+        try:
+            widget = await find_widget(reddit, cache, target['subreddit'], target['widget_title'])
+            if widget is None:
+                print(f"[r/{target['subreddit']}] No sidebar widget titled \"{target['widget_title']}\"")
+                return
+            await widget.mod.update(text=md)
+        except Exception as e:
+
+            # The cached widget may have been deleted or renamed: look it up again next cycle
+            cache.forget_widget_id(key)
+            print(f"[r/{target['subreddit']}] Error updating widget \"{target['widget_title']}\": {str(e)}")
+            return
+    cache.remember_widget(key, md)
+    print(f"[r/{target['subreddit']}] Updated widget \"{target['widget_title']}\"")
+
+
+async def update_widgets_cycle(reddit, cache, semaphore, widgets):
+    """
+    Fetches each calendar once, then updates the widgets whose text changed concurrently
+    """
+    import asyncio
+
+    # The fetches (blocking requests) run in a worker thread, so a slow calendar host does not hold up the event loop.
+    # They go one at a time since they write to the cache, and before any widget update does.
+    events_by_url = {}
+    for ical_url in dict.fromkeys(target['ical_url'] for target in widgets):
+        num_days = max(target.get('days', NUM_DAYS) for target in widgets if target['ical_url'] == ical_url)
+        try:
+            events_by_url[ical_url] = await asyncio.to_thread(fetch_calendar_events, ical_url, num_days, cache)
+        except Exception as e:
+            print(f"Error fetching calendar {ical_url}: {str(e)}")
+
+    updates = []
+    for target in widgets:
+        if target['ical_url'] not in events_by_url:
+            continue
+        md = calendar_events_md(events_by_url[target['ical_url']], target.get('days', NUM_DAYS), target.get('footer_md', ''))
+        if cache.widget_changed(widget_key(target['subreddit'], target['widget_title']), md):
+            updates.append(update_daemon_widget(reddit, cache, target, md, semaphore))
+    await asyncio.gather(*updates)
+
+
+async def run_daemon(config):
+    """
+    Keeps all the widgets up to date, checking every "calendar_widget_interval" seconds (300 by default), with up to
+    "calendar_widget_concurrency" widget updates in flight at once (4 by default)
+    """
+    import asyncio
+
+    widgets = calendar_widgets(config)
+    interval = config.get('calendar_widget_interval', 300)
+    cache = calendar_cache(config, default_file='calendar_cache.json')
+    semaphore = asyncio.Semaphore(config.get('calendar_widget_concurrency', 4))
+    async with asyncpraw_reddit(**script_credentials(config)) as reddit:
+        print(f"Updating {len(widgets)} calendar widgets every {interval} seconds")
+        while True:
+            start = time.perf_counter()
+            try:
+                await update_widgets_cycle(reddit, cache, semaphore, widgets)
+            except Exception as e:
+                print(f"Error in update cycle: {str(e)}")
+            print(f"Cycle done in {time.perf_counter() - start:.2f}s ({cache.stats()})")
+            await asyncio.sleep(interval)
+
+
+def main(argv=None):
+    """
+    Updates the configured widget once, or keeps all the widgets up to date with --daemon
+    """
+    argv = sys.argv[1:] if argv is None else argv
+    config = load_config()
+    if '--daemon' in argv:
+        import asyncio
+
+        try:
+            asyncio.run(run_daemon(config))
+        except KeyboardInterrupt:
+            print('Received CTRL-C. Exiting.')
+    else:
+        update_widget(config)
 
-    calendar_widget.mod.update(text=md)        
 
+if __name__ == "__main__":
+    main()
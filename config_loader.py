@@ -0,0 +1,53 @@
+"""
+Loads the settings and secrets of the scripts.
+
+The scripts read their settings from a JSON file in the directory they run in: local_config.json for the bots and
+reports that log in as the bot account, bot_config.json for the ones that use an app refresh token. You can just enter
+these secrets in the file, but keep in mind that they are called "secrets" for a reason: keep the files out of git.
+
+The scripts only load their config in main(), so they can be imported (e.g. to reuse a function, or to time the
+imports) without a config file being there.
+"""
+
+import json
+
+LOCAL_CONFIG_FILE = 'local_config.json'
+BOT_CONFIG_FILE = 'bot_config.json'
+
+_configs = {}
+
+
+def load_config(config_file: str = LOCAL_CONFIG_FILE) -> dict:
+    """
+    Returns the settings in the config file, reading the file on the first call only
+    """
+    config = _configs.get(config_file)
+    if config is None:
+        with open(config_file) as f:
+            config = _configs[config_file] = json.load(f)
+    return config
+
+
+def script_credentials(config: dict) -> dict:
+    """
+    Returns the praw.Reddit arguments to log in as the bot account (password flow)
+    """
+    return {
+        'client_id': config['reddit_client_id'],
+        'client_secret': config['reddit_client_secret'],
+        'user_agent': config['reddit_user_agent'],
+        'username': config['reddit_username'],
+        'password': config['reddit_password']
+    }
+
+
+def app_credentials(config: dict) -> dict:
+    """
+    Returns the praw.Reddit arguments to act for the mod who authorized the app (see reddit_auth.py)
+    """
+    return {
+        'client_id': config['app_client_id'],
+        'client_secret': config['app_client_secret'],
+        'user_agent': config['app_user_agent'],
+        'refresh_token': config['app_token']
+    }
@@ -1,113 +1,316 @@
-import praw
-import json
 import sys
-from datetime import datetime
-
-LOCAL_CONFIG_FILE='bot_config.json'
-with open(LOCAL_CONFIG_FILE) as local_config_file:
-    local_config = json.load(local_config_file)
-APP_CLIENT_ID = local_config['app_client_id']
-APP_CLIENT_SECRET = local_config['app_client_secret']
-APP_USER_AGENT = local_config['app_user_agent']
-APP_TOKEN = local_config['app_token']
-SUBREDDIT_NAME = local_config['subreddit_name']
-POST_LIMIT = local_config['post_limit']
-WIKI_PAGE = local_config['wiki_page']
-
-flair_counter = {}
-
-# Get input
-while True:
+import time
+from bisect import bisect_right
+from datetime import date, datetime, timedelta
+from request_scheduler import BACKFILL, request_priority
+from token_cache import asyncpraw_reddit, praw_reddit
+from bot_logger import get_bot_logger, span, span_summary
+from config_loader import BOT_CONFIG_FILE, app_credentials, load_config
+from flair_rollup import FlairRollup, rollup_settle_before
+from wiki_publisher import PagedReport, open_wiki_publisher
+
+logger = get_bot_logger()
+
+
+class FlairCounter:
+    """
+    Counts posts by flair for one or more months in a single pass over a newest-first listing of posts
+
+    Month boundaries are computed once as epoch timestamps (in local time, like datetime.fromtimestamp),
+    so each post only costs a couple of number comparisons.
+    """
+
+    def __init__(self, months, show_progress=True):
+        self.show_progress = show_progress
+        self.months = sorted(set(months))
+        self.starts = [datetime(year=year, month=month, day=1).timestamp() for year, month in self.months]
+        self.ends = [
+            datetime(year=year + month // 12, month=month % 12 + 1, day=1).timestamp() for year, month in self.months
+        ]
+        self.counters = {year_month: {} for year_month in self.months}
+
+    def add(self, created_utc, flair):
+        """
+        Counts a post if it falls in one of the months. Returns False once the posts are older than all the months.
+        """
+        if created_utc < self.starts[0]:
+            return False
+        index = bisect_right(self.starts, created_utc) - 1
+        if created_utc < self.ends[index]:
+            counter = self.counters[self.months[index]]
+            counter[flair] = counter.get(flair, 0) + 1
+            if self.show_progress:
+                print('*', end='')
+        elif self.show_progress:
+            print('.', end='')
+        return True
+
+    def total(self):
+        return sum(sum(counter.values()) for counter in self.counters.values())
+
+    def report_md(self, year, month):
+        """
+        Returns the markdown report for one of the months, or None if no posts were found
+        """
+        return flair_counts_md(year, month, self.counters[(year, month)])
+
+    def reports_md(self):
+        """
+        Returns the reports for all the months that have posts, newest month first
+        """
+        reports_md = [self.report_md(year, month) for year, month in reversed(self.months)]
+        return [report_md for report_md in reports_md if report_md is not None]
+
+
+def flair_counts_md(year, month, flair_counter):
+    """
+    Returns the markdown report for a month from its {flair: posts} counts, or None if there were no posts
+    """
+    if len(flair_counter) == 0:
+        return None
+    sorted_counter = dict(sorted(flair_counter.items(), key=lambda item: item[1], reverse=True))
+    report_md = (
+        f"# Posts by flair for {datetime(year=year, month=month, day=1).strftime('%B, %Y')}\n"
+        f"**Total posts**: {sum(sorted_counter.values())}  \n\n"
+        '| **Flair** | **Posts** |\n'
+        '|:--|:--:|\n'
+    )
+    for flair, count in sorted_counter.items():
+        report_md += f"|{flair}|{count}|\n"
+    return report_md
+
+
+#########################################################################
+# Reports from the rollup of per-day flair counts (see flair_rollup.py) #
+#########################################################################
+def open_flair_rollup(config):
+    """
+    Returns the FlairRollup set in the config file, or None to count the posts by scanning the new() listing
+
+    The rollup keeps the per-day flair counts on disk, so each run only reads the posts submitted since the last one,
+    and months that fell off the listing can still be reported on. Set "flair_rollup_file" to null in the config file
+    to scan the listing instead.
+    """
+    rollup_file = config.get('flair_rollup_file', 'flair_rollup.db')
+    return FlairRollup(rollup_file) if rollup_file else None
+
+
+def rollup_reports_md(rollup, subreddit_name, months):
+    """
+    Returns (the reports for all the months that have posts, newest month first; the number of posts in them)
+    """
+    coverage = rollup.coverage(subreddit_name)
+    reports_md = []
+    total = 0
+    for year, month in sorted(set(months), reverse=True):
+        first_day = date(year, month, 1)
+        next_month = date(year + month // 12, month % 12 + 1, 1)
+        if coverage is None or coverage[0] > datetime(year, month, 1).timestamp():
+            logger.warning(f"[r/{subreddit_name}] The flair rollup does not go back to {first_day}: the report for {year}-{month:02d} may be incomplete")
+        flair_counter = rollup.counts(subreddit_name, first_day, next_month - timedelta(days=1))
+        total += sum(flair_counter.values())
+        report_md = flair_counts_md(year, month, flair_counter)
+        if report_md is not None:
+            reports_md.append(report_md)
+    return reports_md, total
+
+
+def parse_months(text):
+    """
+    Parses a comma-separated list of months in the format YYYY-MM. Returns a list of (year, month), or None if invalid.
+    """
+    months = []
     try:
-        year_month = input('Enter the month to collect data for using the format YYYY-MM (e.g. 2022-07): ')
-        year = int(year_month.split('-')[0] or 0)
-        month = int(year_month.split('-')[1] or 0)
+        for year_month in text.split(','):
+            year = int(year_month.strip().split('-')[0] or 0)
+            month = int(year_month.strip().split('-')[1] or 0)
+            if not (1 <= month <= 12) or year < 2000:
+                return None
+            months.append((year, month))
     except:
-        year = 0
-        month = 0
-    if not (1 <= month <= 12) or year < 2000:
-        print('Invalid input. Try again.')
-    else:
-        break
-
-# Connect to Reddit
-with praw.Reddit(
-    client_id = APP_CLIENT_ID,
-    client_secret = APP_CLIENT_SECRET,
-    user_agent = APP_USER_AGENT,
-    refresh_token = APP_TOKEN
-) as prawddit:
-
-    # Iterate through posts and count by flair
-    print(f"Checking for posts in r/{SUBREDDIT_NAME} matching the specified timeframe...")
-    for post in prawddit.subreddit(SUBREDDIT_NAME).new(limit=POST_LIMIT):
-        if datetime.fromtimestamp(post.created_utc).month == month and datetime.fromtimestamp(post.created_utc).year == year:
-            print('*', end='')
-            if flair_counter.get(post.link_flair_text, None) is None:
-                flair_counter[post.link_flair_text] = 1
-            else:
-                flair_counter[post.link_flair_text] += 1
+        return None
+    return months
+
+
+def interactive_report(config):
+    """
+    Asks for the months and the update mode, then updates the wiki page set in the config file
+    """
+    subreddit_name = config['subreddit_name']
+    wiki_page_name = config['wiki_page']
+
+    # Get input
+    while True:
+        months = parse_months(input('Enter the months to collect data for using the format YYYY-MM, separated by commas (e.g. 2022-07,2022-08): '))
+        if not months:
+            print('Invalid input. Try again.')
         else:
-            print('.', end='')
-    
-if len(flair_counter) == 0:
-    print('\nNo posts found for this time frame!')
-    sys.exit()
-else:
-    print(f"\nFound {sum(flair_counter.values())} posts")
-
-sorted_counter = dict(sorted(flair_counter.items(), key=lambda item: item[1], reverse=True))
-
-# Prepare report
-print('Generating report...', end='')
-report_md = (
-    f"# Posts by flair for {datetime(year=datetime.utcnow().year, month=month, day=1).strftime('%B, %Y')}\n"
-    f"**Total posts**: {sum(sorted_counter.values())}  \n\n"
-    '| **Flair** | **Posts** |\n'
-    '|:--|:--:|\n'
-)
-for flair, count in sorted_counter.items():
-    report_md += f"|{flair}|{count}|\n"
-print(' Done\n')
-
-# Prompt for update mode
-print(f"About to update wiki page r/{SUBREDDIT_NAME}/wiki/{WIKI_PAGE}...")
-while True:
-    update = input('Enter [y] to overwrite page, [n] to update existing page, [q] to quit without updating: ')
-    if update.lower() == 'y':
-        overwrite = True
-        break
-    elif update.lower() == 'n':
-        overwrite = False
-        break
-    elif update.lower() == 'q':
-        print('Bye!')
+            break
+    rollup = open_flair_rollup(config)
+
+    # Connect to Reddit
+    with praw_reddit(**app_credentials(config)) as prawddit:
+
+        # Bring the rollup up to date: only the posts submitted since the last run are read
+        if rollup is not None:
+            print(f"Syncing the flair counts of r/{subreddit_name}...")
+            with request_priority(BACKFILL):
+                added = rollup.sync(
+                    prawddit.subreddit(subreddit_name), limit=config['post_limit'], settle_before=rollup_settle_before(config)
+                )
+            print(f"Added {added} posts to {rollup.db_file}")
+
+        # Iterate through posts and count by flair. Posts are listed newest first, so we stop at the first post older than all the months.
+        else:
+            flair_counter = FlairCounter(months)
+            print(f"Checking for posts in r/{subreddit_name} matching the specified timeframe...")
+            with request_priority(BACKFILL):
+                for post in prawddit.subreddit(subreddit_name).new(limit=config['post_limit']):
+                    if not flair_counter.add(post.created_utc, post.link_flair_text):
+                        break
+
+    # Prepare report
+    if rollup is not None:
+        reports_md, total = rollup_reports_md(rollup, subreddit_name, months)
+    else:
+        reports_md, total = flair_counter.reports_md(), flair_counter.total()
+    if total == 0:
+        print('\nNo posts found for this time frame!')
         sys.exit()
     else:
-        print('Invalid input. Try again.')
-
-# Update the wiki page
-with praw.Reddit(
-    client_id = APP_CLIENT_ID,
-    client_secret = APP_CLIENT_SECRET,
-    user_agent = APP_USER_AGENT,
-    refresh_token = APP_TOKEN
-) as prawddit:
-    wiki_page = prawddit.subreddit(SUBREDDIT_NAME).wiki[WIKI_PAGE]
-    try:
-        wiki_page_content = wiki_page.content_md
-    except:
-        print("Wiki page does not exist")
-        overwrite = True
-    if overwrite:
-        print(f"Creating / overwriting wiki page r/{SUBREDDIT_NAME}/wiki/{WIKI_PAGE}")
-        wiki_page_content = report_md
+        print(f"\nFound {total} posts")
+
+    # Prompt for update mode
+    print(f"About to update wiki page r/{subreddit_name}/wiki/{wiki_page_name}...")
+    while True:
+        update = input('Enter [y] to overwrite page, [n] to update existing page, [q] to quit without updating: ')
+        if update.lower() == 'y':
+            overwrite = True
+            break
+        elif update.lower() == 'n':
+            overwrite = False
+            break
+        elif update.lower() == 'q':
+            print('Bye!')
+            sys.exit()
+        else:
+            print('Invalid input. Try again.')
+
+    # Update the wiki page (and its per-year subpages)
+    with praw_reddit(**app_credentials(config)) as prawddit:
+        try:
+            edits = open_wiki_publisher(config).publish(
+                prawddit.subreddit(subreddit_name), flair_wiki_report(wiki_page_name), reports_md, overwrite
+            )
+            print(f"Edited {edits} wiki pages")
+        except Exception as e:
+            print(f"Error updating wiki page: {str(e)}")
+
+    print('All done.')
+
+
+def flair_wiki_report(wiki_page_name):
+    """
+    Returns the layout of the flair report wiki page: the reports of each year on their own subpage, newest month first
+    """
+    return PagedReport(wiki_page_name, r'# Posts by flair for (.+)', separator='\n---\n', newest_first=True, title='Posts by flair')
+
+
+###############################################################################
+# Batch mode: run the jobs listed in the config file concurrently, unattended #
+###############################################################################
+async def run_flair_job(reddit, job, semaphore, post_limit, rollup=None, settle_before=None):
+    """
+    Counts posts by flair for one job (in the newest post_limit posts, unless the job sets its own "post_limit"),
+    from the rollup after syncing it (up to settle_before) if one is given. Returns (job, reports markdown or None,
+    seconds spent).
+    """
+    async with semaphore:
+        start = time.perf_counter()
+        months = parse_months(','.join(job['months']))
+        subreddit = await reddit.subreddit(job['subreddit'])
+        if rollup is not None:
+            with request_priority(BACKFILL), span('sync_rollup', subreddit=job['subreddit']):
+                await rollup.sync_async(subreddit, limit=job.get('post_limit', post_limit), settle_before=settle_before)
+            reports_md, total = rollup_reports_md(rollup, job['subreddit'], months)
+        else:
+            flair_counter = FlairCounter(months, show_progress=False)
+            with request_priority(BACKFILL), span('scan_posts', subreddit=job['subreddit']):
+                async for post in subreddit.new(limit=job.get('post_limit', post_limit)):
+                    if not flair_counter.add(post.created_utc, post.link_flair_text):
+                        break
+            reports_md, total = flair_counter.reports_md(), flair_counter.total()
+        reports_md = reports_md if total > 0 else None
+        elapsed = time.perf_counter() - start
+        logger.info(f"[r/{job['subreddit']}] Counted {total} posts for {', '.join(job['months'])} in {elapsed:.2f}s")
+        return job, reports_md, elapsed
+
+
+@span('update_wiki')
+async def write_flair_report(reddit, publisher, job, reports_md):
+    subreddit = await reddit.subreddit(job['subreddit'])
+    await publisher.publish_async(subreddit, flair_wiki_report(job['wiki_page']), reports_md, job.get('overwrite', False))
+
+
+async def batch_report(config):
+    """
+    Runs every job in the "flair_report_jobs" list of the config file, e.g.
+    {"subreddit": "orangetheory", "months": ["2022-07", "2022-08"], "wiki_page": "flair-report", "overwrite": false}
+    The posts are counted concurrently over one session (at most "flair_report_concurrency" jobs at a time),
+    then all the wiki pages are written at the end: each report on the subpage of its year, skipping the pages that
+    would not change (see wiki_publisher.py).
+    """
+    import asyncio
+
+    jobs = config['flair_report_jobs']
+    for job in jobs:
+        if parse_months(','.join(job['months'])) is None:
+            logger.error(f"Invalid months for r/{job['subreddit']}: {job['months']}")
+            sys.exit(1)
+
+    start = time.perf_counter()
+    semaphore = asyncio.Semaphore(config.get('flair_report_concurrency', 4))
+    rollup = open_flair_rollup(config)
+    publisher = open_wiki_publisher(config)
+    async with asyncpraw_reddit(**app_credentials(config)) as reddit:
+        results = await asyncio.gather(
+            *(run_flair_job(reddit, job, semaphore, config['post_limit'], rollup, rollup_settle_before(config)) for job in jobs),
+            return_exceptions=True
+        )
+
+        # Write the wiki pages once all the counting is done
+        for job, result in zip(jobs, results):
+            if isinstance(result, Exception):
+                logger.error(f"[r/{job['subreddit']}] Error counting posts: {str(result)}")
+                continue
+            _, reports_md, _ = result
+            if reports_md is None:
+                logger.info(f"[r/{job['subreddit']}] No posts found for {', '.join(job['months'])}")
+                continue
+            try:
+                await write_flair_report(reddit, publisher, job, reports_md)
+            except Exception as e:
+                logger.error(f"[r/{job['subreddit']}] Error updating wiki page: {str(e)}")
+
+    if rollup is not None:
+        rollup.close()
+    logger.info(f"Ran {len(jobs)} jobs in {time.perf_counter() - start:.2f}s")
+    logger.info(f"Timings: {span_summary()}")
+
+
+def main(argv=None):
+    """
+    Runs the interactive report, or the batch jobs with --batch
+    """
+    argv = sys.argv[1:] if argv is None else argv
+    config = load_config(BOT_CONFIG_FILE)
+    if '--batch' in argv:
+        import asyncio
+
+        asyncio.run(batch_report(config))
     else:
-        print(f"Updating wiki page r/{SUBREDDIT_NAME}/wiki/{WIKI_PAGE}")
-        wiki_page_content = report_md + '\n---\n' + wiki_page_content
-    try:
-        wiki_page.edit(content=wiki_page_content)
-    except Exception as e:
-        print(f"Error updating wiki page: {str(e)}")
+        interactive_report(config)
+
 
-print('All done.')
+if __name__ == "__main__":
+    main()
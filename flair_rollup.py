@@ -0,0 +1,303 @@
+"""
+Local SQLite rollup of how many posts each subreddit got per day and per flair.
+
+flair_report.py used to count flairs by paging through the subreddit's new() listing, which Reddit caps at about
+1000 posts, so the report for an older month could not be rebuilt. The rollup is kept up to date instead: each
+sync only reads the posts submitted since the previous one (the high-water mark) and adds them to the per-day
+counts. Any date range, month-over-month trend or top-N list is then a query on disk, with no API calls.
+
+Run the collector often enough that fewer than ~1000 posts come in between two syncs (e.g. hourly from cron),
+otherwise the posts that fell off the listing are missed (a warning is logged when that happens). Days are local
+dates, like the month boundaries of FlairCounter. A post is counted with the flair it has when it is synced, so
+posts are only counted once the mods have had time to flair them: FLAIR_SETTLE_HOURS, or "flair_settle_hours" in
+the config file (--settle-hours here).
+
+Usage: python flair_rollup.py [--db flair_rollup.db] [--settle-hours N] [--skip-sync] [--from YYYY-MM-DD] [--to YYYY-MM-DD] [--top N] subreddit [subreddit ...]
+(syncs the rollup, then prints the top flairs and the monthly counts of each subreddit). The database and the settle
+window default to the ones flair_report.py uses.
+"""
+
+import sqlite3
+import time
+from collections import Counter
+from datetime import date, datetime
+
+from bot_logger import get_bot_logger
+
+# Posts without a flair are stored under this flair, since NULLs would not be merged by the primary key
+NO_FLAIR = ''
+
+# Posts are only counted once they are this many hours old, so the mods have had time to flair them (a counted post
+# is never read again). Set "flair_settle_hours" in the config file to change it.
+FLAIR_SETTLE_HOURS = 24
+
+logger = get_bot_logger()
+
+
+def settle_hours(config) -> float:
+    return config.get('flair_settle_hours', FLAIR_SETTLE_HOURS)
+
+
+def rollup_settle_before(config, hours: float = None) -> float:
+    """
+    Returns the timestamp after which the posts are left for a later sync (see FLAIR_SETTLE_HOURS)
+    """
+    return time.time() - (settle_hours(config) if hours is None else hours) * 3600
+
+
+def post_day(created_utc: float) -> str:
+    return datetime.fromtimestamp(created_utc).strftime('%Y-%m-%d')
+
+
+def _day(day) -> str:
+    return day.isoformat() if isinstance(day, date) else day
+
+
+def _flair(flair):
+    return None if flair == NO_FLAIR else flair
+
+
+class FlairRollup:
+
+    SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS flair_counts ('
+        '    subreddit TEXT NOT NULL,'
+        '    day TEXT NOT NULL,'
+        '    flair TEXT NOT NULL,'
+        '    count INTEGER NOT NULL,'
+        '    PRIMARY KEY (subreddit, day, flair)'
+        ') WITHOUT ROWID',
+        'CREATE TABLE IF NOT EXISTS sync_state ('
+        '    subreddit TEXT PRIMARY KEY,'
+        '    newest_utc REAL NOT NULL,'
+        '    newest_ids TEXT NOT NULL,'
+        '    oldest_utc REAL NOT NULL'
+        ')',
+    )
+
+    def __init__(self, db_file: str = 'flair_rollup.db'):
+        self.db_file = db_file
+        self.conn = sqlite3.connect(db_file)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        with self.conn:
+            for statement in self.SCHEMA:
+                self.conn.execute(statement)
+        self._locks = {}
+
+    def high_water_mark(self, subreddit_name: str):
+        """
+        Returns (created_utc, fullnames) of the newest posts counted for the subreddit (several posts can share the
+        same second), or None if it was never synced
+        """
+        row = self.conn.execute(
+            'SELECT newest_utc, newest_ids FROM sync_state WHERE subreddit = ?',
+            (subreddit_name.lower(),)
+        ).fetchone()
+        return (row[0], set(row[1].split(','))) if row else None
+
+    def coverage(self, subreddit_name: str):
+        """
+        Returns (oldest, newest) created_utc of the posts counted for the subreddit, or None if it was never synced
+        """
+        row = self.conn.execute(
+            'SELECT oldest_utc, newest_utc FROM sync_state WHERE subreddit = ?',
+            (subreddit_name.lower(),)
+        ).fetchone()
+        return tuple(row) if row else None
+
+    def sync(self, subreddit, limit: int = None, settle_before: float = None) -> int:
+        """
+        Counts the posts submitted since the last sync and returns how many were added
+
+        Parameters
+        ----------
+        subreddit : praw.models.Subreddit
+            The subreddit whose posts to count
+        limit : int (optional)
+            The most posts to read from the new() listing (Reddit stops at about 1000 anyway)
+        settle_before : float (optional)
+            Leave the posts submitted after this timestamp for a later sync
+        """
+        state = _SyncState(self, subreddit.display_name.lower(), settle_before)
+
+        # The listing is newest first, so we can stop as soon as we reach what we already counted
+        for post in subreddit.new(limit=limit):
+            if not state.add(post):
+                break
+        return state.finish()
+
+    async def sync_async(self, subreddit, limit: int = None, settle_before: float = None) -> int:
+        """
+        Same as sync(), for an asyncpraw subreddit. Concurrent syncs of the same subreddit run one at a time.
+        """
+        import asyncio
+
+        subreddit_name = subreddit.display_name.lower()
+        lock = self._locks.setdefault(subreddit_name, asyncio.Lock())
+        async with lock:
+            state = _SyncState(self, subreddit_name, settle_before)
+            async for post in subreddit.new(limit=limit):
+                if not state.add(post):
+                    break
+            return state.finish()
+
+    ###########
+    # Queries #
+    ###########
+    def counts(self, subreddit_name: str, start_day, end_day) -> dict:
+        """
+        Returns {flair: posts} for the posts submitted from start_day to end_day (inclusive), most posts first.
+        Days are datetime.date objects or 'YYYY-MM-DD' strings. Posts without a flair are counted under None.
+        """
+        rows = self.conn.execute(
+            'SELECT flair, SUM(count) AS posts FROM flair_counts WHERE subreddit = ? AND day >= ? AND day <= ? '
+            'GROUP BY flair ORDER BY posts DESC, flair',
+            (subreddit_name.lower(), _day(start_day), _day(end_day))
+        )
+        return {_flair(flair): posts for flair, posts in rows}
+
+    def top_flairs(self, subreddit_name: str, start_day, end_day, n: int = 10) -> list:
+        """
+        Returns (flair, posts) for the n flairs with the most posts from start_day to end_day (inclusive)
+        """
+        return list(self.counts(subreddit_name, start_day, end_day).items())[:n]
+
+    def monthly_counts(self, subreddit_name: str, start_day, end_day) -> dict:
+        """
+        Returns {(year, month): {flair: posts}} for the months from start_day to end_day (inclusive), oldest first,
+        e.g. to compare flairs month over month
+        """
+        rows = self.conn.execute(
+            'SELECT substr(day, 1, 7) AS month, flair, SUM(count) AS posts FROM flair_counts '
+            'WHERE subreddit = ? AND day >= ? AND day <= ? GROUP BY month, flair ORDER BY month, posts DESC, flair',
+            (subreddit_name.lower(), _day(start_day), _day(end_day))
+        )
+        months = {}
+        for month, flair, posts in rows:
+            year, month = month.split('-')
+            months.setdefault((int(year), int(month)), {})[_flair(flair)] = posts
+        return months
+
+    def total(self, subreddit_name: str) -> int:
+        return self.conn.execute(
+            'SELECT COALESCE(SUM(count), 0) FROM flair_counts WHERE subreddit = ?', (subreddit_name.lower(),)
+        ).fetchone()[0]
+
+    def close(self):
+        self.conn.close()
+
+
+class _SyncState:
+    """
+    The bookkeeping of one sync: which posts are new, and their counts until they are written in one transaction
+    """
+
+    def __init__(self, rollup: FlairRollup, subreddit_name: str, settle_before: float = None):
+        self.rollup = rollup
+        self.subreddit_name = subreddit_name
+        self.settle_before = settle_before
+        self.high_water_mark = rollup.high_water_mark(subreddit_name)
+        self.reached_mark = self.high_water_mark is None
+        self.newest_utc = None
+        self.newest_ids = set()
+        self.oldest_utc = None
+        self.counts = Counter()  # (day, flair) -> posts
+        self.added = 0
+
+    def add(self, post) -> bool:
+        """
+        Counts a post if it is new. Returns False once the post is older than the ones already counted.
+        """
+        created_utc = post.created_utc
+        if self.settle_before is not None and created_utc > self.settle_before:
+            return True
+        if self.high_water_mark is not None:
+            newest_utc, newest_ids = self.high_water_mark
+            if created_utc < newest_utc or (created_utc == newest_utc and post.fullname in newest_ids):
+                self.reached_mark = True
+                return created_utc == newest_utc
+        if self.newest_utc is None or created_utc > self.newest_utc:
+            self.newest_utc, self.newest_ids = created_utc, {post.fullname}
+        elif created_utc == self.newest_utc:
+            self.newest_ids.add(post.fullname)
+        self.oldest_utc = created_utc if self.oldest_utc is None else min(self.oldest_utc, created_utc)
+        self.counts[(post_day(created_utc), post.link_flair_text or NO_FLAIR)] += 1
+        self.added += 1
+        return True
+
+    def finish(self) -> int:
+        """
+        Adds the counts and moves the high-water mark in one transaction, so a post is never counted twice
+        """
+        if not self.reached_mark:
+            logger.warning(
+                f"[r/{self.subreddit_name}] The listing ended before reaching the posts counted by the last sync: "
+                'some posts in between were missed. Sync more often.'
+            )
+        if self.newest_utc is None:
+            return 0
+        if self.high_water_mark is not None and self.newest_utc == self.high_water_mark[0]:
+            self.newest_ids |= self.high_water_mark[1]
+        with self.rollup.conn:
+            self.rollup.conn.executemany(
+                'INSERT INTO flair_counts (subreddit, day, flair, count) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT (subreddit, day, flair) DO UPDATE SET count = count + excluded.count',
+                ((self.subreddit_name, day, flair, count) for (day, flair), count in self.counts.items())
+            )
+            self.rollup.conn.execute(
+                'INSERT INTO sync_state (subreddit, newest_utc, newest_ids, oldest_utc) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT (subreddit) DO UPDATE SET newest_utc = excluded.newest_utc, newest_ids = excluded.newest_ids, '
+                'oldest_utc = MIN(oldest_utc, excluded.oldest_utc)',
+                (self.subreddit_name, self.newest_utc, ','.join(sorted(self.newest_ids)), self.oldest_utc)
+            )
+        return self.added
+
+
+def main(argv=None):
+    import argparse
+    from config_loader import BOT_CONFIG_FILE, app_credentials, load_config
+    from request_scheduler import BACKFILL, request_priority
+    from token_cache import praw_reddit
+
+    # The defaults come from the config file flair_report.py reads, so both use the same rollup the same way
+    try:
+        config = load_config(BOT_CONFIG_FILE)
+    except OSError:
+        config = {}
+    db_file = config.get('flair_rollup_file') or 'flair_rollup.db'
+
+    parser = argparse.ArgumentParser(description='Sync the per-day flair counts of subreddits and print a summary')
+    parser.add_argument('subreddits', nargs='+', help='The subreddit names (do not include r/)')
+    parser.add_argument('--db', default=db_file, help=f"SQLite database file (default: {db_file})")
+    parser.add_argument(
+        '--settle-hours', type=float, default=settle_hours(config),
+        help=f"Only count posts at least this old (default: {settle_hours(config)})"
+    )
+    parser.add_argument('--skip-sync', action='store_true', help='Only query the rollup, without calling Reddit')
+    parser.add_argument('--from', dest='start_day', default='2000-01-01', help='First day to summarize (YYYY-MM-DD)')
+    parser.add_argument('--to', dest='end_day', default=date.today().isoformat(), help='Last day to summarize (YYYY-MM-DD)')
+    parser.add_argument('--top', type=int, default=10, help='Number of flairs to list (default: 10)')
+    args = parser.parse_args(argv)
+
+    if not args.skip_sync and not config:
+        parser.error(f"{BOT_CONFIG_FILE} is needed to sync (use --skip-sync to only query the rollup)")
+
+    rollup = FlairRollup(args.db)
+    if not args.skip_sync:
+        settle_before = rollup_settle_before(config, args.settle_hours) if args.settle_hours else None
+        with praw_reddit(**app_credentials(config)) as reddit, request_priority(BACKFILL):
+            for subreddit_name in args.subreddits:
+                added = rollup.sync(reddit.subreddit(subreddit_name), settle_before=settle_before)
+                print(f"Added {added} posts for r/{subreddit_name} ({rollup.total(subreddit_name)} counted)")
+
+    for subreddit_name in args.subreddits:
+        print(f"\nr/{subreddit_name}, {args.start_day} to {args.end_day}")
+        for flair, posts in rollup.top_flairs(subreddit_name, args.start_day, args.end_day, args.top):
+            print(f"  {flair}: {posts}")
+        for (year, month), flair_counts in rollup.monthly_counts(subreddit_name, args.start_day, args.end_day).items():
+            print(f"  {year}-{month:02d}: {sum(flair_counts.values())} posts")
+    rollup.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+"""
+Streaming ICS parser that only materializes the events falling in a time window.
+
+ics.Calendar parses and builds an object for every VEVENT in the feed, including years of past events, before
+the timeline can be filtered. WindowedCalendarParser reads the feed line by line, keeps only the few properties
+an event needs (DTSTART, DTEND, DURATION, SUMMARY, RRULE, EXDATE), and drops each event as soon as it is known to
+fall outside the window. Recurring events (RRULE) are expanded with dateutil, only over the window, and the
+expansions can be kept in a dict per feed (e.g. CalendarCache.feed_expansions()) so later runs do not expand them again.
+
+Events are returned the way calendar_widget.py caches them: [begin, end, name] with ISO 8601 begin and end, in
+chronological order. Times are read the same way ics 0.7 reads them: UTC unless they carry a TZID, all-day
+events start at midnight UTC and last one day unless they have a DTEND.
+"""
+
+from datetime import datetime, timedelta, timezone
+
+from dateutil import tz
+from dateutil.rrule import rrulestr
+
+# Properties we read from each VEVENT; everything else is skipped without being parsed
+EVENT_PROPERTIES = {'DTSTART', 'DTEND', 'DURATION', 'SUMMARY', 'RRULE', 'EXDATE'}
+
+# Recurrences are expanded this far past the end of the window, so the memoized expansions
+# still cover the window on later runs as it moves forward
+EXPANSION_HORIZON = timedelta(days=90)
+
+
+class WindowedCalendarParser:
+
+    def __init__(self, start: datetime, stop: datetime, expansions: dict = None):
+        """
+        Parameters
+        ----------
+        start, stop : datetime
+            Timezone-aware bounds of the window. Events that cannot overlap it are skipped.
+        expansions : dict (optional)
+            Memoized RRULE expansions of the feed being parsed, read and updated in place. Expansions the feed no
+            longer uses are dropped, so the dict must not be shared with other feeds.
+        """
+        self.start = start
+        self.stop = stop
+        self.expansions = expansions
+        self.events_seen = 0
+        self.events_kept = 0
+        self.expansions_computed = 0
+        self.expansions_reused = 0
+
+    def parse(self, lines) -> list:
+        """
+        Returns [begin, end, name] for every event (or recurrence) that can overlap the window, in chronological order
+
+        Parameters
+        ----------
+        lines : iterable of str
+            The lines of the ICS feed, e.g. response.iter_lines(decode_unicode=True) or text.splitlines()
+        """
+        events = []
+        used_expansions = {}
+        for properties in iter_vevents(lines):
+            self.events_seen += 1
+            try:
+                occurrences = self._occurrences(properties, used_expansions)
+            except (ValueError, KeyError):
+                continue
+            name = unescape_text(properties['SUMMARY'][1]) if 'SUMMARY' in properties else None
+            for begin, end in occurrences:
+                events.append((begin, end, name))
+        if self.expansions is not None:
+            self.expansions.clear()
+            self.expansions.update(used_expansions)
+
+        # Same order as ics' timeline: by begin, then by end
+        events.sort(key=lambda event: (event[0], event[1]))
+        self.events_kept = len(events)
+        return [[begin.isoformat(), end.isoformat(), name] for begin, end, name in events]
+
+    def stats(self) -> str:
+        return (
+            f"read {self.events_seen} events, kept {self.events_kept} occurrences; "
+            f"recurrences: {self.expansions_computed} expanded, {self.expansions_reused} memoized"
+        )
+
+    def _occurrences(self, properties, used_expansions):
+        """
+        Returns (begin, end) of each occurrence of the event that can overlap the window
+        """
+        params, value = properties['DTSTART']
+        begin = parse_datetime(value, params)
+        all_day = len(value) == 8
+        if 'DTEND' in properties:
+            duration = parse_datetime(properties['DTEND'][1], properties['DTEND'][0]) - begin
+        elif 'DURATION' in properties:
+            duration = parse_duration(properties['DURATION'][1])
+        else:
+            duration = timedelta(days=1) if all_day else timedelta(0)
+
+        if 'RRULE' not in properties:
+            if begin <= self.stop and begin + duration >= self.start:
+                return [(begin, begin + duration)]
+            return []
+
+        # An expansion only depends on the start, the rule and the exceptions, so that is what it is memoized by
+        key = '|'.join([
+            ';'.join(f"{name}={param}" for name, param in sorted(params.items())),
+            value,
+            properties['RRULE'][1],
+            properties.get('EXDATE', ({}, ''))[1],
+            str(duration.total_seconds())
+        ])
+        expansion = self.expansions.get(key) if self.expansions is not None else None
+        if expansion is not None and expansion['start'] <= self.start.timestamp() and expansion['stop'] >= self.stop.timestamp():
+            self.expansions_reused += 1
+        else:
+            self.expansions_computed += 1
+            expansion = {
+                'start': self.start.timestamp(),
+                'stop': (self.stop + EXPANSION_HORIZON).timestamp(),
+                'begins': [occurrence.isoformat() for occurrence in self._expand(properties, begin, duration)]
+            }
+        used_expansions[key] = expansion
+
+        occurrences = []
+        for occurrence in expansion['begins']:
+            occurrence = datetime.fromisoformat(occurrence)
+            if occurrence > self.stop:
+                break
+            if occurrence + duration >= self.start:
+                occurrences.append((occurrence, occurrence + duration))
+        return occurrences
+
+    def _expand(self, properties, begin, duration):
+        rules = rrulestr(f"RRULE:{properties['RRULE'][1]}", dtstart=begin, forceset=True)
+        if 'EXDATE' in properties:
+            params, value = properties['EXDATE']
+            for exdate in value.split(','):
+                rules.exdate(parse_datetime(exdate, params))
+        try:
+            return rules.between(self.start - duration, self.stop + EXPANSION_HORIZON, inc=True)
+        except TypeError:
+
+            # UNTIL given in a different form (floating / UTC) than DTSTART: keep just the first occurrence, like ics does
+            return [begin] if self.start - duration <= begin <= self.stop + EXPANSION_HORIZON else []
+
+
+def iter_vevents(lines):
+    """
+    Yields a dict of {property name: (params, value)} for each VEVENT in the feed, reading it line by line
+    """
+    in_event = False
+    nested = 0
+    properties = None
+    current = None
+    for line in lines:
+        line = line.rstrip('\r\n')
+        if line[:1] in (' ', '\t'):
+
+            # Folded line: continues the previous one
+            if current is not None:
+                current += line[1:]
+            continue
+        if current is not None:
+            _add_property(properties, current)
+            current = None
+        if not line:
+            continue
+        if line == 'BEGIN:VEVENT':
+            in_event = True
+            nested = 0
+            properties = {}
+        elif not in_event:
+            continue
+
+        # Properties of components nested in the event (e.g. VALARM) are not the event's
+        elif line.startswith('BEGIN:'):
+            nested += 1
+        elif nested and line.startswith('END:'):
+            nested -= 1
+        elif line == 'END:VEVENT':
+            yield properties
+            in_event = False
+        elif not nested:
+            current = line
+
+
+def _add_property(properties, line):
+    name_end = len(line)
+    for separator in (';', ':'):
+        index = line.find(separator)
+        if index != -1:
+            name_end = min(name_end, index)
+    name = line[:name_end].upper()
+    if name not in EVENT_PROPERTIES:
+        return
+
+    # The value starts at the first colon that is not inside a quoted parameter value
+    quoted = False
+    for index in range(name_end, len(line)):
+        char = line[index]
+        if char == '"':
+            quoted = not quoted
+        elif char == ':' and not quoted:
+            break
+    else:
+        return
+    params = {}
+    for param in line[name_end + 1:index].split(';'):
+        if '=' in param:
+            param_name, param_value = param.split('=', 1)
+            params[param_name.upper()] = param_value.strip('"')
+    properties[name] = (params, line[index + 1:])
+
+
+def parse_datetime(value: str, params: dict) -> datetime:
+    """
+    Parses a DATE or DATE-TIME value. Floating times and dates are read as UTC.
+    """
+    value = value.strip()
+    if len(value) == 8:
+        return datetime.strptime(value, '%Y%m%d').replace(tzinfo=timezone.utc)
+    if value.endswith('Z'):
+        return datetime.strptime(value[:-1], '%Y%m%dT%H%M%S').replace(tzinfo=timezone.utc)
+    parsed = datetime.strptime(value, '%Y%m%dT%H%M%S')
+    zone = tz.gettz(params['TZID']) if 'TZID' in params else None
+    return parsed.replace(tzinfo=zone or timezone.utc)
+
+
+def parse_duration(value: str) -> timedelta:
+    """
+    Parses a DURATION value, e.g. PT1H30M or P1D
+    """
+    value = value.strip()
+    sign = -1 if value.startswith('-') else 1
+    value = value.lstrip('+-')
+    if not value.startswith('P'):
+        raise ValueError(f"Invalid duration: {value}")
+    units = {'W': 'weeks', 'D': 'days', 'H': 'hours', 'M': 'minutes', 'S': 'seconds'}
+    amounts = {}
+    number = ''
+    for char in value[1:]:
+        if char == 'T':
+            continue
+        if char.isdigit():
+            number += char
+        elif char in units and number:
+            amounts[units[char]] = int(number)
+            number = ''
+        else:
+            raise ValueError(f"Invalid duration: {value}")
+    return sign * timedelta(**amounts)
+
+
+def unescape_text(value: str) -> str:
+    result = []
+    chars = iter(value)
+    for char in chars:
+        if char == '\\':
+            escaped = next(chars, '')
+            result.append('\n' if escaped in ('n', 'N') else escaped)
+        else:
+            result.append(char)
+    return ''.join(result)
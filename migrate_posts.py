@@ -0,0 +1,73 @@
+"""
+Use this program to move posts saved by older versions of report_deleted_posts.py
+(one <subreddit>/<fullname>.json file per post) into the SQLite post store.
+
+Usage: python migrate_posts.py [--db posts.db] [--root .] subreddit [subreddit ...]
+
+Posts that are already in the database are left alone, so it is safe to run this more than once.
+The JSON files are not deleted; remove them yourself once you are happy with the result.
+"""
+
+import argparse
+import json
+import os
+from post_store import SQLitePostStore
+
+BATCH_SIZE = 1000
+
+
+def read_json_posts(root_dir, subreddit_name):
+    """
+    Yields (subreddit_name, fullname, payload) for every JSON post file of the subreddit
+    """
+    subreddit_dir = os.path.join(root_dir, subreddit_name)
+    for file_name in os.listdir(subreddit_dir):
+        fullname, extension = os.path.splitext(file_name)
+        if extension != '.json':
+            continue
+        path = os.path.join(subreddit_dir, file_name)
+        try:
+            with open(path, 'r') as json_file:
+                payload = json.load(json_file)
+        except Exception as e:
+            print(f"Error loading file: [{path}]: {str(e)}. Skipping.")
+            continue
+
+        # Older files did not record when the post was created, so the file time is the best guess we have
+        if payload.get('created_utc') is None:
+            payload['created_utc'] = int(os.path.getmtime(path))
+        yield subreddit_name, fullname, payload
+
+
+def migrate(store, root_dir, subreddit_name):
+    migrated = 0
+    batch = []
+    for row in read_json_posts(root_dir, subreddit_name):
+        batch.append(row)
+        if len(batch) >= BATCH_SIZE:
+            migrated += store.save_many(batch)
+            batch = []
+    if batch:
+        migrated += store.save_many(batch)
+    return migrated
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Migrate JSON post files into the SQLite post store')
+    parser.add_argument('subreddits', nargs='+', help='Names of the subreddit directories to migrate')
+    parser.add_argument('--db', default='posts.db', help='SQLite database file (default: posts.db)')
+    parser.add_argument('--root', default='.', help='Directory containing the subreddit directories (default: .)')
+    args = parser.parse_args(argv)
+
+    store = SQLitePostStore(args.db)
+    for subreddit_name in args.subreddits:
+        if not os.path.isdir(os.path.join(args.root, subreddit_name)):
+            print(f"No directory found for [r/{subreddit_name}]. Skipping.")
+            continue
+        migrated = migrate(store, args.root, subreddit_name)
+        print(f"Migrated {migrated} posts for [r/{subreddit_name}] ({store.count(subreddit_name)} posts in database)")
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -9,176 +9,417 @@ The code also updates a wiki page with links to posted reports.
 Please note: this has not been thoroughly tested with other subs and it's possible there are lots of bugs here!
 """
 
-import json
+import re
+import sys
+import time
 from datetime import datetime, tzinfo
 from dateutil.tz import tzutc
-import pandas as pd
-import praw
+from token_cache import asyncpraw_reddit, praw_reddit
+from request_scheduler import BACKFILL, RequestCounter, count_requests, request_priority
+from modlog_archive import ModlogArchive
+from report_aggregator import ModActionAggregator
+from bot_logger import get_bot_logger, span, span_summary
+from config_loader import load_config, script_credentials
+from wiki_publisher import PagedReport, open_wiki_publisher
 
 """
-Retrieve settings and secrets
-This code assumes that all the secrets are in a json file located in the same directory as this script.
-You can just enter these secrets here, but keep in mind that they are called "secrets" for a reason.
-Make sure your bot user can manage / edit wiki pages if you want to archive these reports on your sub's wiki
+Settings and secrets are read from local_config.json (see config_loader.py), with "monitored_subreddit" naming the sub
+to report on. Make sure your bot user can manage / edit wiki pages if you want to archive these reports on your sub's wiki
 """
-CONFIG_FILE='local_config.json'
-with open(CONFIG_FILE) as config_file:
-    config = json.load(config_file)
-monitored_subreddit = config['monitored_subreddit']
-reddit_username = config['reddit_username']
-reddit_password = config['reddit_password']
-reddit_user_agent = config['reddit_user_agent']
-reddit_client_id = config['reddit_client_id']
-reddit_client_secret = config['reddit_client_secret']
+
+logger = get_bot_logger()
 
 # Enter the range of modlog data to retrieve
 earliest_dt = datetime(year=2022, month=7, day=1, tzinfo=tzutc()) 
 latest_dt = datetime(year=2022, month=7, day=31, tzinfo=tzutc())
 
-# Generate Reddit post text in markdown format
-post_title = f"Moderation Transparency Report for {latest_dt.strftime('%B %Y')}"
-post_body_md = f"This report provides a summary of actions taken by the moderators of r/{monitored_subreddit.title()} during {latest_dt.strftime('%B %Y')}.\n"
-
-# Initialize Reddit connection
-with praw.Reddit(
-    client_secret=reddit_client_secret,
-    client_id=reddit_client_id,
-    username=reddit_username,
-    password=reddit_password,
-    user_agent=reddit_user_agent
-) as reddit:
-
-    # Get modlog
-    report_data = {}
-    for item in reddit.subreddit(monitored_subreddit).mod.log(limit=None):
-        item_created_dt = datetime.fromtimestamp(item.created_utc, tz=tzutc())
-        if earliest_dt <= item_created_dt <= latest_dt:
-            
-            """
-            The logic here is a little convoluted because I wanted the report to only consider "items" as opposed to "mod actions"
-            For example: if a mod removed a post, added a removal reason, then changed their mind and approved the post, I only want
-            the report to consider the item as approved.
-            """
-            target_item_dict = report_data.get(item.target_fullname, {})
-            if item.action == 'addremovalreason':
-                target_item_dict['removal_reason'] = item.description
-                report_data[item.target_fullname] = target_item_dict
-            elif item.action in ['approvelink', 'approvecomment', 'removelink', 'removecomment']:
-                if target_item_dict.get('type') is None:
-                    target_item_dict['type'] = 'comment' if item.target_fullname.split('_')[0] == 't1' else 'post'
-                    target_item_dict['mod_action'] = 'approve' if item.action.startswith('approve') else 'remove'
-                    target_item_dict['date_time'] = item_created_dt.strftime('%Y/%m/%d')       
-                    report_data[item.target_fullname] = target_item_dict
-        
-# Get results as DataFrame
-print('Creating report...')
-df_report = pd.DataFrame(report_data).transpose()
-
-# Summarize mod action data
-summary_data = pd.pivot_table(
-    data=df_report,
-    index=['type', 'mod_action'],
-    values='date_time',
-    aggfunc='count',
-    fill_value=0    
-)
-# Summarize removal reason data
-removal_reason_data = pd.pivot_table(
-    data = df_report,
-    index=['type', 'mod_action', 'removal_reason'],
-    values='date_time',
-    aggfunc='count',
-    fill_value=0
+# The modlog actions the report looks at
+REPORT_ACTIONS = ['addremovalreason', 'approvelink', 'approvecomment', 'removelink', 'removecomment', 'banuser']
+
+# Post flair of the reports, and the wiki page that links to them
+REPORT_FLAIR_ID = '161cdb20-1a7d-11e8-affb-0e5c7ea2a678'
+WIKI_PAGE_NAME = 'mod-transparency-reports'
+
+# The wiki page lists a link to each report, oldest first, with the links of each year on their own subpage
+WIKI_REPORT = PagedReport(
+    WIKI_PAGE_NAME, r'- \[([^\]]+)\]\(', separator='\n', newest_first=False, title='Moderation Transparency Reports'
 )
 
-# Add removal reason summary to the Reddit post
-if 'post' in summary_data['date_time']:
-    approved_posts = summary_data['date_time']['post'].get('approve', 0) + summary_data['date_time']['post'].get('chaos_mode', 0) 
-    removed_posts = summary_data['date_time']['post'].get('remove', 0)
-    total_posts = approved_posts + removed_posts
-    post_body_md += (
-        '## Post Removals\n'
-        f"A total of **{total_posts}** posts were reviewed by the moderators, of which **{removed_posts}** " 
-        f"({int(round(removed_posts / total_posts * 100, 0))}%) were removed for the following reasons:  \n"
-    )
-    for removal_reason, count in removal_reason_data['date_time']['post']['remove'].sort_values(ascending=False).items():
-        post_body_md += f"- {removal_reason}: **{count}** ({int(round(count / removed_posts * 100, 0))}%)  \n"
 
-if 'comment' in summary_data['date_time']:
-    approved_comments = summary_data['date_time']['comment'].get('approve', 0) + summary_data['date_time']['comment'].get('chaos_mode', 0) 
-    removed_comments = summary_data['date_time']['comment'].get('remove', 0)
-    total_comments = approved_comments + removed_comments
-    post_body_md += (
-        '## Comment Removals\n'
-        f"A total of **{total_comments}** comments were reported to the moderators by community users or by SplatBot, of which **{removed_comments}** " 
-        f"({int(round(removed_comments / total_comments * 100, 0))}%) were removed for the following reasons:  \n"
-    )
-    for removal_reason, count in removal_reason_data['date_time']['comment']['remove'].sort_values(ascending=False).items():
-        post_body_md += f"- {removal_reason}: **{count}** ({int(round(count / removed_comments * 100, 0))}%)  \n"
-
-
-# Get information about bans
-bans = []
-for item in reddit.subreddit(monitored_subreddit).mod.log(action='banuser', limit=None):
-    item_dt = datetime.fromtimestamp(item.created_utc, tz=tzutc())
-    if earliest_dt <= item_dt <= latest_dt:
-        bans.append({
-            'timestamp': item.created_utc,
-            'reason': item.description.split(':')[0],
-            'duration': item.details
-        })
-
-if len(bans) > 0:
-    # Clean up BotDefense ban reasons
-    for ban in bans:
-        if '/u/' in ban['reason']:
-            ban['reason'] = 'Unauthorized bot'
-    
-    # Summarize and add to post
-    df_bans = pd.DataFrame(bans)
-    bans_summary_data = pd.pivot_table(
-        data=df_bans,
-        index=['reason'],
-        columns=['duration'],
-        values='timestamp',
-        aggfunc='count',
-        fill_value=0    
+def scan_modlog(subreddit, earliest_ts, latest_ts, after=None):
+    """
+    Yields the modlog entries logged between earliest_ts and latest_ts in a single pass, newest first
+
+    The modlog is listed newest first, so we skip entries newer than the window and stop as soon as we see an entry older than it.
+    """
+    scan = _ModlogScan(subreddit.display_name, earliest_ts, latest_ts)
+    modlog = iter(subreddit.mod.log(limit=None, params={'after': after} if after else {}))
+    while True:
+
+        # Count the requests it takes to page through the log, only while the listing is fetching
+        with count_requests(scan.requests):
+            item = next(modlog, None)
+        if item is None or scan.past_window(item):
+            break
+        if scan.in_window(item):
+            yield item
+    scan.finish()
+
+
+async def scan_modlog_async(subreddit, earliest_ts, latest_ts, after=None):
+    """
+    Same as scan_modlog(), for an asyncpraw subreddit
+    """
+    scan = _ModlogScan(subreddit.display_name, earliest_ts, latest_ts)
+    modlog = subreddit.mod.log(limit=None, params={'after': after} if after else {}).__aiter__()
+    while True:
+        try:
+            with count_requests(scan.requests):
+                item = await modlog.__anext__()
+        except StopAsyncIteration:
+            break
+        if scan.past_window(item):
+            break
+        if scan.in_window(item):
+            yield item
+    scan.finish()
+
+
+class _ModlogScan:
+    """
+    The bookkeeping of one modlog scan: where the window is, and how many requests it took to reach it and read it
+    """
+
+    def __init__(self, subreddit_name: str, earliest_ts: float, latest_ts: float):
+        self.subreddit_name = subreddit_name
+        self.earliest_ts = earliest_ts
+        self.latest_ts = latest_ts
+        self.requests = RequestCounter()
+        self.requests_to_window = None
+        self.entries = 0
+
+    def past_window(self, item) -> bool:
+        """
+        Counts an entry read. Returns True once it is older than the window, i.e. the scan is over.
+        """
+        self.entries += 1
+        if not self.in_window(item):
+            return False
+        if self.requests_to_window is None:
+            self.requests_to_window = self.requests.requests
+        return item.created_utc < self.earliest_ts
+
+    def in_window(self, item) -> bool:
+        return item.created_utc <= self.latest_ts
+
+    def finish(self):
+        requests_to_window = self.requests.requests if self.requests_to_window is None else self.requests_to_window
+        logger.info(
+            f"[r/{self.subreddit_name}] Read {self.entries} modlog entries in {self.requests.requests} requests: "
+            f"{requests_to_window} to reach the window, {self.requests.requests - requests_to_window} inside it"
+        )
+
+
+def open_modlog_archive(config):
+    """
+    Returns the ModlogArchive set in the config file, or None to read the modlog straight from Reddit
+
+    Modlog entries are kept in a local archive (see modlog_archive.py) so that each run only downloads what is new.
+    Set "modlog_archive_file" to null in the config file to read the modlog straight from Reddit instead.
+    """
+    modlog_archive_file = config.get('modlog_archive_file', 'modlog.db')
+    return ModlogArchive(modlog_archive_file) if modlog_archive_file else None
+
+
+def report_post_md(subreddit_name, period_name, aggregator):
+    """
+    Returns the Reddit post text (markdown) of the report on one subreddit and period, e.g. 'July 2022'
+    """
+    post_body_md = f"This report provides a summary of actions taken by the moderators of r/{subreddit_name.title()} during {period_name}.\n"
+
+    # Add removal reason summaries to the Reddit post
+    post_body_md += aggregator.removals_md('post', 'Post Removals', 'posts were reviewed by the moderators')
+    post_body_md += aggregator.removals_md(
+        'comment',
+        'Comment Removals',
+        'comments were reported to the moderators by community users or by SplatBot'
     )
+
+    # Summarize bans and add to post
+    post_body_md += aggregator.bans_md()
+
+    # Add closing statements
     post_body_md += (
-        '## Bans\n'
-        f"A total of **{len(bans)}** bans were issued by the moderators. The table below breaks them down by reason and duration:  \n\n" 
+        '\n\n'
+        'We hope you find this information useful and we welcome your feedback. '
+        f"All reports are archived on our [wiki](https://www.reddit.com/r/{subreddit_name}/wiki/{WIKI_PAGE_NAME}).  \n\n"
+        '-The Modsquad'
     )
-    post_body_md += bans_summary_data.to_markdown() 
+    return post_body_md
 
 
-# Add closing statements
-post_body_md += (
-    '\n\n'
-    'We hope you find this information useful and we welcome your feedback. '
-    f"All reports are archived on our [wiki](https://www.reddit.com/r/{monitored_subreddit}/wiki/mod-transparency-reports).  \n\n"
-    '-The Modsquad'
-)
+def single_report(config):
+    """
+    Reports on the monitored subreddit for the window set by earliest_dt and latest_dt
+    """
+    monitored_subreddit = config['monitored_subreddit']
+    period_name = latest_dt.strftime('%B %Y')
+
+    # Optional: the id of a modlog entry (e.g. "ModAction_...") logged shortly after latest_dt, such as the last entry a previous run saw.
+    # If set, reading straight from Reddit starts right after that entry instead of paging through everything newer than the report window.
+    modlog_after = config.get('modlog_after')
+
+    # Initialize Reddit connection
+    with praw_reddit(**script_credentials(config)) as reddit:
+
+        with request_priority(BACKFILL):
+
+            # Get the modlog entries for the report window, either from the archive (after fetching what is new) or from Reddit
+            earliest_ts = earliest_dt.timestamp()
+            latest_ts = latest_dt.timestamp()
+            subreddit = reddit.subreddit(monitored_subreddit)
+            archive = open_modlog_archive(config)
+            modlog_items = None
+            if archive is not None:
+                with span('modlog_sync', subreddit=monitored_subreddit):
+                    added = archive.sync(subreddit, stop_before=earliest_ts)
+                logger.info(f"Added {added} new modlog entries to {archive.db_file}")
+                if archive.covers(monitored_subreddit, earliest_ts):
+                    modlog_items = archive.entries(monitored_subreddit, earliest_ts, latest_ts, REPORT_ACTIONS)
+                else:
+                    logger.error(f"{archive.db_file} does not go back to {earliest_dt}, reading the modlog from Reddit instead")
+            if modlog_items is None:
+                modlog_items = scan_modlog(subreddit, earliest_ts, latest_ts, after=modlog_after)
+
+            # Keep running counts as the entries stream in. Bans are picked up in the same pass.
+            aggregator = ModActionAggregator()
+            with span('aggregate', subreddit=monitored_subreddit):
+                for item in modlog_items:
+                    aggregator.add(item)
+
+        logger.info('Creating report...')
+        post_title = f"Moderation Transparency Report for {period_name}"
+        post_body_md = report_post_md(monitored_subreddit, period_name, aggregator)
+
+        # Optionally export the per-item data and bans as CSV files (this needs pandas)
+        export_prefix = config.get('export_csv_prefix')
+        if export_prefix:
+            aggregator.to_dataframe().to_csv(f"{export_prefix}_items.csv", index_label='target_fullname')
+            aggregator.bans_dataframe().to_csv(f"{export_prefix}_bans.csv", index=False)
+
+        # Post to Reddit
+        logger.info('Submitting post...')
+        print(f"\n{post_body_md}")
+        with span('submit_report', subreddit=monitored_subreddit):
+            new_post = reddit.subreddit(monitored_subreddit).submit(title=post_title, selftext=post_body_md, flair_id=REPORT_FLAIR_ID)
+            new_post.mod.distinguish()
+        logger.info('... Done')
+
+        # Update the wiki page
+        logger.info('Updating wiki...')
+        with span('update_wiki', subreddit=monitored_subreddit):
+            open_wiki_publisher(config).publish(
+                reddit.subreddit(monitored_subreddit), WIKI_REPORT, [report_link_md(period_name, new_post)]
+            )
+        logger.info(f"Timings: {span_summary()}")
+        logger.info('... All done.')
+
+
+#########################################################################################
+# Batch mode: report on several subreddits and periods, reading each modlog only once #
+#########################################################################################
+def parse_period(text):
+    """
+    Parses a report period: a month ('2022-07') or a quarter ('2022-Q3')
+
+    Returns
+    -------
+    (name, start timestamp, end timestamp), e.g. ('July 2022', ...), where the end is the start of the next period,
+    or None if the text is not a valid period
+    """
+    match = re.fullmatch(r'(\d{4})-(?:(\d{1,2})|[Qq]([1-4]))', text.strip())
+    if match is None:
+        return None
+    year = int(match.group(1))
+    if match.group(2) is not None:
+        first_month = int(match.group(2))
+        if not 1 <= first_month <= 12:
+            return None
+        month_count = 1
+    else:
+        first_month = (int(match.group(3)) - 1) * 3 + 1
+        month_count = 3
+    start = datetime(year=year, month=first_month, day=1, tzinfo=tzutc())
+    next_month = first_month - 1 + month_count
+    end = datetime(year=year + next_month // 12, month=next_month % 12 + 1, day=1, tzinfo=tzutc())
+    name = start.strftime('%B %Y') if month_count == 1 else f"Q{match.group(3)} {year}"
+    return name, start.timestamp(), end.timestamp()
+
+
+async def aggregate_subreddit(reddit, subreddit_name, periods, semaphore, archive=None, modlog_after=None):
+    """
+    Reads the modlog of one subreddit once, over the union of its report periods, and feeds each entry to the
+    aggregator of every period it falls in
+
+    Parameters
+    ----------
+    periods : list
+        (name, start timestamp, end timestamp) for each report period
+    archive : ModlogArchive (optional)
+        If given, the new entries are synced into the archive and the report is read from there
+    modlog_after : str (optional)
+        Without the archive, start reading the modlog right after this entry (see "modlog_after" in single_report)
+
+    Returns
+    -------
+    {period name: ModActionAggregator}
+    """
+    aggregators = {name: ModActionAggregator() for name, _, _ in periods}
+    earliest_ts = min(start for _, start, _ in periods)
+    latest_ts = max(end for _, _, end in periods)
+
+    def add(item):
+        for name, start, end in periods:
+            if start <= item.created_utc < end:
+                aggregators[name].add(item)
+
+    async with semaphore:
+        start_time = time.perf_counter()
+        subreddit = await reddit.subreddit(subreddit_name)
+        with request_priority(BACKFILL):
+            from_archive = False
+            if archive is not None:
+                async with span('modlog_sync', subreddit=subreddit_name):
+                    added = await archive.sync_async(subreddit, stop_before=earliest_ts)
+                logger.info(f"[r/{subreddit_name}] Added {added} new modlog entries to {archive.db_file}")
+                from_archive = archive.covers(subreddit_name, earliest_ts)
+                if not from_archive:
+                    logger.error(f"[r/{subreddit_name}] {archive.db_file} does not go back to the earliest period, reading the modlog from Reddit instead")
+            if from_archive:
+                with span('aggregate', subreddit=subreddit_name):
+                    for item in archive.entries(subreddit_name, earliest_ts, latest_ts, REPORT_ACTIONS):
+                        add(item)
+            else:
+                async with span('modlog_scan', subreddit=subreddit_name):
+                    async for item in scan_modlog_async(subreddit, earliest_ts, latest_ts, after=modlog_after):
+                        add(item)
+        logger.info(
+            f"[r/{subreddit_name}] Aggregated {', '.join(name for name, _, _ in periods)} "
+            f"in {time.perf_counter() - start_time:.2f}s"
+        )
+    return aggregators
+
+
+def report_link_md(period_name, post):
+    """
+    Returns the wiki list item linking to a report post
+    """
+    return f"- [{period_name}](https://reddit.com{post.permalink})"
+
+
+async def publish_reports(reddit, publisher, subreddit_name, reports, flair_id):
+    """
+    Submits the report posts of one subreddit, then adds links to all of them to its wiki pages
+
+    Parameters
+    ----------
+    reports : list
+        (period name, post markdown) for each report, in the order they should be listed on the wiki
+    """
+    subreddit = await reddit.subreddit(subreddit_name)
+    links_md = []
+    for period_name, post_body_md in reports:
+        with span('submit_report', subreddit=subreddit_name):
+            new_post = await subreddit.submit(
+                title=f"Moderation Transparency Report for {period_name}",
+                selftext=post_body_md,
+                flair_id=flair_id
+            )
+            await new_post.mod.distinguish()
+        logger.info(f"[r/{subreddit_name}] Submitted the report for {period_name}")
+        links_md.append(report_link_md(period_name, new_post))
+    with span('update_wiki', subreddit=subreddit_name):
+        await publisher.publish_async(subreddit, WIKI_REPORT, links_md)
+    logger.info(f"[r/{subreddit_name}] Updated r/{subreddit_name}/wiki/{WIKI_PAGE_NAME}")
+
+
+async def batch_report(config):
+    """
+    Runs every job in the "transparency_report_jobs" list of the config file, e.g.
+    {"subreddit": "orangetheory", "periods": ["2022-07", "2022-08", "2022-Q3"], "flair_id": "...", "modlog_after": "..."}
+    ("modlog_after" is optional, as in single_report). Each subreddit's modlog is read once for all of its periods, concurrently over one session (at most
+    "transparency_report_concurrency" subreddits at a time). The posts and wiki updates are only sent once
+    every report has been aggregated.
+    """
+    import asyncio
+
+    jobs = config['transparency_report_jobs']
+
+    # Group the periods by subreddit, so a subreddit listed in several jobs is still only read once
+    periods = {}
+    flair_ids = {}
+    modlog_afters = {}
+    for job in jobs:
+        subreddit_name = job['subreddit']
+        for text in job['periods']:
+            period = parse_period(text)
+            if period is None:
+                logger.error(f"Invalid period for r/{subreddit_name}: {text}")
+                sys.exit(1)
+            if period not in periods.setdefault(subreddit_name, []):
+                periods[subreddit_name].append(period)
+        flair_ids[subreddit_name] = job.get('flair_id', REPORT_FLAIR_ID)
+
+        # A cursor only fits the periods of its own job: if the jobs of a subreddit disagree, read from the top
+        if modlog_afters.setdefault(subreddit_name, job.get('modlog_after')) != job.get('modlog_after'):
+            logger.warning(f"Jobs for r/{subreddit_name} set different modlog_after cursors, reading its modlog from the newest entry")
+            modlog_afters[subreddit_name] = None
+
+    start = time.perf_counter()
+    semaphore = asyncio.Semaphore(config.get('transparency_report_concurrency', 4))
+    archive = open_modlog_archive(config)
+    publisher = open_wiki_publisher(config)
+    async with asyncpraw_reddit(**script_credentials(config)) as reddit:
+        subreddit_names = list(periods)
+        results = await asyncio.gather(
+            *(aggregate_subreddit(reddit, name, periods[name], semaphore, archive, modlog_afters[name]) for name in subreddit_names),
+            return_exceptions=True
+        )
+        logger.info(f"Aggregated {sum(len(p) for p in periods.values())} reports in {time.perf_counter() - start:.2f}s")
+
+        # Submit the posts and update the wikis once all the reading is done
+        for subreddit_name, result in zip(subreddit_names, results):
+            if isinstance(result, Exception):
+                logger.error(f"[r/{subreddit_name}] Error reading the modlog: {str(result)}")
+                continue
+            reports = [
+                (name, report_post_md(subreddit_name, name, result[name]))
+                for name, _, _ in sorted(periods[subreddit_name], key=lambda period: (period[1], period[2]))
+            ]
+            try:
+                await publish_reports(reddit, publisher, subreddit_name, reports, flair_ids[subreddit_name])
+            except Exception as e:
+                logger.error(f"[r/{subreddit_name}] Error submitting the reports: {str(e)}")
+
+    if archive is not None:
+        archive.close()
+    logger.info(f"Ran {len(jobs)} jobs in {time.perf_counter() - start:.2f}s")
+    logger.info(f"Timings: {span_summary()}")
+
+
+def main(argv=None):
+    """
+    Runs the report on the monitored subreddit, or the batch jobs with --batch
+    """
+    argv = sys.argv[1:] if argv is None else argv
+    config = load_config()
+    if '--batch' in argv:
+        import asyncio
+
+        asyncio.run(batch_report(config))
+    else:
+        single_report(config)
+
 
-# Connect to Reddit
-with praw.Reddit(
-    client_secret=reddit_client_secret,
-    client_id=reddit_client_id,
-    username=reddit_username,
-    password=reddit_password,
-    user_agent=reddit_user_agent
-) as reddit:
-
-    # Post to Reddit
-    print('Submitting post...')
-    print(f"\n{post_body_md}")
-    new_post = reddit.subreddit(monitored_subreddit).submit(title=post_title, selftext=post_body_md, flair_id='161cdb20-1a7d-11e8-affb-0e5c7ea2a678')
-    new_post.mod.distinguish()
-    print('... Done')
-
-    # Update the wiki page
-    print('Updating wiki...')
-    WIKI_PAGE_NAME = 'mod-transparency-reports'
-    wikipage = reddit.subreddit(monitored_subreddit).wiki[WIKI_PAGE_NAME]
-    updated_content_md = wikipage.content_md + f"\n- [{latest_dt.strftime('%B %Y')}](https://reddit.com{new_post.permalink})"
-    wikipage.edit(updated_content_md)
-    print('... All done.')
\ No newline at end of file
+if __name__ == "__main__":
+    main()
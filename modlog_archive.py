@@ -0,0 +1,320 @@
+"""
+Local SQLite archive of a subreddit's modlog.
+
+The archive remembers the newest modlog entry it has seen (the high-water mark), so each sync only downloads
+the entries logged since the previous one. Reports can then query any date range and any set of actions from
+disk instead of paging through the modlog on Reddit again.
+
+It also remembers how far back it goes (the oldest entry, and the time it is complete from). A sync asked to go
+further back than that (stop_before) pages on from the oldest archived entry with the listing's "after" cursor,
+down to stop_before, so a report on an earlier period does not come out empty.
+
+Usage: python modlog_archive.py [--db modlog.db] subreddit   (syncs the archive and prints a summary)
+"""
+
+import sqlite3
+from collections import namedtuple
+
+ModlogEntry = namedtuple(
+    'ModlogEntry',
+    ['id', 'created_utc', 'action', 'target_fullname', 'description', 'details', 'mod']
+)
+
+# Number of entries written to the database per transaction while syncing
+SYNC_BATCH_SIZE = 500
+
+
+class ModlogArchive:
+
+    SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS modlog ('
+        '    id TEXT PRIMARY KEY,'
+        '    subreddit TEXT NOT NULL,'
+        '    created_utc REAL NOT NULL,'
+        '    action TEXT NOT NULL,'
+        '    target_fullname TEXT,'
+        '    description TEXT,'
+        '    details TEXT,'
+        '    mod TEXT'
+        ')',
+        'CREATE INDEX IF NOT EXISTS modlog_subreddit_created ON modlog (subreddit, created_utc)',
+        'CREATE INDEX IF NOT EXISTS modlog_subreddit_action_created ON modlog (subreddit, action, created_utc)',
+        'CREATE TABLE IF NOT EXISTS sync_state ('
+        '    subreddit TEXT PRIMARY KEY,'
+        '    newest_id TEXT NOT NULL,'
+        '    newest_utc REAL NOT NULL,'
+        '    oldest_id TEXT,'
+        '    oldest_utc REAL'
+        ')',
+    )
+
+    def __init__(self, db_file: str = 'modlog.db'):
+        self.db_file = db_file
+        self.conn = sqlite3.connect(db_file)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        with self.conn:
+            for statement in self.SCHEMA:
+                self.conn.execute(statement)
+            self._upgrade()
+
+    def _upgrade(self):
+        """
+        Adds the coverage columns to archives created before they existed. The archive is taken to be complete from
+        its oldest entry.
+        """
+        columns = [row[1] for row in self.conn.execute('PRAGMA table_info(sync_state)')]
+        if 'oldest_utc' in columns:
+            return
+        self.conn.execute('ALTER TABLE sync_state ADD COLUMN oldest_id TEXT')
+        self.conn.execute('ALTER TABLE sync_state ADD COLUMN oldest_utc REAL')
+        self.conn.execute(
+            'UPDATE sync_state SET '
+            'oldest_id = (SELECT id FROM modlog WHERE modlog.subreddit = sync_state.subreddit ORDER BY created_utc LIMIT 1), '
+            'oldest_utc = (SELECT MIN(created_utc) FROM modlog WHERE modlog.subreddit = sync_state.subreddit)'
+        )
+
+    def high_water_mark(self, subreddit_name: str):
+        """
+        Returns (id, created_utc) of the newest entry synced for the subreddit, or None if it was never synced
+        """
+        row = self.conn.execute(
+            'SELECT newest_id, newest_utc FROM sync_state WHERE subreddit = ?',
+            (subreddit_name.lower(),)
+        ).fetchone()
+        return tuple(row) if row else None
+
+    def coverage(self, subreddit_name: str):
+        """
+        Returns (id of the oldest entry synced, time the archive is complete from) for the subreddit, or None if it
+        was never synced. The time is 0 once a sync reached the end of the modlog.
+        """
+        row = self.conn.execute(
+            'SELECT oldest_id, oldest_utc FROM sync_state WHERE subreddit = ?',
+            (subreddit_name.lower(),)
+        ).fetchone()
+        return tuple(row) if row and row[1] is not None else None
+
+    def covers(self, subreddit_name: str, start: float) -> bool:
+        """
+        Returns True if the archive holds every entry of the subreddit logged since start (up to the last sync)
+        """
+        coverage = self.coverage(subreddit_name)
+        return coverage is not None and coverage[1] <= start
+
+    def sync(self, subreddit, stop_before: float = None) -> int:
+        """
+        Downloads the modlog entries logged since the last sync and returns how many were added
+
+        Parameters
+        ----------
+        subreddit : praw.models.Subreddit
+            The subreddit whose modlog to sync
+        stop_before : float (optional)
+            Make sure the archive goes back to this timestamp (and not further on the first sync). Without it, the
+            first sync downloads the whole modlog.
+        """
+        state = _SyncState(self, subreddit.display_name.lower(), stop_before)
+
+        # The modlog is listed newest first, so we can stop as soon as we reach what we already have
+        for item in subreddit.mod.log(limit=None):
+            if not state.add(item):
+                break
+        else:
+            state.end_of_log()
+
+        # Then page on from the oldest entry we have, if the archive does not go back far enough
+        if state.start_backfill():
+            for item in subreddit.mod.log(limit=None, params={'after': state.backfill_after}):
+                if not state.add_older(item):
+                    break
+            else:
+                state.end_of_log()
+        return state.finish()
+
+    async def sync_async(self, subreddit, stop_before: float = None) -> int:
+        """
+        Same as sync(), for an asyncpraw subreddit
+        """
+        state = _SyncState(self, subreddit.display_name.lower(), stop_before)
+        async for item in subreddit.mod.log(limit=None):
+            if not state.add(item):
+                break
+        else:
+            state.end_of_log()
+        if state.start_backfill():
+            async for item in subreddit.mod.log(limit=None, params={'after': state.backfill_after}):
+                if not state.add_older(item):
+                    break
+            else:
+                state.end_of_log()
+        return state.finish()
+
+    def entries(self, subreddit_name: str, start: float = None, end: float = None, actions=None):
+        """
+        Yields the archived entries of the subreddit logged between start and end (inclusive), newest first
+
+        Parameters
+        ----------
+        subreddit_name : str
+            The subreddit name (do not include r/)
+        start, end : float (optional)
+            Timestamps bounding the query
+        actions : list (optional)
+            Only return entries for these actions, e.g. ['banuser', 'removelink']
+        """
+        query = 'SELECT id, created_utc, action, target_fullname, description, details, mod FROM modlog WHERE subreddit = ?'
+        params = [subreddit_name.lower()]
+        if start is not None:
+            query += ' AND created_utc >= ?'
+            params.append(start)
+        if end is not None:
+            query += ' AND created_utc <= ?'
+            params.append(end)
+        if actions:
+            query += f" AND action IN ({', '.join('?' * len(actions))})"
+            params.extend(actions)
+        query += ' ORDER BY created_utc DESC'
+        for row in self.conn.execute(query, params):
+            yield ModlogEntry(*row)
+
+    def count(self, subreddit_name: str) -> int:
+        return self.conn.execute('SELECT COUNT(*) FROM modlog WHERE subreddit = ?', (subreddit_name.lower(),)).fetchone()[0]
+
+    def _insert(self, rows):
+        before = self.conn.total_changes
+        with self.conn:
+            self.conn.executemany(
+                'INSERT OR IGNORE INTO modlog (id, subreddit, created_utc, action, target_fullname, description, details, mod) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                rows
+            )
+        return self.conn.total_changes - before
+
+    def close(self):
+        self.conn.close()
+
+
+class _SyncState:
+    """
+    The bookkeeping of one sync: which entries are new, and the batch of rows waiting to be written
+    """
+
+    def __init__(self, archive: ModlogArchive, subreddit_name: str, stop_before: float = None):
+        self.archive = archive
+        self.subreddit_name = subreddit_name
+        self.stop_before = stop_before
+        self.high_water_mark = archive.high_water_mark(subreddit_name)
+        self.coverage = archive.coverage(subreddit_name)
+        self.newest = None
+        self.oldest = None
+        self.reached_end = False
+        self.backfilling = False
+        self.added = 0
+        self.batch = []
+
+    def add(self, item) -> bool:
+        """
+        Queues a modlog entry for writing. Returns False once the entry is one we already have (or too old).
+        """
+        if self.high_water_mark is not None and (item.id == self.high_water_mark[0] or item.created_utc < self.high_water_mark[1]):
+            return False
+        if self.high_water_mark is None and self.stop_before is not None and item.created_utc < self.stop_before:
+            return False
+        if self.newest is None:
+            self.newest = (item.id, item.created_utc)
+
+        # On a later sync, these entries are newer than the archive: its oldest entry stays the same
+        if self.high_water_mark is None:
+            self.oldest = (item.id, item.created_utc)
+        self._queue(item)
+        return True
+
+    def end_of_log(self):
+        self.reached_end = True
+
+    def start_backfill(self) -> bool:
+        """
+        Returns True if the archive does not go back to stop_before, so older entries must be fetched after
+        backfill_after (the oldest entry we have)
+        """
+        if self.high_water_mark is None or self.stop_before is None or self.coverage is None:
+            return False
+        if self.coverage[1] <= self.stop_before:
+            return False
+        self.backfilling = True
+        self.reached_end = False
+        self.backfill_after = self.coverage[0]
+        return True
+
+    def add_older(self, item) -> bool:
+        """
+        Queues an entry older than the archive. Returns False once the entry is older than stop_before.
+        """
+        if item.created_utc < self.stop_before:
+            return False
+        self.oldest = (item.id, item.created_utc)
+        self._queue(item)
+        return True
+
+    def _queue(self, item):
+        self.batch.append((
+            item.id,
+            self.subreddit_name,
+            item.created_utc,
+            item.action,
+            item.target_fullname,
+            item.description,
+            item.details,
+            str(item.mod) if item.mod is not None else None
+        ))
+        if len(self.batch) >= SYNC_BATCH_SIZE:
+            self.added += self.archive._insert(self.batch)
+            self.batch = []
+
+    def finish(self) -> int:
+        """
+        Writes what is left of the batch and moves the high-water mark (and how far back the archive goes).
+        Returns how many entries were added.
+        """
+        if self.batch:
+            self.added += self.archive._insert(self.batch)
+            self.batch = []
+        newest = self.newest or self.high_water_mark
+        if newest is None:
+            return self.added
+
+        # The archive is complete down to stop_before (or to the beginning, if the log ended first)
+        if self.high_water_mark is None or self.backfilling:
+            oldest_id = self.oldest[0] if self.oldest is not None else self.coverage[0]
+            oldest_utc = 0 if self.reached_end or self.stop_before is None else self.stop_before
+        else:
+            oldest_id, oldest_utc = self.coverage or (None, None)
+
+        # Only move the marks once the entries are safely on disk
+        with self.archive.conn:
+            self.archive.conn.execute(
+                'INSERT OR REPLACE INTO sync_state (subreddit, newest_id, newest_utc, oldest_id, oldest_utc) VALUES (?, ?, ?, ?, ?)',
+                (self.subreddit_name, newest[0], newest[1], oldest_id, oldest_utc)
+            )
+        return self.added
+
+
+def main(argv=None):
+    import argparse
+    from config_loader import load_config, script_credentials
+    from token_cache import praw_reddit
+
+    parser = argparse.ArgumentParser(description='Sync the local modlog archive of a subreddit')
+    parser.add_argument('subreddit', help='The subreddit name (do not include r/)')
+    parser.add_argument('--db', default='modlog.db', help='SQLite database file (default: modlog.db)')
+    args = parser.parse_args(argv)
+
+    archive = ModlogArchive(args.db)
+    with praw_reddit(**script_credentials(load_config())) as reddit:
+        added = archive.sync(reddit.subreddit(args.subreddit))
+    print(f"Added {added} entries for r/{args.subreddit} ({archive.count(args.subreddit)} archived)")
+    archive.close()
+
+
+if __name__ == "__main__":
+    main()
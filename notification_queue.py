@@ -0,0 +1,236 @@
+"""
+Persistent queue of deleted-post notifications, and the sender that drains it.
+
+Finding a deleted post and telling the mods about it are separate steps: the deletion check only pushes an event
+onto the queue (a SQLite table, so nothing is lost if the bot restarts or Reddit is down), and NotificationSender
+sends the modmail in the background. Sends run with bounded concurrency, and a send that fails is retried with
+exponential backoff instead of waiting for the post's next deletion check.
+
+With a digest interval, the events of each subreddit are held for up to that long after the first one, and sent
+together in one call, so a burst of deletions (say, a spammer cleaning up 30 posts) becomes one digest modmail.
+A digest too long for one message is acknowledged message by message, so a failure part way through only retries
+the events that were not sent yet.
+"""
+
+import asyncio
+import sqlite3
+import time
+from collections import namedtuple
+
+from bot_logger import get_bot_logger
+
+NotificationEvent = namedtuple('NotificationEvent', ['fullname', 'subreddit_name', 'detected_utc', 'last_seen', 'attempts'])
+
+# Seconds before the first retry of a failed send; doubled on every further failure, up to MAX_RETRY_DELAY
+RETRY_DELAY = 30
+MAX_RETRY_DELAY = 60 * 60
+
+logger = get_bot_logger()
+
+
+class NotificationQueue:
+
+    SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS notifications ('
+        '    fullname TEXT PRIMARY KEY,'
+        '    subreddit TEXT NOT NULL,'
+        '    detected_utc REAL NOT NULL,'
+        '    last_seen REAL,'
+        '    attempts INTEGER NOT NULL DEFAULT 0,'
+        '    next_attempt REAL NOT NULL'
+        ')',
+        'CREATE INDEX IF NOT EXISTS notifications_next_attempt ON notifications (next_attempt)',
+    )
+
+    def __init__(self, db_file: str = 'notifications.db', subreddit_names: list = None):
+        """
+        Pass subreddit_names to only see the events of those subs, when several processes share the queue
+        """
+        self.db_file = db_file
+
+        # The connection may be used from an executor thread (one at a time), not just the one that opened it
+        self.conn = sqlite3.connect(db_file, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        with self.conn:
+            for statement in self.SCHEMA:
+                self.conn.execute(statement)
+        if subreddit_names is None:
+            self._scope, self._scope_args = '1', ()
+        else:
+            self._scope = f"subreddit IN ({', '.join('?' for _ in subreddit_names)})"
+            self._scope_args = tuple(subreddit_names)
+
+    def __len__(self):
+        return self.conn.execute(f"SELECT COUNT(*) FROM notifications WHERE {self._scope}", self._scope_args).fetchone()[0]
+
+    def push(self, subreddit_name: str, fullname: str, last_seen: float = None) -> bool:
+        """
+        Queues a notification about a deleted post. Returns False if one is already queued for the post.
+        """
+        now = time.time()
+        with self.conn:
+            cursor = self.conn.execute(
+                'INSERT OR IGNORE INTO notifications (fullname, subreddit, detected_utc, last_seen, next_attempt) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (fullname, subreddit_name, now, last_seen, now)
+            )
+        return cursor.rowcount == 1
+
+    def due(self, now: float = None) -> list:
+        """
+        Returns the events whose next attempt is due, oldest first
+        """
+        now = time.time() if now is None else now
+        rows = self.conn.execute(
+            'SELECT fullname, subreddit, detected_utc, last_seen, attempts FROM notifications '
+            f"WHERE next_attempt <= ? AND {self._scope} ORDER BY detected_utc",
+            (now,) + self._scope_args
+        )
+        return [NotificationEvent(*row) for row in rows]
+
+    def next_attempt(self) -> float:
+        """
+        Returns the time the next event is due, or None if the queue is empty
+        """
+        return self.conn.execute(f"SELECT MIN(next_attempt) FROM notifications WHERE {self._scope}", self._scope_args).fetchone()[0]
+
+    def done(self, fullnames: list):
+        with self.conn:
+            self.conn.executemany('DELETE FROM notifications WHERE fullname = ?', ((fullname,) for fullname in fullnames))
+
+    def retry(self, events: list, now: float = None):
+        """
+        Schedules the next attempt for events whose send failed, backing off exponentially per event
+        """
+        now = time.time() if now is None else now
+        with self.conn:
+            self.conn.executemany(
+                'UPDATE notifications SET attempts = attempts + 1, next_attempt = ? WHERE fullname = ?',
+                ((now + retry_delay(event.attempts), event.fullname) for event in events)
+            )
+
+    def close(self):
+        self.conn.close()
+
+
+def retry_delay(attempts: int) -> float:
+    """
+    Returns how long to wait before retrying a send that has already failed attempts times
+    """
+    return min(RETRY_DELAY * 2 ** attempts, MAX_RETRY_DELAY)
+
+
+class NotificationSender:
+    """
+    Drains a NotificationQueue in the background
+
+    Parameters
+    ----------
+    queue : NotificationQueue
+        The queue to drain
+    send : coroutine function
+        send(subreddit_name, events, acknowledge) notifies the mods of one subreddit about a list of events, and raises
+        if it fails. It awaits acknowledge(events) with the events it has notified the mods about as soon as they are
+        sent (e.g. after each message of a digest), so they are not sent again if a later message fails.
+    concurrency : int (optional)
+        How many sends may run at once
+    digest_interval : float (optional)
+        If set, how long (in seconds) to hold a subreddit's events after the first one, so they go out in one send
+    executor : concurrent.futures.Executor (optional)
+        Where to run the queue's database calls, to keep them off the event loop
+    """
+
+    def __init__(self, queue: NotificationQueue, send, concurrency: int = 4, digest_interval: float = 0, executor=None):
+        self.queue = queue
+        self.send = send
+        self.digest_interval = digest_interval
+        self.executor = executor
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.sent = 0
+        self.failed = 0
+        self._sending = set()
+        self._tasks = set()
+        self._wakeup = asyncio.Event()
+
+    async def _run_blocking(self, function, *args):
+        if self.executor is None:
+            return function(*args)
+        return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+
+    async def push(self, subreddit_name: str, fullname: str, last_seen: float = None):
+        """
+        Queues a notification and wakes the sender up
+        """
+        if await self._run_blocking(self.queue.push, subreddit_name, fullname, last_seen):
+            self._wakeup.set()
+
+    def _ready_groups(self, due_events: list, now: float):
+        """
+        Returns the (subreddit name, events) groups to send now, and when the next held group will be ready
+        """
+        groups = {}
+        for event in due_events:
+            if event.fullname not in self._sending:
+                key = event.subreddit_name if self.digest_interval else event.fullname
+                groups.setdefault(key, []).append(event)
+
+        ready = []
+        next_ready = None
+        for events in groups.values():
+
+            # Retries go out straight away, only fresh bursts wait for the rest of the digest
+            ready_at = min(event.detected_utc for event in events) + self.digest_interval
+            if any(event.attempts for event in events) or ready_at <= now:
+                ready.append((events[0].subreddit_name, events))
+            else:
+                next_ready = ready_at if next_ready is None else min(next_ready, ready_at)
+        return ready, next_ready
+
+    async def _send_group(self, subreddit_name: str, events: list):
+        try:
+            async with self.semaphore:
+                await self.send(subreddit_name, events, self._acknowledge)
+            await self._run_blocking(self.queue.done, [event.fullname for event in events])
+            self.sent += 1
+        except Exception as e:
+
+            # The events acknowledged before the failure are no longer queued, so only the rest are retried
+            await self._run_blocking(self.queue.retry, events)
+            self.failed += 1
+            logger.error(
+                f"Error sending modmail notification to [r/{subreddit_name}]: {str(e)}. "
+                f"Retrying in {retry_delay(min(event.attempts for event in events)):.0f}s"
+            )
+        finally:
+            self._sending.difference_update(event.fullname for event in events)
+            self._wakeup.set()
+
+    async def _acknowledge(self, events: list):
+        await self._run_blocking(self.queue.done, [event.fullname for event in events])
+
+    async def run(self):
+        """
+        Sends the queued notifications as they become due, forever
+        """
+        try:
+            while True:
+                self._wakeup.clear()
+                now = time.time()
+                ready, next_ready = self._ready_groups(await self._run_blocking(self.queue.due, now), now)
+                for subreddit_name, events in ready:
+                    self._sending.update(event.fullname for event in events)
+                    task = asyncio.create_task(self._send_group(subreddit_name, events))
+                    self._tasks.add(task)
+                    task.add_done_callback(self._tasks.discard)
+
+                # Sleep until something is pushed, a send finishes, or the next retry or digest is due
+                next_attempt = await self._run_blocking(self.queue.next_attempt)
+                wake_at = [at for at in (next_ready, next_attempt) if at is not None and at > now]
+                timeout = min(wake_at) - now if wake_at else None
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            for task in self._tasks:
+                task.cancel()
@@ -0,0 +1,260 @@
+"""
+Storage backends for the posts saved by report_deleted_posts.py.
+
+Both coroutines (the one saving new posts and the one checking for deleted posts) talk to a single store object,
+so the on-disk layout can be swapped without touching the bot logic.
+
+- JsonPostStore keeps the original layout: one <subreddit>/<fullname>.json file per post.
+- SQLitePostStore keeps every post in a single SQLite database (WAL mode), indexed by fullname, subreddit and created_utc.
+"""
+
+import json
+import os
+import sqlite3
+import time
+
+
+class PostStore:
+    """
+    Interface shared by all post storage backends
+
+    A saved post is a dict with the keys 'title', 'author', 'permalink', 'body', 'created_utc' and 'notified'.
+    """
+
+    def exists(self, subreddit_name: str, fullname: str) -> bool:
+        raise NotImplementedError
+
+    def save(self, subreddit_name: str, fullname: str, payload: dict) -> bool:
+        """
+        Saves a post unless it was saved before. Returns True if the post was written.
+        """
+        raise NotImplementedError
+
+    def load(self, subreddit_name: str, fullname: str) -> dict:
+        """
+        Returns the saved post, or None if there is no such post.
+        """
+        raise NotImplementedError
+
+    def mark_notified(self, subreddit_name: str, fullname: str):
+        raise NotImplementedError
+
+    def recent_fullnames(self, subreddit_name: str) -> list:
+        """
+        Returns the fullnames of all saved posts for the subreddit, newest first.
+        """
+        raise NotImplementedError
+
+    def unnotified_since(self, subreddit_name: str, created_after: float) -> list:
+        """
+        Returns (fullname, created_utc) for the saved posts created after the given time that nobody was notified about yet
+        """
+        raise NotImplementedError
+
+    def count(self, subreddit_name: str = None) -> int:
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+############################################################
+# Original layout: one JSON file per post, one dir per sub #
+############################################################
+def _json_fullnames(subreddit_dir):
+    """
+    Returns the fullnames of the posts saved in a subreddit dir, skipping any other file (e.g. .tmp or .DS_Store)
+    """
+    return [file_name[:-len('.json')] for file_name in os.listdir(subreddit_dir) if file_name.endswith('.json')]
+
+
+class JsonPostStore(PostStore):
+
+    def __init__(self, root_dir: str = '.'):
+        self.root_dir = root_dir
+
+    def _file_name(self, subreddit_name, fullname):
+        return os.path.join(self.root_dir, subreddit_name, f"{fullname}.json")
+
+    def exists(self, subreddit_name, fullname):
+        return os.path.exists(self._file_name(subreddit_name, fullname))
+
+    def save(self, subreddit_name, fullname, payload):
+        file_name = self._file_name(subreddit_name, fullname)
+        if os.path.exists(file_name):
+            return False
+        os.makedirs(os.path.dirname(file_name), exist_ok=True)
+        with open(file_name, 'w') as json_file:
+            json.dump(payload, json_file)
+        return True
+
+    def load(self, subreddit_name, fullname):
+        try:
+            with open(self._file_name(subreddit_name, fullname), 'r') as json_file:
+                return json.load(json_file)
+        except FileNotFoundError:
+            return None
+
+    def mark_notified(self, subreddit_name, fullname):
+        payload = self.load(subreddit_name, fullname)
+        if payload is None:
+            return
+        payload['notified'] = True
+        with open(self._file_name(subreddit_name, fullname), 'w') as json_file:
+            json.dump(payload, json_file)
+
+    def recent_fullnames(self, subreddit_name):
+        # Note: sorting by latest post relies on the post id name (also the filename).
+        subreddit_dir = os.path.join(self.root_dir, subreddit_name)
+        if not os.path.isdir(subreddit_dir):
+            return []
+        return sorted(_json_fullnames(subreddit_dir), reverse=True)
+
+    def unnotified_since(self, subreddit_name, created_after):
+        posts = []
+        for fullname in self.recent_fullnames(subreddit_name):
+            payload = self.load(subreddit_name, fullname)
+            if payload is None or payload.get('notified') is not None:
+                continue
+
+            # Files saved by older versions do not record when the post was created, so use the file time instead
+            created_utc = payload.get('created_utc') or os.path.getmtime(self._file_name(subreddit_name, fullname))
+            if created_utc > created_after:
+                posts.append((fullname, created_utc))
+        return posts
+
+    def count(self, subreddit_name=None):
+        if subreddit_name is not None:
+            return len(self.recent_fullnames(subreddit_name))
+        return sum(
+            len(_json_fullnames(os.path.join(self.root_dir, entry)))
+            for entry in os.listdir(self.root_dir)
+            if os.path.isdir(os.path.join(self.root_dir, entry))
+        )
+
+
+###########################################
+# Single SQLite database for all the subs #
+###########################################
+class SQLitePostStore(PostStore):
+
+    SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS posts ('
+        '    fullname TEXT PRIMARY KEY,'
+        '    subreddit TEXT NOT NULL,'
+        '    created_utc INTEGER NOT NULL,'
+        '    title TEXT,'
+        '    author TEXT,'
+        '    permalink TEXT,'
+        '    body TEXT,'
+        '    notified INTEGER NOT NULL DEFAULT 0'
+        ')',
+        'CREATE INDEX IF NOT EXISTS posts_subreddit_created ON posts (subreddit, created_utc DESC)',
+        'CREATE INDEX IF NOT EXISTS posts_created ON posts (created_utc)',
+    )
+
+    def __init__(self, db_file: str = 'posts.db'):
+        self.db_file = db_file
+
+        # The connection may be used from an executor thread (one at a time), not just the one that opened it
+        self.conn = sqlite3.connect(db_file, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        with self.conn:
+            for statement in self.SCHEMA:
+                self.conn.execute(statement)
+
+    @staticmethod
+    def _row(subreddit_name, fullname, payload):
+        return (
+            fullname,
+            subreddit_name,
+            int(payload.get('created_utc') or time.time()),
+            payload.get('title'),
+            payload.get('author'),
+            payload.get('permalink'),
+            payload.get('body'),
+            1 if payload.get('notified') else 0
+        )
+
+    def exists(self, subreddit_name, fullname):
+        row = self.conn.execute('SELECT 1 FROM posts WHERE fullname = ?', (fullname,)).fetchone()
+        return row is not None
+
+    def save(self, subreddit_name, fullname, payload):
+        with self.conn:
+            cursor = self.conn.execute(
+                'INSERT OR IGNORE INTO posts (fullname, subreddit, created_utc, title, author, permalink, body, notified) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                self._row(subreddit_name, fullname, payload)
+            )
+        return cursor.rowcount == 1
+
+    def save_many(self, rows):
+        """
+        Saves an iterable of (subreddit_name, fullname, payload) tuples in one transaction. Returns the number of new posts.
+        """
+        before = self.conn.total_changes
+        with self.conn:
+            self.conn.executemany(
+                'INSERT OR IGNORE INTO posts (fullname, subreddit, created_utc, title, author, permalink, body, notified) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (self._row(subreddit_name, fullname, payload) for subreddit_name, fullname, payload in rows)
+            )
+        return self.conn.total_changes - before
+
+    def load(self, subreddit_name, fullname):
+        row = self.conn.execute(
+            'SELECT title, author, permalink, body, created_utc, notified FROM posts WHERE fullname = ?',
+            (fullname,)
+        ).fetchone()
+        if row is None:
+            return None
+        payload = dict(row)
+        payload['notified'] = True if payload['notified'] else None
+        return payload
+
+    def mark_notified(self, subreddit_name, fullname):
+        with self.conn:
+            self.conn.execute('UPDATE posts SET notified = 1 WHERE fullname = ?', (fullname,))
+
+    def recent_fullnames(self, subreddit_name):
+        rows = self.conn.execute(
+            'SELECT fullname FROM posts WHERE subreddit = ? ORDER BY created_utc DESC',
+            (subreddit_name,)
+        )
+        return [row[0] for row in rows]
+
+    def unnotified_since(self, subreddit_name, created_after):
+        rows = self.conn.execute(
+            'SELECT fullname, created_utc FROM posts WHERE subreddit = ? AND created_utc > ? AND notified = 0',
+            (subreddit_name, int(created_after))
+        )
+        return [tuple(row) for row in rows]
+
+    def count(self, subreddit_name=None):
+        if subreddit_name is None:
+            return self.conn.execute('SELECT COUNT(*) FROM posts').fetchone()[0]
+        return self.conn.execute('SELECT COUNT(*) FROM posts WHERE subreddit = ?', (subreddit_name,)).fetchone()[0]
+
+    def close(self):
+        self.conn.close()
+
+
+def get_post_store(backend: str = 'sqlite', path: str = None) -> PostStore:
+    """
+    Returns a post store for the given backend name
+
+    Parameters
+    ----------
+    backend : str
+        Either 'sqlite' or 'json'
+    path : str (optional)
+        The database file for 'sqlite' (default posts.db) or the root directory for 'json' (default .)
+    """
+    if backend == 'sqlite':
+        return SQLitePostStore(path or 'posts.db')
+    elif backend == 'json':
+        return JsonPostStore(path or '.')
+    raise ValueError(f"Unknown post store backend: [{backend}]")
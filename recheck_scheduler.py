@@ -0,0 +1,152 @@
+"""
+Age-tiered scheduler for re-checking saved posts.
+
+Fresh posts are the ones most likely to be deleted, so they are re-checked often. As a post gets older it is
+re-checked less and less often, and once it is older than the last tier it is retired and never checked again.
+This keeps the number of reddit.info() requests per cycle roughly flat no matter how many posts were archived.
+
+Posts are kept in a priority queue ordered by the time they are next due. When the due posts do not fill a whole
+info() request (up to 100 ids), the batch is topped up with the posts that are due next, since checking them
+early costs nothing extra.
+"""
+
+import heapq
+import time
+
+# (maximum post age in seconds, seconds between checks) for each tier, youngest first
+DEFAULT_TIERS = (
+    (60 * 60, 60),                   # Every minute for the first hour
+    (24 * 60 * 60, 60 * 60),         # Every hour for the first day
+    (7 * 24 * 60 * 60, 24 * 60 * 60) # Every day for the first week, then retire
+)
+
+# Maximum number of ids Reddit accepts in a single /api/info request
+INFO_BATCH_SIZE = 100
+
+
+class RecheckEntry:
+    __slots__ = ('fullname', 'subreddit_name', 'created_utc', 'due', 'checked')
+
+    def __init__(self, fullname, subreddit_name, created_utc, due, checked=None):
+        self.fullname = fullname
+        self.subreddit_name = subreddit_name
+        self.created_utc = created_utc
+        self.due = due
+        self.checked = checked  # The last time the post was seen, i.e. when it was queued or last re-checked
+
+    def __lt__(self, other):
+        return self.due < other.due
+
+
+class RecheckScheduler:
+    """
+    Priority queue of posts to re-check, ordered by next due time
+
+    Parameters
+    ----------
+    tiers : tuple (optional)
+        (maximum post age, seconds between checks) pairs, youngest first. Posts older than the last tier are retired.
+    batch_size : int (optional)
+        The number of ids per info() request
+    """
+
+    def __init__(self, tiers=DEFAULT_TIERS, batch_size=INFO_BATCH_SIZE):
+        self.tiers = tiers
+        self.batch_size = batch_size
+        self._heap = []
+        self._entries = {}
+        self.retired = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, fullname):
+        return fullname in self._entries
+
+    def interval(self, age: float) -> float:
+        """
+        Returns the number of seconds until the next check of a post of the given age, or None if it should retire
+        """
+        for max_age, interval in self.tiers:
+            if age < max_age:
+                return interval
+        return None
+
+    def add(self, fullname: str, subreddit_name: str, created_utc: float, now: float = None):
+        """
+        Schedules the first re-check of a post. Posts that are already scheduled or too old to check are ignored.
+        """
+        if fullname in self._entries:
+            return
+        now = time.time() if now is None else now
+        interval = self.interval(now - created_utc)
+        if interval is None:
+            self.retired += 1
+            return
+        self._push(RecheckEntry(fullname, subreddit_name, created_utc, min(created_utc + interval, now + interval), now))
+
+    def discard(self, fullname: str):
+        """
+        Stops re-checking a post, e.g. because it was deleted and the mods were notified.
+        """
+        self._entries.pop(fullname, None)
+
+    def reschedule(self, entry: RecheckEntry, now: float = None):
+        """
+        Schedules the next re-check of a post that was just checked, or retires it if it is old enough
+        """
+        if entry.fullname in self._entries:
+            return
+        now = time.time() if now is None else now
+        interval = self.interval(now - entry.created_utc)
+        if interval is None:
+            self.retired += 1
+            return
+        entry.due = now + interval
+        entry.checked = now
+        self._push(entry)
+
+    def next_due(self) -> float:
+        """
+        Returns the time the next post is due, or None if nothing is scheduled
+        """
+        self._drop_discarded()
+        return self._heap[0].due if self._heap else None
+
+    def due_batches(self, now: float = None) -> list:
+        """
+        Removes the posts that are due and returns them in lists of up to batch_size entries
+
+        The last batch is topped up with the posts that are due next so that no info() request is wasted.
+        Call reschedule() for every returned entry once it has been checked.
+        """
+        now = time.time() if now is None else now
+        due = []
+        while True:
+            self._drop_discarded()
+            if not self._heap or self._heap[0].due > now:
+                break
+            due.append(self._pop())
+
+        if due:
+            while len(due) % self.batch_size:
+                self._drop_discarded()
+                if not self._heap:
+                    break
+                due.append(self._pop())
+
+        return [due[i:i + self.batch_size] for i in range(0, len(due), self.batch_size)]
+
+    def _push(self, entry):
+        self._entries[entry.fullname] = entry
+        heapq.heappush(self._heap, entry)
+
+    def _pop(self):
+        entry = heapq.heappop(self._heap)
+        del self._entries[entry.fullname]
+        return entry
+
+    def _drop_discarded(self):
+        # Discarded posts stay in the heap until they reach the top
+        while self._heap and self._entries.get(self._heap[0].fullname) is not self._heap[0]:
+            heapq.heappop(self._heap)
@@ -1,37 +1,73 @@
 """
 Use this program to generate refresh tokens that our bot will need to use
 Best to run this locally because it is only needed when you initially set up the bot
+
+The Flask app is only built when it is first needed (by main(), or by a WSGI server loading reddit_auth:application),
+so importing this module does not import Flask and praw or read the config file.
 """
 
-from flask import Flask, request
-import praw
 from bot_logger import get_bot_logger
-import json
+from config_loader import load_config
 from random import randint
 import sys
 
-application = Flask(__name__)
-app = application
+logger = get_bot_logger()
 
-#######################################################################################
-# This API endpoint is used to request a Reddit refresh token for a mod using the bot #
-#######################################################################################
-@app.route('/api/authorize', methods=['GET'])
-def authorize_bot():
-    
+
+def create_app(config):
+    """
+    Returns the Flask app serving the two endpoints below, with the app credentials from the config file
+    """
+    from flask import Flask, request
+    import praw
+
+    app = Flask(__name__)
+    logger.info('Initializing api endpoints')
+    logger.info('Loading environment variables from config file')
+    APP_CLIENT_ID = config['app_client_id']
+    APP_CLIENT_SECRET = config['app_client_secret']
+    APP_REDIRECT_URI = config['app_redirect_uri']
+    APP_USER_AGENT = config['app_user_agent']
+
+    # Generate random number to be used for verifying auth requests
+    APP_AUTH_STATE = str(randint(1, 65000))
+
+    #######################################################################################
+    # This API endpoint is used to request a Reddit refresh token for a mod using the bot #
+    #######################################################################################
+    @app.route('/api/authorize', methods=['GET'])
+    def authorize_bot():
+        return authorization_page(praw.Reddit(
+            redirect_uri=APP_REDIRECT_URI,
+            user_agent=APP_USER_AGENT,
+            client_id=APP_CLIENT_ID,
+            client_secret=APP_CLIENT_SECRET
+        ), APP_AUTH_STATE)
+
+    ##########################################################################################################
+    # This endpoint receives a refresh token from Reddit when the app is authorized and shows it to the user #
+    ##########################################################################################################
+    @app.route('/api/token', methods=['GET'])
+    def receive_token():
+        return token_page(praw.Reddit(
+            redirect_uri=APP_REDIRECT_URI,
+            user_agent=APP_USER_AGENT,
+            client_id=APP_CLIENT_ID,
+            client_secret=APP_CLIENT_SECRET
+        ), request.args, APP_AUTH_STATE, APP_REDIRECT_URI)
+
+    return app
+
+
+def authorization_page(prawddit, state):
+    """
+    Returns the page with the link that sends the mod to Reddit to authorize the bot
+    """
     REDDIT_OAUTH_SCOPES = ['read', 'wikiread', 'wikiedit']  # List of scopes: https://praw.readthedocs.io/en/stable/tutorials/refresh_token.html
     scopes = REDDIT_OAUTH_SCOPES 
 
     # Call Reddit to authorize the bot
     logger.info('Generating auth url')
-    prawddit = praw.Reddit(
-        redirect_uri=APP_REDIRECT_URI,
-        user_agent=APP_USER_AGENT,
-        client_id=APP_CLIENT_ID,
-        client_secret=APP_CLIENT_SECRET
-
-    )
-    state = APP_AUTH_STATE
     url = prawddit.auth.url(duration="permanent", scopes=scopes, state=state)
     logger.info(f"Auth url: {url}")
 
@@ -43,28 +79,22 @@ def authorize_bot():
     )
     return page_html
 
-##########################################################################################################
-# This endpoint receives a refresh token from Reddit when the app is authorized and shows it to the user #
-##########################################################################################################
-@app.route('/api/token', methods=['GET'])
-def receive_token():
+
+def token_page(prawddit, args, state, redirect_uri):
+    """
+    Returns the page showing the refresh token Reddit sent back, or the error if the request is not valid
+    """
     logger.info('Received token request')
     
     # If the request is valid, display the auth token to the user
     error_getting_token = False
-    if request.args.get('state') == APP_AUTH_STATE:
+    if args.get('state') == state:
         logger.info('Request is valid')        
         
         # Get refresh token from Reddit
         logger.info('Getting refresh token from Reddit')
-        prawddit = praw.Reddit(
-            redirect_uri=APP_REDIRECT_URI,
-            user_agent=APP_USER_AGENT,
-            client_id=APP_CLIENT_ID,
-            client_secret=APP_CLIENT_SECRET
-        )
         try:
-            refresh_token = prawddit.auth.authorize(request.args.get('code'))       
+            refresh_token = prawddit.auth.authorize(args.get('code'))       
             page_html = (
                 '<h1>Success!</h1>'
                 f"<p>Your referesh token is {refresh_token}</p>"
@@ -78,39 +108,43 @@ def receive_token():
     
     # If there was an error, construct error message
     if error_getting_token:
-        logger.info(f"Bad request with error [{request.args.get('error')}]")
+        logger.info(f"Bad request with error [{args.get('error')}]")
         page_html = (
             '<h1>This Did Not Work!</h1>'
-            f"<p>Reddit returned the following error message: {request.args.get('error')}</p>"
-            f"<p>If you want to try again, <a href={APP_REDIRECT_URI}/api/authorize>click here</a>.</p>"
+            f"<p>Reddit returned the following error message: {args.get('error')}</p>"
+            f"<p>If you want to try again, <a href={redirect_uri}/api/authorize>click here</a>.</p>"
         )
 
     return page_html 
 
+
 ################
 # Main program #
 ################
+_application = None
+
+
+def __getattr__(name):
+    """
+    Builds the app the first time reddit_auth.application (or .app) is looked up, e.g. by a WSGI server
+    """
+    global _application
+    if name in ('application', 'app'):
+        if _application is None:
+            _application = create_app(load_config())
+        return _application
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def main():
+    logger.info('Python version is %s.%s.%s' % sys.version_info[:3])
+    app = create_app(load_config())
+
+    # Start flask and wait for user to hit any of the endpoints
+    logger.info('Starting Flask')
+    logger.info('Ready to receive api requests!')
+    app.run(port=5555)
+
 
-# Set up logging
-logger = get_bot_logger()
-logger.info('Python version is %s.%s.%s' % sys.version_info[:3])
-logger.info('Initializing api endpoints')
-
-# Retrieve settings and secrets from a local_config.json file (make sure to add this file to .gitignore)
-CONFIG_FILE='local_config.json'
-with open(CONFIG_FILE) as config_file:
-    config = json.load(config_file)
-logger.info('Loading environment variables from config file') 
-APP_CLIENT_ID = config['app_client_id']
-APP_CLIENT_SECRET = config['app_client_secret']
-APP_REDIRECT_URI = config['app_redirect_uri']
-APP_USER_AGENT = config['app_user_agent']
-
-# Generate random number to be used for verifying auth requests
-APP_AUTH_STATE = str(randint(1, 65000))
-
-# Start flask and wait for user to hit any of the endpoints
-logger.info('Starting Flask')
-logger.info('Ready to receive api requests!')
 if __name__ == "__main__":
-    app.run(port=5555)
\ No newline at end of file
+    main()
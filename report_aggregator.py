@@ -0,0 +1,305 @@
+"""
+Streaming aggregation of modlog entries for the moderation transparency report.
+
+Entries are fed in one at a time, newest first (the order Reddit lists the modlog in), and the aggregator keeps
+running counts of the numbers the report needs, so nothing has to be collected into a DataFrame first.
+pandas is only imported when a DataFrame is explicitly asked for (to_dataframe / bans_dataframe), e.g. to export data.
+
+A busy sub logs hundreds of thousands of entries a month, so the per-item records are kept compact: one row per
+target in a few column arrays (see ItemRecords), with the type, action and removal reason stored as small integer
+codes, strings interned once in a StringTable, and timestamps stored as whole seconds.
+"""
+
+from array import array
+from collections import Counter
+from datetime import datetime
+from dateutil.tz import tzutc
+
+MOD_ACTIONS = {
+    'approvelink': 'approve',
+    'approvecomment': 'approve',
+    'removelink': 'remove',
+    'removecomment': 'remove'
+}
+
+# Item kinds are coded as type * 2 + mod action, e.g. 3 for a removed comment
+ITEM_TYPES = ('post', 'comment')
+ITEM_ACTIONS = ('approve', 'remove')
+ACTION_CODES = {action: ITEM_ACTIONS.index(mod_action) for action, mod_action in MOD_ACTIONS.items()}
+NO_KIND = 255  # No approve/remove seen for the item yet (only a removal reason)
+
+BASE36_DIGITS = '0123456789abcdefghijklmnopqrstuvwxyz'
+
+
+class StringTable:
+    """
+    Interns strings as integer codes, so each distinct value is stored once. Code 0 stands for None.
+    """
+    __slots__ = ('strings', 'codes')
+
+    def __init__(self):
+        self.strings = [None]
+        self.codes = {None: 0}
+
+    def code(self, value) -> int:
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.strings)
+            self.strings.append(value)
+        return code
+
+    def __getitem__(self, code: int):
+        return self.strings[code]
+
+
+class ItemRecords:
+    """
+    One row per target item, stored in column arrays: kind code, removal reason code and timestamp
+
+    Rows are looked up by target key: comment and post fullnames are packed into an int (see target_key),
+    which takes far less memory than the fullname string.
+    """
+    __slots__ = ('rows', 'kinds', 'reasons', 'timestamps')
+
+    def __init__(self):
+        self.rows = {}                   # target key -> row
+        self.kinds = array('B')          # kind code, or NO_KIND
+        self.reasons = array('I')        # StringTable code of the removal reason
+        self.timestamps = array('q')     # created_utc of the approve/remove, in whole seconds
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def row(self, key) -> int:
+        """
+        Returns the row of the target, adding an empty one if it is new
+        """
+        row = self.rows.get(key)
+        if row is None:
+            row = self.rows[key] = len(self.kinds)
+            self.kinds.append(NO_KIND)
+            self.reasons.append(0)
+            self.timestamps.append(0)
+        return row
+
+
+def target_key(fullname: str):
+    """
+    Packs a comment or post fullname into an int (base 36 id * 2, plus 1 for comments). Other fullnames are kept as is.
+    """
+    if fullname is not None and fullname[:3] in ('t1_', 't3_'):
+        try:
+            return int(fullname[3:], 36) * 2 + (fullname[1] == '1')
+        except ValueError:
+            pass
+    return fullname
+
+
+def target_fullname(key) -> str:
+    """
+    The fullname packed by target_key()
+    """
+    if not isinstance(key, int):
+        return key
+    number, digits = key >> 1, ''
+    while True:
+        number, digit = divmod(number, 36)
+        digits = BASE36_DIGITS[digit] + digits
+        if number == 0:
+            break
+    return ('t1_' if key & 1 else 't3_') + digits
+
+
+class ModActionAggregator:
+    """
+    Running counts of mod actions, removal reasons and bans
+
+    The report only considers "items" as opposed to "mod actions". For example: if a mod removed a post, added a
+    removal reason, then changed their mind and approved the post, the item only counts as approved.
+    Since entries arrive newest first, the first approve/remove seen for an item wins. For removal reasons, the last
+    one seen (i.e. the oldest) wins, which matches how the report has always worked.
+    """
+
+    def __init__(self):
+        self.strings = StringTable()    # removal reasons, ban reasons and ban durations
+        self.items = ItemRecords()
+        self.kind_counts = Counter()    # kind code -> count
+        self.reason_counts = Counter()  # (kind code, reason code) -> count
+        self.ban_counts = Counter()     # (reason, duration) -> count
+
+        # Bans, one entry per column: whole-second timestamp, reason code, duration code
+        self.ban_timestamps = array('q')
+        self.ban_reasons = array('I')
+        self.ban_durations = array('I')
+
+    def add(self, item):
+        """
+        Adds a modlog entry (anything with action, target_fullname, description, details and created_utc attributes)
+        """
+        action = item.action
+        if action == 'banuser':
+            self._add_ban(item)
+            return
+        if action != 'addremovalreason' and action not in MOD_ACTIONS:
+            return
+
+        items = self.items
+        row = items.row(target_key(item.target_fullname))
+        kind = items.kinds[row]
+        if kind != NO_KIND:
+            self._count(kind, items.reasons[row], -1)
+
+        if action == 'addremovalreason':
+            items.reasons[row] = self.strings.code(item.description)
+        elif kind == NO_KIND:
+            item_type = 1 if item.target_fullname.startswith('t1_') else 0
+            kind = items.kinds[row] = item_type * 2 + ACTION_CODES[action]
+            items.timestamps[row] = int(item.created_utc)
+
+        if kind != NO_KIND:
+            self._count(kind, items.reasons[row], 1)
+
+    def _count(self, kind, reason, delta):
+        self.kind_counts[kind] += delta
+        if reason:
+            self.reason_counts[(kind, reason)] += delta
+
+    def _add_ban(self, item):
+        reason = (item.description or '').split(':')[0]
+
+        # Clean up BotDefense ban reasons
+        if '/u/' in reason:
+            reason = 'Unauthorized bot'
+        self.ban_timestamps.append(int(item.created_utc))
+        self.ban_reasons.append(self.strings.code(reason))
+        self.ban_durations.append(self.strings.code(item.details))
+        if item.details is not None:
+            self.ban_counts[(reason, item.details)] += 1
+
+    @property
+    def ban_count(self) -> int:
+        return len(self.ban_timestamps)
+
+    def count(self, item_type: str, mod_action: str) -> int:
+        """
+        Returns the number of items of the given type ('post' or 'comment') and action ('approve' or 'remove')
+        """
+        return self.kind_counts[ITEM_TYPES.index(item_type) * 2 + ITEM_ACTIONS.index(mod_action)]
+
+    def has_type(self, item_type: str) -> bool:
+        type_code = ITEM_TYPES.index(item_type)
+        return any(count > 0 for kind, count in self.kind_counts.items() if kind >> 1 == type_code)
+
+    def removal_reasons(self, item_type: str) -> list:
+        """
+        Returns (removal_reason, count) for removed items of the given type, most common first
+        """
+        removed_kind = ITEM_TYPES.index(item_type) * 2 + ITEM_ACTIONS.index('remove')
+        reasons = sorted(
+            (self.strings[reason], count) for (kind, reason), count in self.reason_counts.items()
+            if kind == removed_kind and count > 0
+        )
+        return sorted(reasons, key=lambda reason_count: reason_count[1], reverse=True)
+
+    ###################
+    # Markdown output #
+    ###################
+    def removals_md(self, item_type: str, heading: str, reviewed_text: str) -> str:
+        """
+        Returns the removal summary section for posts or comments, or '' if there were none
+
+        Parameters
+        ----------
+        item_type : str
+            'post' or 'comment'
+        heading : str
+            The section heading, e.g. 'Post Removals'
+        reviewed_text : str
+            How the items came to the moderators' attention, e.g. 'posts were reviewed by the moderators'
+        """
+        if not self.has_type(item_type):
+            return ''
+        approved = self.count(item_type, 'approve')
+        removed = self.count(item_type, 'remove')
+        total = approved + removed
+        md = (
+            f"## {heading}\n"
+            f"A total of **{total}** {reviewed_text}, of which **{removed}** "
+            f"({int(round(removed / total * 100, 0))}%) were removed for the following reasons:  \n"
+        )
+        for removal_reason, count in self.removal_reasons(item_type):
+            md += f"- {removal_reason}: **{count}** ({int(round(count / removed * 100, 0))}%)  \n"
+        return md
+
+    def bans_md(self) -> str:
+        """
+        Returns the ban summary section with a table of bans by reason and duration, or '' if there were none
+        """
+        if not self.ban_count:
+            return ''
+        reasons = sorted(set(reason for reason, _ in self.ban_counts))
+        durations = sorted(set(duration for _, duration in self.ban_counts))
+        rows = [[reason] + [self.ban_counts[(reason, duration)] for duration in durations] for reason in reasons]
+        return (
+            '## Bans\n'
+            f"A total of **{self.ban_count}** bans were issued by the moderators. The table below breaks them down by reason and duration:  \n\n"
+            + markdown_table(['reason'] + durations, rows)
+        )
+
+    ##########################
+    # Exports (needs pandas) #
+    ##########################
+    def to_dataframe(self):
+        """
+        Returns the per-item data as a pandas DataFrame indexed by target fullname
+        """
+        import pandas as pd
+        items = self.items
+        rows = {}
+        for key, row in items.rows.items():
+            kind = items.kinds[row]
+            if kind == NO_KIND:
+                rows[target_fullname(key)] = [None, None, self.strings[items.reasons[row]], None]
+            else:
+                rows[target_fullname(key)] = [
+                    ITEM_TYPES[kind >> 1],
+                    ITEM_ACTIONS[kind & 1],
+                    self.strings[items.reasons[row]],
+                    datetime.fromtimestamp(items.timestamps[row], tz=tzutc()).strftime('%Y/%m/%d')
+                ]
+        return pd.DataFrame.from_dict(
+            rows,
+            orient='index',
+            columns=['type', 'mod_action', 'removal_reason', 'date_time']
+        )
+
+    def bans_dataframe(self):
+        import pandas as pd
+        return pd.DataFrame({
+            'timestamp': self.ban_timestamps,
+            'reason': [self.strings[code] for code in self.ban_reasons],
+            'duration': [self.strings[code] for code in self.ban_durations]
+        }, columns=['timestamp', 'reason', 'duration'])
+
+
+def markdown_table(headers: list, rows: list) -> str:
+    """
+    Returns a markdown (pipe) table laid out the same way as pandas' DataFrame.to_markdown():
+    text columns are left-aligned, number columns are right-aligned, and headers get at least two spaces of padding.
+    """
+    columns = list(zip(headers, *rows))
+    numeric = [all(isinstance(value, (int, float)) for value in column[1:]) for column in columns]
+    widths = [max([len(str(column[0])) + 2] + [len(str(value)) for value in column[1:]]) for column in columns]
+
+    def format_row(values):
+        cells = [
+            str(value).rjust(width) if is_numeric else str(value).ljust(width)
+            for value, width, is_numeric in zip(values, widths, numeric)
+        ]
+        return '| ' + ' | '.join(cells) + ' |'
+
+    separator = '|' + '|'.join(
+        '-' * (width + 1) + ':' if is_numeric else ':' + '-' * (width + 1)
+        for width, is_numeric in zip(widths, numeric)
+    ) + '|'
+    return '\n'.join([format_row(headers), separator] + [format_row(row) for row in rows])
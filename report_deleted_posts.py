@@ -6,191 +6,724 @@ including the original text of the post.
 
 """
 
-import asyncpraw
-import json
 import asyncio
+import functools
 import os
+import signal
+import subprocess
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from post_store import get_post_store
+from recheck_scheduler import RecheckScheduler
+from request_scheduler import INGESTION, NOTIFICATION, RECHECK, count_requests, get_scheduler, request_priority
+from token_cache import asyncpraw_reddit
+from bot_logger import get_bot_logger, span, span_summary
+from bot_metrics import MetricsRegistry, serve_metrics
+from notification_queue import NotificationQueue, NotificationSender
+from stream_checkpoint import StreamCheckpoints
+from config_loader import load_config, script_credentials
+
+# Longest "a+b+c" multireddit name we ask Reddit to stream. Longer lists of subs are split into several streams.
+MULTIREDDIT_MAX_LENGTH = 1000
+
+# Longest modmail message Reddit accepts. Digests that are longer are split into several messages.
+MODMAIL_MAX_LENGTH = 10000
+DIGEST_SEPARATOR = '\n\n---\n\n'
+
+# Most posts to fetch when filling the gap after a restart (Reddit does not list further back than 1000 posts)
+GAP_FILL_LIMIT = 1000
+
+# Seconds to wait before restarting a stream that failed
+STREAM_RESTART_DELAY = 10
+
+# Fields we need from each post. The submission listing normally includes all of them.
+REQUIRED_POST_FIELDS = ('title', 'author', 'permalink', 'selftext', 'created_utc')
+
+# How many extra requests we saved by using the listing data instead of calling post.load() for every post
+INGEST_STATS = {'loads_avoided': 0, 'enrichment_requests': 0, 'replays_dropped': 0, 'gap_fill_requests': 0}
+
+logger = get_bot_logger()
+
+# Store and file I/O (and the JSON encoding that goes with it) runs on this thread, so a slow disk does not stall
+# the event loop. One thread, because the SQLite connections must not be used by two threads at once.
+STORE_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix='store')
+
+
+async def run_blocking(function, *args):
+    return await asyncio.get_running_loop().run_in_executor(STORE_EXECUTOR, function, *args)
+
+# Served at http://127.0.0.1:<metrics_port>/metrics when "metrics_port" is set in the config file (see bot_metrics.py)
+METRICS = MetricsRegistry('deleted_posts_')
+INGESTION_LAG = METRICS.histogram('ingestion_lag_seconds', 'Time from a post being created to it being saved')
+RECHECK_LAG = METRICS.histogram('recheck_lag_seconds', 'Time from a post being due for a deletion check to it being checked')
+NOTIFICATION_LATENCY = METRICS.histogram(
+    'notification_latency_seconds',
+    'Time from the last check that saw a post to the modmail about its deletion going out (an upper bound on the time since it was deleted)'
+)
+
+
+###########################################################
+# Build the payload we save from the data we already have #
+###########################################################
+def post_payload(post):
+    """
+    Returns the payload to save for the post, or None if the listing did not include everything we need
+    """
+    data = vars(post)
+    if any(field not in data for field in REQUIRED_POST_FIELDS):
+        return None
+    author = data['author']
+    return {
+        'title': data['title'],
+        'author': author.name if author is not None else '[deleted]',
+        'permalink': data['permalink'],
+        'body': data['selftext'],
+        'created_utc': int(data['created_utc'])
+    }
+
+
+#########################################################
+# Save a post so we can report on it if it gets deleted #
+#########################################################
+async def save_post(subreddit_name, fullname, payload, scheduler):
+    """
+    Returns True if the post is in the store (saved now or before), False if saving it failed
+    """
+    try:
+        logger.info(f"Saving post: [r/{subreddit_name}]: [{fullname}]")
+
+        # If the post was already saved, we don't want to overwrite! save() leaves it alone and returns False.
+        with span('save_post', subreddit=subreddit_name):
+            saved = await run_blocking(POST_STORE.save, subreddit_name, fullname, payload)
+        if saved:
+            INGESTION_LAG.observe(max(time.time() - payload['created_utc'], 0))
+            scheduler.add(fullname, subreddit_name, payload['created_utc'])
+        return True
+    
+    except:
+        
+        # If there was an error saving the post, report it and move on.
+        logger.error(f"Error saving post: [r/{subreddit_name}]: [{fullname}]")
+        return False
+
+
+async def store_post(subreddit_name, fullname, created_utc, payload, scheduler, incomplete_posts):
+    """
+    Saves a post and marks it seen. If saving fails, the post is queued with the posts missing data to be tried again.
+    """
+    if await save_post(subreddit_name, fullname, payload, scheduler):
+        CHECKPOINTS.mark_seen(subreddit_name, fullname, created_utc)
+        incomplete_posts.pop(fullname, None)
+    else:
+        incomplete_posts[fullname] = subreddit_name
+
+
+###############################################################
+# Save a post from the stream, or queue it if data is missing #
+###############################################################
+async def ingest_post(subreddit_name, post, scheduler, incomplete_posts, filling_gap=False):
+
+    # Replays of posts we already ingested are dropped before touching the store (see stream_checkpoint.py)
+    if CHECKPOINTS.is_replay(subreddit_name, post.fullname, None if filling_gap else post.created_utc):
+        INGEST_STATS['replays_dropped'] += 1
+        return
+    logger.info(f"Found post: [r/{subreddit_name}]: [{post.fullname}]")
+
+    # Posts we already have cost nothing
+    if await run_blocking(POST_STORE.exists, subreddit_name, post.fullname):
+        INGEST_STATS['loads_avoided'] += 1
+        CHECKPOINTS.mark_seen(subreddit_name, post.fullname, post.created_utc)
+        return
+
+    # A post is only marked seen once it is in the store: until then it waits in incomplete_posts
+    payload = post_payload(post)
+    if payload is None:
+        incomplete_posts[post.fullname] = subreddit_name
+        return
+    INGEST_STATS['loads_avoided'] += 1
+    await store_post(subreddit_name, post.fullname, post.created_utc, payload, scheduler, incomplete_posts)
+
+
+#######################################################################
+# Fetch the posts that were missing data, up to 100 posts per request #
+#######################################################################
+async def enrich_posts(reddit, scheduler, incomplete_posts):
+    if not incomplete_posts:
+        return
+    fullnames = list(incomplete_posts)
+    try:
+        for i in range(0, len(fullnames), 100):
+            batch = fullnames[i:i + 100]
+            returned = set()
+            INGEST_STATS['enrichment_requests'] += 1
+            async for post in reddit.info(batch):
+                returned.add(post.fullname)
+                subreddit_name = incomplete_posts[post.fullname]
+                payload = post_payload(post)
+                if payload is None:
+                    logger.error(f"Error saving post: [r/{subreddit_name}]: [{post.fullname}]. Data is missing.")
+                    del incomplete_posts[post.fullname]
+                    continue
+                await store_post(subreddit_name, post.fullname, post.created_utc, payload, scheduler, incomplete_posts)
+
+            # Reddit does not return the posts that are gone
+            for fullname in batch:
+                if fullname not in returned:
+                    incomplete_posts.pop(fullname, None)
+    except Exception as e:
+
+        # The posts not saved yet stay queued, and are tried again after the next listing
+        logger.error(f"Error fetching the posts missing data ({len(incomplete_posts)} left to retry): {str(e)}")
+
+
+#######################################################################
+# Fetch the posts submitted between the checkpoint and the first listing #
+#######################################################################
+async def fill_gap(reddit, subreddit, after_fullname, cutoff, scheduler, subreddit_for_post, incomplete_posts):
+    """
+    Ingests the posts older than after_fullname (the oldest post of the stream's first listing) down to the cutoff,
+    i.e. what was submitted while the bot was down and did not fit in that listing
+    """
+    missed_posts = []
+    with count_requests() as requests:
+        async for post in subreddit.new(limit=GAP_FILL_LIMIT, params={'after': after_fullname}):
+            if post.created_utc < cutoff:
+                break
+            missed_posts.append(post)
+    INGEST_STATS['gap_fill_requests'] += requests.requests
+    logger.info(f"Filling the gap since the last checkpoint on [r/{subreddit.display_name}]: {len(missed_posts)} posts")
+    for post in reversed(missed_posts):
+        await ingest_post(subreddit_for_post(post), post, scheduler, incomplete_posts, filling_gap=True)
+    await enrich_posts(reddit, scheduler, incomplete_posts)
+
+
+#############################################################
+# Save every post from a stream of submissions to the store #
+#############################################################
+async def ingest_stream(reddit, stream_name, scheduler, subreddit_for_post, incomplete_posts):
+    """
+    incomplete_posts holds the posts still to be saved ({fullname: subreddit name}): it is kept by the caller across
+    restarts of the stream, since the posts in it are not marked seen and would not come back from the stream
+    """
+
+    # New posts go before rechecks of old ones when we run low on rate limit (see request_scheduler.py)
+    with request_priority(INGESTION):
+        subreddit = await reddit.subreddit(stream_name)
+
+        # If the stream's first listing is full and does not reach back to the oldest checkpoint of the subs,
+        # posts were missed while we were down
+        checkpoints = [CHECKPOINTS.get(subreddit_name) for subreddit_name in stream_name.split('+')]
+        checkpoint_times = [checkpoint['created_utc'] for checkpoint in checkpoints if checkpoint is not None]
+        cutoff = min(checkpoint_times) if checkpoint_times else None
+        first_listing = []
+
+        # The stream yields None after each listing it fetches, which is when we look up the posts that were missing data
+        reported_stats = dict(INGEST_STATS)
+        async for post in subreddit.stream.submissions(pause_after=-1):
+            if post is None or len(incomplete_posts) >= 100:
+                await enrich_posts(reddit, scheduler, incomplete_posts)
+            if post is not None:
+                if first_listing is not None:
+                    first_listing.append(post)
+                await ingest_post(subreddit_for_post(post), post, scheduler, incomplete_posts)
+                continue
+
+            # Listings are yielded oldest post first
+            if first_listing is not None:
+                if cutoff is not None and len(first_listing) >= 100 and first_listing[0].created_utc >= cutoff:
+                    await fill_gap(reddit, subreddit, first_listing[0].fullname, cutoff, scheduler, subreddit_for_post, incomplete_posts)
+                first_listing = None
+
+            # Everything up to here is in the store, unless some posts are waiting to be tried again: then the
+            # checkpoints on disk stay where they are, so a restart reads those posts again
+            if not incomplete_posts:
+                await run_blocking(CHECKPOINTS.write, CHECKPOINTS.take_changes())
+            if INGEST_STATS != reported_stats:
+                logger.info(
+                    f"Extra fetches avoided so far: {INGEST_STATS['loads_avoided']} "
+                    f"(enrichment requests: {INGEST_STATS['enrichment_requests']}, "
+                    f"replays dropped: {INGEST_STATS['replays_dropped']}, "
+                    f"gap fill requests: {INGEST_STATS['gap_fill_requests']})"
+                )
+                reported_stats = dict(INGEST_STATS)
+
 
 #################################################################
 # Coroutine to record every post submitted to the specified sub #
 #################################################################
-async def save_posts(subreddit_name):
-    print(f"Monitoring for new posts on [r/{subreddit_name}]")
+async def save_posts(subreddit_name, scheduler):
+    logger.info(f"Monitoring for new posts on [r/{subreddit_name}]")
     
-    # Create directory for storing the posts of the monitored subreddit 
-    if not os.path.exists(subreddit_name):
-        os.makedirs(subreddit_name)
-    
-    # Initialize the asyncpraw Reddit instance
-    with asyncpraw.Reddit(
-        client_id=REDDIT_CLIENT_ID,
-        client_secret=REDDIT_CLIENT_SECRET,
-        user_agent=REDDIT_USER_AGENT,
-        username=REDDIT_USERNAME,
-        password=REDDIT_PASSWORD
-    ) as reddit:
+    # Initialize the asyncpraw Reddit instance (closing its session when the task ends)
+    async with asyncpraw_reddit(**REDDIT_CREDENTIALS) as reddit:
+        incomplete_posts = {}
 
-        try:
+        while True:
+            try:
             
-            # Save each post to the directory so that we can retrieve the text later if the post is deleted
-            subreddit = await reddit.subreddit(subreddit_name)
-            async for post in subreddit.stream.submissions():
-                await post.load()
-                print(f"Found post: [r/{subreddit_name}]: [{post.fullname}]")
-                file_name = f"{subreddit_name}/{post.fullname}.json"
-                payload = {
-                    'title': post.title,
-                    'author': post.author.name,
-                    'permalink': post.permalink,
-                    'body': post.selftext
-                }
-                
-                # If a file named post_id already exists, we don't want to overwrite!
-                if not os.path.exists(file_name):
-                    try:
-                        print(f"Saving post: [r/{subreddit_name}]: [{post.fullname}]")
-                        with open(file_name, 'w') as json_file:
-                            json.dump(payload, json_file)
-                    
-                    except:
-                        
-                        # If there was an error saving the file, report it and move on.
-                        print(f"Error saving post: [r/{subreddit_name}]: [{post.fullname}]")
-                        continue
+                # Save each post to the store so that we can retrieve the text later if the post is deleted
+                await ingest_stream(reddit, subreddit_name, scheduler, lambda post: subreddit_name, incomplete_posts)
 
-        except Exception as e:
+            except Exception as e:
             
-            # Exceptions can occur because calls to Reddit fail, Reddit has an outage, etc. We just report them and try again.
-            print(str(e))
+                # Exceptions can occur because calls to Reddit fail, Reddit has an outage, etc. We just report them and try again.
+                # The stream picks up from the checkpoint, so restarting it is cheap.
+                logger.error(str(e))
+                await asyncio.sleep(STREAM_RESTART_DELAY)
 
 
-########################################################
-# Coroutine to check for deleted posts and notify mods #
-########################################################
-async def check_deleted_posts(subreddit_name):
-    
-    # We only need to have this coroutine executed periodically, so we sleep for a bit. 
-    await asyncio.sleep(10) # Feel free to replace the delay with the number of seconds that work for you
+##################################################################################
+# Coroutine to record every post submitted to a group of subs through one stream #
+##################################################################################
+async def save_posts_shared(reddit, subreddit_names, scheduler):
+    multireddit_name = '+'.join(subreddit_names)
+    logger.info(f"Monitoring for new posts on [r/{multireddit_name}]")
 
-    print(f"Checking for deleted posts on [r/{subreddit_name}]")
+    # Posts come back with the sub's own capitalization, which may differ from the configured name
+    configured_names = {subreddit_name.lower(): subreddit_name for subreddit_name in subreddit_names}
+    incomplete_posts = {}
+    while True:
+        try:
+            await ingest_stream(
+                reddit,
+                multireddit_name,
+                scheduler,
+                lambda post: configured_names.get(post.subreddit.display_name.lower(), post.subreddit.display_name),
+                incomplete_posts
+            )
 
-    # Get list of posts we previously saved
-    try:
-        recent_posts = [os.path.splitext(filename)[0] for filename in os.listdir(subreddit_name)]
-        
-        # Note: the current method for sorting the list by latest post relies on the post id name (also the filename). Hopefully this is reliable enough.
-        recent_posts = sorted(recent_posts, reverse=True)
+        except Exception as e:
+            logger.error(str(e))
+            await asyncio.sleep(STREAM_RESTART_DELAY)
 
-    except Exception as e: # Could fail if no posts were saved, in which case we will just print the exception
-        print(str(e))
-    
-    # Get info on recent posts       
-    # Initialize the asyncpraw Reddit instance
-    with asyncpraw.Reddit(
-        client_id=REDDIT_CLIENT_ID,
-        client_secret=REDDIT_CLIENT_SECRET,
-        user_agent=REDDIT_USER_AGENT,
-        username=REDDIT_USERNAME,
-        password=REDDIT_PASSWORD
-    ) as reddit:
+
+##########################################################################
+# Send modmail about deleted posts (called by the notification sender) #
+##########################################################################
+def notification_md(payload):
+    return (
+        f"**Title:** {payload['title']}\n\n  "
+        f"**Author:** {payload['author']}\n\n  "
+        f"**Link:** https://reddit.com{payload['permalink']}\n\n  "
+        f"**Original Text:** {payload['body']}"
+    )
+
+
+def digest_messages(sections, max_length=MODMAIL_MAX_LENGTH):
+    """
+    Packs the per-post sections of a digest into as few modmail messages as fit Reddit's length limit. Returns
+    (message, number of sections in it) for each message, in order.
+    """
+    messages = []
+    message = ''
+    count = 0
+    for section in sections:
+        if message and len(message) + len(DIGEST_SEPARATOR) + len(section) > max_length:
+            messages.append((message, count))
+            message = ''
+            count = 0
+        message = message + DIGEST_SEPARATOR + section if message else section
+        count += 1
+    if message:
+        messages.append((message, count))
+    return messages
+
+
+async def send_notifications(reddit, subreddit_name, events, acknowledge):
+    """
+    Sends one modmail about a deleted post, or a digest about several, and marks the posts as notified as soon as
+    the message about them is sent. Raises if a message could not be sent, so the sender retries the posts left.
+    """
+
+    # Load original text from the store, skipping the posts that are missing or that the mods already know about
+    payloads = []
+    for event in events:
+        try:
+            payload = await run_blocking(POST_STORE.load, subreddit_name, event.fullname)
+        except:
+            payload = None
+        if payload is None:
+            logger.error(f"Error loading post: [r/{subreddit_name}]: [{event.fullname}]. Skipping notification.")
+        elif payload.get('notified') is not None:
+            logger.info(f"Already notified about post: [r/{subreddit_name}]: [{event.fullname}]")
+        else:
+            payloads.append((event, payload))
+    if not payloads:
+        return
+
+    # Send modmail to the subreddit
+    if len(payloads) == 1:
+        subject = f"Deleted Post Notification for r/{subreddit_name}"
+        messages = [(notification_md(payloads[0][1]), 1)]
+    else:
+        subject = f"Deleted Post Notification for r/{subreddit_name} ({len(payloads)} posts)"
+        messages = digest_messages([notification_md(payload) for _, payload in payloads])
+    logger.info(f"Sending modmail notification to [r/{subreddit_name}] about {len(payloads)} posts")
+    subreddit = await reddit.subreddit(subreddit_name)
+    for message, sections in messages:
+        with request_priority(NOTIFICATION), span('send_modmail', subreddit=subreddit_name, posts=sections):
+            await subreddit.message(subject, message)
+        sent, payloads = payloads[:sections], payloads[sections:]
+        await mark_notified(subreddit_name, sent)
+        await acknowledge([event for event, _ in sent])
+
+
+async def mark_notified(subreddit_name, sent):
+    """
+    Updates the store to make sure we do not resend the notifications about the (event, payload) pairs sent
+    """
+    sent_at = time.time()
+    for event, _ in sent:
+        if event.last_seen is not None:
+            NOTIFICATION_LATENCY.observe(sent_at - event.last_seen)
+        try:
+            with span('mark_notified', subreddit=subreddit_name):
+                await run_blocking(POST_STORE.mark_notified, subreddit_name, event.fullname)
+        except:
+            logger.error(f"Error updating post: [r/{subreddit_name}]: [{event.fullname}]")
+
+
+################################################################
+# Check the posts that are due and notify mods about deletions #
+################################################################
+async def check_due_posts(reddit, scheduler, sender):
+    batches = scheduler.due_batches()
+    if not batches:
+        return
+    subreddit_names = sorted(set(entry.subreddit_name for batch in batches for entry in batch))
+    logger.info(f"Checking {sum(len(batch) for batch in batches)} posts for deletion on [r/{'+'.join(subreddit_names)}] ({len(batches)} requests)")
+
+    # Get info on the posts that are due, up to 100 posts per request
+    for batch in batches:
+        entries = {entry.fullname: entry for entry in batch}
+
+        # Posts pulled in early to fill the batch were not due yet, so they are not late.
+        # Posts that were already overdue when they were queued (e.g. at startup) are late from then on.
+        checked_at = time.time()
+        for entry in batch:
+            if entry.due <= checked_at:
+                RECHECK_LAG.observe(checked_at - max(entry.due, entry.checked))
         try:
-            async for post in reddit.info(recent_posts):
+            with request_priority(RECHECK), span('recheck_batch', posts=len(entries)):
+                posts = [post async for post in reddit.info(list(entries))]
+            for post in posts:
 
-                # Check if any of the recent posts have been deleted
+                # Check if any of the posts have been deleted
                 if post.removed_by_category == 'deleted':
-                    print(f"Found deleted post: [r/{subreddit_name}]: [{post.fullname})]")
-
-                    # Load original text from file
-                    payload = {}
-                    file_name = f"{subreddit_name}/{post.fullname}.json"
-                    try:
-                        with open(file_name, 'r') as json_file:
-                            payload = json.load(json_file)
-                    except:
-                        
-                        # Skip if error
-                        print(f"Error loading file: [{file_name}]. Skipping notification.")
-                        continue
-
-                    # Check if we already notified about this post
-                    if payload.get('notified') is None:
-                            
-                        # Send modmail to the subreddit
-                        modmail_subject = f"Deleted Post Notification for r/{subreddit_name}"
-                        modmail_message = (
-                            f"**Title:** {payload['title']}\n\n  "
-                            f"**Author:** {payload['author']}\n\n  "
-                            f"**Link:** https://reddit.com{payload['permalink']}\n\n  "
-                            f"**Original Text:** {payload['body']}"
-                        )
-                        try:
-                            print(f"Sending modmail notification to [r/{subreddit_name}]")
-                            subreddit = await(reddit.subreddit(subreddit_name))
-                            await subreddit.message(modmail_subject, modmail_message)
-                        
-                        except:
-                            print('Error sending modmail notification')
-                            continue
-
-                        # Update the file to make sure we do not resend the notification
-                        payload['notified'] = True
-                        try:
-                            with open(file_name, 'w') as json_file:
-                                json.dump(payload, json_file)
-                        except:
-                            print(f"Error updating file: [{file_name}]")
-                    
-                    else:
-                        # If we already notified about the file, no need to send modmail again
-                        print(f"Already notified about post: [r/{subreddit_name}]: [{post.fullname}]")
+                    entry = entries.pop(post.fullname)
+                    logger.info(f"Found deleted post: [r/{entry.subreddit_name}]: [{post.fullname})]")
+
+                    # The sender takes it from here (and retries until the mods know about it), nothing left to check
+                    await sender.push(entry.subreddit_name, post.fullname, entry.checked)
         
         except Exception as e:
-            print(str(e))
+            logger.error(str(e))
+
+        # Everything else goes back in the queue until it is old enough to retire
+        for entry in entries.values():
+            scheduler.reschedule(entry)
+    logger.info(f"Timings so far: {span_summary()}")
+
+
+########################################################
+# Coroutine to check for deleted posts and notify mods #
+########################################################
+async def check_deleted_posts(subreddit_name, scheduler, sender):
+
+    # One asyncpraw Reddit instance for the whole task, closed when the task ends
+    async with asyncpraw_reddit(**REDDIT_CREDENTIALS) as reddit:
+        while True:
+
+            # Posts are re-checked on a schedule that slows down as they get older (see recheck_scheduler.py),
+            # so we only need to wake up every now and then to see which posts are due.
+            await asyncio.sleep(CHECK_INTERVAL)
+            if scheduler.next_due() is None or scheduler.next_due() > time.time():
+                continue
+            await check_due_posts(reddit, scheduler, sender)
+
+
+###########################################################################
+# Coroutine to check for deleted posts on all the subs in one batched job #
+###########################################################################
+async def check_deleted_posts_shared(reddit, scheduler, sender):
+    while True:
+        await asyncio.sleep(CHECK_INTERVAL)
+        await check_due_posts(reddit, scheduler, sender)
+
+
+########################################################################
+# Put every post that is still young enough to be checked in the queue #
+########################################################################
+def seed_scheduler(scheduler, subreddit_names):
+    for subreddit_name in subreddit_names:
+        try:
+            for fullname, created_utc in POST_STORE.unnotified_since(subreddit_name, time.time() - scheduler.tiers[-1][0]):
+                scheduler.add(fullname, subreddit_name, created_utc)
+        except Exception as e:
+            logger.error(str(e))
+
+
+#################################################################
+# Split the subs into multireddits whose names are not too long #
+#################################################################
+def chunk_subreddits(subreddit_names, max_length=MULTIREDDIT_MAX_LENGTH):
+    chunks = []
+    chunk = []
+    chunk_length = 0
+    for subreddit_name in subreddit_names:
+        added_length = len(subreddit_name) + (1 if chunk else 0)
+        if chunk and chunk_length + added_length > max_length:
+            chunks.append(chunk)
+            chunk = []
+            added_length = len(subreddit_name)
+            chunk_length = 0
+        chunk.append(subreddit_name)
+        chunk_length += added_length
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+#########################################################
+# Serve the metrics, including the current queue depths #
+#########################################################
+async def serve_bot_metrics(schedulers):
+    request_scheduler = get_scheduler()
+
+    METRICS.gauge('recheck_queue_depth', 'Posts waiting for their next deletion check', lambda: sum(len(scheduler) for scheduler in schedulers))
+    METRICS.gauge('request_queue_depth', 'Requests waiting for their turn under the rate limit', request_scheduler.waiting)
+    METRICS.gauge('requests_in_flight', 'Requests sent to Reddit and not answered yet', lambda: request_scheduler.in_flight)
+    METRICS.gauge('api_calls_per_minute', 'Requests sent to Reddit in the last 60 seconds', request_scheduler.requests_last_minute)
+    METRICS.gauge('ratelimit_remaining', 'Requests left in the current rate limit window', lambda: request_scheduler.remaining)
+    METRICS.gauge('store_posts', 'Posts in the post store', POST_STORE.count)
+    METRICS.gauge('notification_queue_depth', 'Deleted posts the mods have not been notified about yet', lambda: len(NOTIFICATION_QUEUE))
+
+    # Each worker process of the supervisor serves its own metrics, on the next port up
+    await serve_metrics(METRICS, METRICS_PORT + (SHARD[0] if SHARD else 0), METRICS_HOST, STORE_EXECUTOR)
+
+
+def notification_sender(reddit):
+    return NotificationSender(
+        NOTIFICATION_QUEUE,
+        functools.partial(send_notifications, reddit),
+        concurrency=NOTIFICATION_CONCURRENCY,
+        digest_interval=NOTIFICATION_DIGEST_INTERVAL,
+        executor=STORE_EXECUTOR
+    )
 
 
 ###################
 # Main Event loop #
 ###################
-async def main():
-    SUBREDDITS = ['modguide'] # Add the names of your monitored subreddits in this list
+async def run():
     
     # For each specified subreddit, create tasks for saving posts and checking for deleted posts
     tasks = []
+    schedulers = []
     for subreddit in SUBREDDITS:
-        tasks.append(save_posts(subreddit))
-        tasks.append(check_deleted_posts(subreddit))
 
-    # Run all the tasks and hope for the best
-    await asyncio.gather(*tasks)
+        # Pick up where we left off
+        scheduler = RecheckScheduler()
+        seed_scheduler(scheduler, [subreddit])
+        schedulers.append(scheduler)
+
+        tasks.append(save_posts(subreddit, scheduler))
+    if METRICS_PORT:
+        tasks.append(serve_bot_metrics(schedulers))
+
+    # Deleted posts are queued for the notification sender, which keeps its own session open
+    async with asyncpraw_reddit(**REDDIT_CREDENTIALS) as reddit:
+        sender = notification_sender(reddit)
+        tasks.extend(check_deleted_posts(subreddit, scheduler, sender) for subreddit, scheduler in zip(SUBREDDITS, schedulers))
+        tasks.append(sender.run())
+
+        # Run all the tasks and hope for the best
+        await asyncio.gather(*tasks)
+
+
+##############################################################
+# Main Event loop when monitoring many subs over one session #
+##############################################################
+async def run_shared():
+
+    # All the subs share one scheduler, so the deletion check is one batched job no matter how many subs there are
+    scheduler = RecheckScheduler()
+    seed_scheduler(scheduler, SUBREDDITS)
+
+    # One Reddit instance (and connection pool) for everything
+    async with asyncpraw_reddit(**REDDIT_CREDENTIALS) as reddit:
+        tasks = [save_posts_shared(reddit, chunk, scheduler) for chunk in chunk_subreddits(SUBREDDITS)]
+        sender = notification_sender(reddit)
+        tasks.append(check_deleted_posts_shared(reddit, scheduler, sender))
+        tasks.append(sender.run())
+        if METRICS_PORT:
+            tasks.append(serve_bot_metrics([scheduler]))
+        await asyncio.gather(*tasks)
+
+
+#####################################################################
+# Supervisor: run the subs as shards in separate worker processes #
+#####################################################################
+def supervise(worker_count):
+    """
+    Runs worker_count copies of this script, each monitoring every worker_count-th sub, and restarts any that exits.
+    The workers share the post store, the notification queue and the stream checkpoints.
+    """
+    def start_worker(index):
+        logger.info(f"Starting worker {index + 1} of {worker_count}")
+        return subprocess.Popen([sys.executable, os.path.abspath(__file__), '--shard', f"{index}/{worker_count}"])
+
+    # Stop the workers too when we are told to terminate
+    signal.signal(signal.SIGTERM, lambda signal_number, frame: sys.exit())
+
+    workers = {index: start_worker(index) for index in range(worker_count)}
+    started_at = {index: time.time() for index in workers}
+    restart_delays = {index: WORKER_RESTART_DELAY for index in workers}
+    restart_at = {}
+    try:
+        while True:
+            time.sleep(1)
+            for index, process in workers.items():
+                if index not in restart_at and process.poll() is not None:
+
+                    # Back off if the worker keeps crashing right after it starts
+                    if time.time() - started_at[index] < WORKER_MIN_UPTIME:
+                        restart_delays[index] = min(restart_delays[index] * 2, WORKER_MAX_RESTART_DELAY)
+                    else:
+                        restart_delays[index] = WORKER_RESTART_DELAY
+                    logger.error(f"Worker {index + 1} exited with code {process.returncode}. Restarting it in {restart_delays[index]}s")
+                    restart_at[index] = time.time() + restart_delays[index]
+            for index, at in list(restart_at.items()):
+                if at <= time.time():
+                    del restart_at[index]
+                    workers[index] = start_worker(index)
+                    started_at[index] = time.time()
+    finally:
+        for process in workers.values():
+            if process.poll() is None:
+                process.terminate()
+        for process in workers.values():
+            process.wait()
+
+
+def parse_shard(argv):
+    """
+    Returns (index, count) from a "--shard index/count" argument, or None
+    """
+    if '--shard' not in argv:
+        return None
+    index, count = argv[argv.index('--shard') + 1].split('/')
+    return int(index), int(count)
+
+
+############
+# Settings #
+############
+# Set from the config file by configure(), so importing this module has no side effects
+REDDIT_CREDENTIALS = None
+SUBREDDITS = []
+WORKER_PROCESSES = 1
+WORKER_RESTART_DELAY = 5
+WORKER_MAX_RESTART_DELAY = 300
+WORKER_MIN_UPTIME = 60
+SHARD = None
+SHARED_SESSION = False
+CHECK_INTERVAL = 10
+METRICS_PORT = None
+METRICS_HOST = '127.0.0.1'
+POST_STORE = None
+CHECKPOINTS = None
+NOTIFICATION_QUEUE = None
+NOTIFICATION_CONCURRENCY = 4
+NOTIFICATION_DIGEST_INTERVAL = 0
+
+
+def configure(local_config, argv):
+    """
+    Sets the settings above from the config file and the command line, and opens the stores
+    """
+    global REDDIT_CREDENTIALS, SUBREDDITS, WORKER_PROCESSES, SHARD, SHARED_SESSION, CHECK_INTERVAL, METRICS_PORT, METRICS_HOST
+    global POST_STORE, CHECKPOINTS, NOTIFICATION_QUEUE, NOTIFICATION_CONCURRENCY, NOTIFICATION_DIGEST_INTERVAL
+
+    # Initialize connection to Reddit
+    REDDIT_CREDENTIALS = script_credentials(local_config)
+
+    # Add the names of your monitored subreddits to the "subreddits" list in the config file
+    SUBREDDITS = local_config.get('subreddits', ['modguide'])
+
+    # Set "worker_processes" (or pass --workers N) to split the subs across that many processes, each with its own event loop
+    # and Reddit session. A worker that crashes is restarted on its own. Each worker runs its share of the subs the same way
+    # a single process would (see shared_session below).
+    WORKER_PROCESSES = int(argv[argv.index('--workers') + 1]) if '--workers' in argv else local_config.get('worker_processes', 1)
+
+    # Worker processes are started with --shard index/count and monitor every count-th sub, starting at index
+    SHARD = parse_shard(argv)
+    if SHARD:
+        SUBREDDITS = SUBREDDITS[SHARD[0]::SHARD[1]]
+
+    # Set "shared_session" to true to monitor all the subs over a single session and a combined r/a+b+c stream.
+    # This keeps the request rate about the same as subs are added.
+    SHARED_SESSION = local_config.get('shared_session', False)
+
+    # How often (in seconds) to look for posts that are due for a deletion check.
+    # The recheck_lag_seconds metric shows how late the checks run with the current value.
+    CHECK_INTERVAL = local_config.get('check_interval', 10)
+
+    # Set "metrics_port" (e.g. 9100) to serve Prometheus-style metrics at http://127.0.0.1:<port>/metrics
+    METRICS_PORT = local_config.get('metrics_port')
+    METRICS_HOST = local_config.get('metrics_host', '127.0.0.1')
+
+    # The supervisor only starts the workers, which open the stores themselves
+    if WORKER_PROCESSES > 1 and not SHARD:
+        return
+
+    # Posts are kept in a SQLite database by default. Set "post_store_backend" to "json" to keep the old one-file-per-post layout.
+    # Use migrate_posts.py to move posts saved in the old layout into the database.
+    POST_STORE = get_post_store(local_config.get('post_store_backend', 'sqlite'), local_config.get('post_store_path'))
+
+    # The newest post ingested from each sub, so restarts neither replay old posts nor miss new ones
+    CHECKPOINTS = StreamCheckpoints(local_config.get('stream_checkpoint_file', 'stream_checkpoints.json'))
+
+    # Deleted posts wait in this queue until the mods have been notified, so notifications survive restarts and outages
+    NOTIFICATION_QUEUE = NotificationQueue(
+        local_config.get('notification_queue_file', 'notifications.db'),
+        subreddit_names=SUBREDDITS if SHARD else None
+    )
+
+    # How many modmails may be sent at once
+    NOTIFICATION_CONCURRENCY = local_config.get('notification_concurrency', 4)
+
+    # Set "notification_digest_interval" (in seconds) to collect the deletions on each sub for that long after the first one
+    # and send them in one digest modmail, instead of one modmail per post
+    NOTIFICATION_DIGEST_INTERVAL = local_config.get('notification_digest_interval', 0)
 
 
 ################
 # MAIN PROGRAM #
 ################
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    configure(load_config(), argv)
 
-# Initialize connection to Reddit
-# This code assumes that all the secrets are in a json file located in the same directory as this script.
-# You can just enter these secrets here, but keep in mind that they are called "secrets" for a reason.
-LOCAL_CONFIG_FILE='local_config.json'
-with open(LOCAL_CONFIG_FILE) as local_config_file:
-    local_config = json.load(local_config_file)
-REDDIT_CLIENT_ID = local_config['reddit_client_id']
-REDDIT_CLIENT_SECRET = local_config['reddit_client_secret']
-REDDIT_USER_AGENT = local_config['reddit_user_agent']
-REDDIT_USERNAME = local_config['reddit_username'],
-REDDIT_PASSWORD = local_config['reddit_password']
-
-# Initialize the event loop
-if __name__ == "__main__":
+    if WORKER_PROCESSES > 1 and not SHARD:
+        try:
+            supervise(WORKER_PROCESSES)
+        except KeyboardInterrupt:
+            logger.info('Received CTRL-C. Stopping the workers.')
+        sys.exit()
 
+    # Initialize the event loop
     while True:
         try:
-            asyncio.run(main())
+            asyncio.run(run_shared() if SHARED_SESSION else run())
         except KeyboardInterrupt:
-            print('Received CTRL-C. Exiting.')
+            logger.info('Received CTRL-C. Exiting.')
             sys.exit()
         except SystemExit:
-            print('Someone said to terminate so here I go.')
+            logger.info('Someone said to terminate so here I go.')
             sys.exit()
 
+
+if __name__ == "__main__":
+    main()
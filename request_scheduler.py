@@ -0,0 +1,344 @@
+"""
+Rate-limit-aware, prioritized scheduling of the requests our scripts send to Reddit.
+
+Reddit gives each account a budget of requests per window and reports what is left of it in the
+X-Ratelimit-Used / -Remaining / -Reset headers of every response. RequestScheduler keeps that budget as a token
+bucket (refilled when the window resets) and hands it out by priority:
+
+    NOTIFICATION  modmail about deleted posts; may spend the whole budget
+    INGESTION     fetching new posts (the default for unmarked work)
+    RECHECK       re-checking old posts for deletion
+    BACKFILL      report backfills: modlog walks, flair counts
+
+Each priority below NOTIFICATION leaves part of the budget (RESERVES) to the ones above it, so when we run low
+the cheap work waits for the next window first and notifications still go out. Waiting coroutines are
+served highest priority first. A 429 response empties the bucket and the request is retried after the reset
+instead of failing.
+
+Requests are tagged with a context manager, which works the same for praw and asyncpraw:
+
+    with request_priority(NOTIFICATION):
+        await subreddit.message(subject, message)
+
+count_requests() works the same way, to see how many requests a piece of work took (e.g. paging through a listing).
+
+attach() plugs the scheduler into a praw or asyncpraw Reddit instance in place of prawcore's rate limiter.
+The sessions created with token_cache.praw_reddit() / asyncpraw_reddit() share one scheduler per process.
+Since Reddit reports the account-wide budget in every response, separate processes using the same account
+each see what the others have spent without having to coordinate.
+"""
+
+import heapq
+import inspect
+import itertools
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from urllib.parse import urlparse
+
+from bot_logger import span
+
+NOTIFICATION = 0
+INGESTION = 1
+RECHECK = 2
+BACKFILL = 3
+PRIORITY_NAMES = ['notification', 'ingestion', 'recheck', 'backfill']
+
+# Share of the window's budget each priority has to leave for the ones above it
+RESERVES = {NOTIFICATION: 0.0, INGESTION: 0.05, RECHECK: 0.2, BACKFILL: 0.4}
+
+# How many times a request that got a 429 is retried after the window resets
+MAX_RATE_LIMITED_RETRIES = 3
+
+_current_priority = ContextVar('request_priority', default=INGESTION)
+_request_counters = ContextVar('request_counters', default=())
+
+
+@contextmanager
+def request_priority(priority: int):
+    """
+    Sends the requests made inside the block (including by coroutines started in it) at the given priority
+    """
+    token = _current_priority.set(priority)
+    try:
+        yield
+    finally:
+        _current_priority.reset(token)
+
+
+class RequestCounter:
+    """
+    The number of requests sent inside a count_requests() block so far (retries after a 429 included)
+    """
+
+    def __init__(self):
+        self.requests = 0
+
+
+@contextmanager
+def count_requests(counter: RequestCounter = None):
+    """
+    Counts the requests sent inside the block (including by coroutines started in it). Blocks can be nested.
+    Pass the counter of an earlier block to keep adding to it.
+    """
+    counter = counter or RequestCounter()
+    token = _request_counters.set(_request_counters.get() + (counter,))
+    try:
+        yield counter
+    finally:
+        _request_counters.reset(token)
+
+
+def _count_request():
+    for counter in _request_counters.get():
+        counter.requests += 1
+
+
+class RequestScheduler:
+
+    def __init__(self, reserves: dict = None):
+        self.reserves = reserves or RESERVES
+        self.remaining = None   # Requests left in the current window, None until a response tells us
+        self.used = None
+        self.reset_timestamp = None
+        self.in_flight = 0
+        self.sent = [0] * len(PRIORITY_NAMES)
+        self.waited = [0] * len(PRIORITY_NAMES)
+        self.rate_limited = 0
+        self._recent = deque()  # When each request of the last minute was sent
+        self._lock = threading.Lock()
+        self._waiters = []      # heap of [priority, sequence, future] for waiting coroutines
+        self._sequence = itertools.count()
+
+    ################
+    # Token bucket #
+    ################
+    def _allowed(self, priority: int) -> bool:
+        """
+        Returns True if a request of this priority can be sent now
+        """
+        if self.reset_timestamp is not None and time.time() >= self.reset_timestamp:
+
+            # New window: we do not know the new budget until the next response comes back
+            self.remaining = None
+            self.reset_timestamp = None
+        if self.remaining is None:
+            return self.in_flight == 0
+        budget = self.remaining + (self.used or 0)
+        return self.remaining - self.in_flight > self.reserves.get(priority, 0) * budget
+
+    def _wait_time(self) -> float:
+        if self.reset_timestamp is None:
+            return 1.0
+        return max(self.reset_timestamp - time.time(), 0.05)
+
+    def _take(self, priority: int):
+        self.in_flight += 1
+        self.sent[priority] += 1
+        now = time.time()
+        self._recent.append(now)
+        self._forget_before(now - 60)
+
+    def _forget_before(self, timestamp: float):
+        while self._recent and self._recent[0] < timestamp:
+            self._recent.popleft()
+
+    def update(self, headers, status: int = None):
+        """
+        Updates the bucket from the response to a request sent with acquire() / acquire_async()
+        """
+        with self._lock:
+            self.in_flight = max(self.in_flight - 1, 0)
+            if headers is not None and 'x-ratelimit-remaining' in headers:
+                self.remaining = float(headers['x-ratelimit-remaining'])
+                self.used = int(float(headers.get('x-ratelimit-used', 0)))
+
+                # The reset is given in whole seconds, rounded down: wait for the end of that second to be safe
+                self.reset_timestamp = time.time() + int(float(headers['x-ratelimit-reset'])) + 1
+            elif self.remaining is not None:
+                self.remaining -= 1
+            if status == 429:
+                self.rate_limited += 1
+                self.remaining = 0
+                if self.reset_timestamp is None:
+                    self.reset_timestamp = time.time() + 1
+        self._wake_next()
+
+    ########
+    # praw #
+    ########
+    def acquire(self, priority: int):
+        """
+        Blocks until a request of this priority can be sent
+        """
+        waited = False
+        while True:
+            with self._lock:
+                if self._allowed(priority):
+                    self._take(priority)
+                    if waited:
+                        self.waited[priority] += 1
+                    return
+                wait_time = self._wait_time()
+            waited = True
+            time.sleep(min(wait_time, 1.0))
+
+    #############
+    # asyncpraw #
+    #############
+    async def acquire_async(self, priority: int):
+        """
+        Waits until a request of this priority can be sent. Waiting coroutines go highest priority first.
+        """
+        import asyncio  # only the asyncpraw sessions need it, and they have already imported it
+
+        loop = asyncio.get_running_loop()
+        entry = [priority, next(self._sequence), loop.create_future()]
+        heapq.heappush(self._waiters, entry)
+        waited = False
+        try:
+            while True:
+                with self._lock:
+                    if self._waiters[0] is entry and self._allowed(priority):
+                        heapq.heappop(self._waiters)
+                        self._take(priority)
+                        if waited:
+                            self.waited[priority] += 1
+                        break
+                    wait_time = self._wait_time()
+                waited = True
+                entry[2] = loop.create_future()
+                try:
+                    await asyncio.wait_for(entry[2], timeout=wait_time)
+                except asyncio.TimeoutError:
+                    pass
+        except BaseException:
+            if entry in self._waiters:
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+            self._wake_next()
+            raise
+        self._wake_next()
+
+    def _wake_next(self):
+        if self._waiters:
+            future = self._waiters[0][2]
+            if not future.done():
+                future.get_loop().call_soon_threadsafe(_set_result, future)
+
+    def requests_last_minute(self) -> int:
+        with self._lock:
+            self._forget_before(time.time() - 60)
+            return len(self._recent)
+
+    def waiting(self) -> int:
+        """
+        Returns the number of coroutines waiting for their turn to send a request
+        """
+        return len(self._waiters)
+
+    def stats(self) -> str:
+        return ', '.join(
+            f"{name}: {sent} sent ({waited} waited)"
+            for name, sent, waited in zip(PRIORITY_NAMES, self.sent, self.waited)
+        ) + f"; {self.rate_limited} rate limited"
+
+
+def _set_result(future):
+    if not future.done():
+        future.set_result(None)
+
+
+def _status(response):
+    return getattr(response, 'status_code', None) or getattr(response, 'status', None)
+
+
+def _request_span(priority, method=None, url=None, *args):
+    return span('reddit_request', method=method, path=urlparse(url or '').path, priority=PRIORITY_NAMES[priority])
+
+
+class _RateLimiter:
+    """
+    Stands in for prawcore's RateLimiter. praw reads remaining / used / reset_timestamp from it (reddit.auth.limits).
+    """
+
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+
+    @property
+    def remaining(self):
+        return self.scheduler.remaining
+
+    @property
+    def used(self):
+        return self.scheduler.used
+
+    @property
+    def reset_timestamp(self):
+        return self.scheduler.reset_timestamp
+
+    def call(self, request_function, set_header_callback, *args, **kwargs):
+        priority = _current_priority.get()
+        for attempt in range(MAX_RATE_LIMITED_RETRIES + 1):
+            self.scheduler.acquire(priority)
+            _count_request()
+            try:
+                kwargs['headers'] = set_header_callback()
+                with _request_span(priority, *args):
+                    response = request_function(*args, **kwargs)
+            except BaseException:
+                self.scheduler.update(None)
+                raise
+            self.scheduler.update(response.headers, _status(response))
+            if _status(response) != 429 or attempt == MAX_RATE_LIMITED_RETRIES:
+                return response
+
+
+class _AsyncRateLimiter(_RateLimiter):
+
+    async def call(self, request_function, set_header_callback, *args, **kwargs):
+        priority = _current_priority.get()
+        for attempt in range(MAX_RATE_LIMITED_RETRIES + 1):
+            await self.scheduler.acquire_async(priority)
+            _count_request()
+            try:
+                kwargs['headers'] = await set_header_callback()
+                with _request_span(priority, *args):
+                    response = await request_function(*args, **kwargs)
+            except BaseException:
+                self.scheduler.update(None)
+                raise
+            self.scheduler.update(response.headers, _status(response))
+            if _status(response) != 429 or attempt == MAX_RATE_LIMITED_RETRIES:
+                return response
+
+
+_default_scheduler = None
+
+
+def get_scheduler() -> RequestScheduler:
+    """
+    Returns the scheduler shared by all the Reddit sessions of this process
+    """
+    global _default_scheduler
+    if _default_scheduler is None:
+        _default_scheduler = RequestScheduler()
+    return _default_scheduler
+
+
+def attach(reddit, scheduler: RequestScheduler = None):
+    """
+    Makes a praw or asyncpraw Reddit instance send its requests through the scheduler (by default the shared one)
+    """
+    scheduler = scheduler or get_scheduler()
+    for core_name in ('_core', '_authorized_core', '_read_only_core'):
+        core = getattr(reddit, core_name, None)
+        if core is None or isinstance(core._rate_limiter, _RateLimiter):
+            continue
+        if inspect.iscoroutinefunction(core._rate_limiter.call):
+            core._rate_limiter = _AsyncRateLimiter(scheduler)
+        else:
+            core._rate_limiter = _RateLimiter(scheduler)
+    return reddit
@@ -0,0 +1,116 @@
+"""
+Checkpoints for the submission streams of report_deleted_posts.py.
+
+Every time a stream starts (at startup, or after an error) asyncpraw replays the newest 100 posts of the
+subreddit, and without a checkpoint each replayed post costs a look-up in the post store. StreamCheckpoints
+remembers, per subreddit, the newest post that was ingested, and saves it to disk after each listing. A replayed
+post is dropped before any I/O when it is older than the checkpoint or in the in-memory set of recently seen
+posts (bounded, so it does not grow with the number of posts).
+
+The checkpoints also tell the bot how far back to look after a restart: posts submitted while it was down are
+fetched from the newest listing until the checkpoint is reached (see fill_gap() in report_deleted_posts.py).
+
+Several processes can share the checkpoint file (see the supervisor in report_deleted_posts.py): each one only
+writes the checkpoints of its own subs, merged into the file under a lock.
+"""
+
+import json
+import os
+from collections import OrderedDict
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: no locking, so only run one process per checkpoint file
+    fcntl = None
+
+# How many of the most recently seen fullnames to remember in memory
+SEEN_SET_SIZE = 10000
+
+
+class StreamCheckpoints:
+
+    def __init__(self, checkpoint_file: str = 'stream_checkpoints.json', seen_set_size: int = SEEN_SET_SIZE):
+        self.checkpoint_file = checkpoint_file
+        self.seen_set_size = seen_set_size
+        self._seen = OrderedDict()
+        self._changed = set()
+        self.checkpoints = self._read()
+
+    def get(self, subreddit_name: str):
+        """
+        Returns {'fullname': ..., 'created_utc': ...} for the newest post ingested from the subreddit, or None
+        """
+        return self.checkpoints.get(subreddit_name.lower())
+
+    def is_replay(self, subreddit_name: str, fullname: str, created_utc: float = None) -> bool:
+        """
+        Returns True if the post was already ingested: it was seen recently, or it is older than the checkpoint.
+        Leave created_utc out to only check the posts seen recently, e.g. for posts older than a listing that already
+        moved the checkpoint forward.
+        """
+        if fullname in self._seen:
+            return True
+        checkpoint = self.get(subreddit_name)
+        return created_utc is not None and checkpoint is not None and created_utc < checkpoint['created_utc']
+
+    def mark_seen(self, subreddit_name: str, fullname: str, created_utc: float):
+        """
+        Remembers an ingested post, and moves the subreddit's checkpoint forward if the post is newer
+        """
+        self._seen[fullname] = None
+        if len(self._seen) > self.seen_set_size:
+            self._seen.popitem(last=False)
+        checkpoint = self.get(subreddit_name)
+        if checkpoint is None or created_utc > checkpoint['created_utc']:
+            self.checkpoints[subreddit_name.lower()] = {'fullname': fullname, 'created_utc': created_utc}
+            self._changed.add(subreddit_name.lower())
+
+    def save(self):
+        """
+        Writes the checkpoints to disk if they moved since the last save
+        """
+        self.write(self.take_changes())
+
+    def take_changes(self) -> dict:
+        """
+        Returns the checkpoints that moved since the last call, for write() (which can then run on another thread)
+        """
+        changes = {key: dict(self.checkpoints[key]) for key in self._changed}
+        self._changed = set()
+        return changes
+
+    def write(self, changes: dict):
+        """
+        Merges the given checkpoints into the file
+        """
+        if not changes:
+            return
+        with self._locked():
+            checkpoints = self._read()
+            checkpoints.update(changes)
+
+            # Write to a temporary file first so an interrupted run cannot leave a truncated file behind
+            temp_file = self.checkpoint_file + '.tmp'
+            with open(temp_file, 'w') as f:
+                json.dump(checkpoints, f)
+            os.replace(temp_file, self.checkpoint_file)
+
+    def _read(self) -> dict:
+        try:
+            with open(self.checkpoint_file) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    @contextmanager
+    def _locked(self):
+        if fcntl is None:
+            yield
+            return
+        with open(self.checkpoint_file + '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
@@ -0,0 +1,258 @@
+"""
+Shared on-disk cache of Reddit OAuth access tokens, for praw and asyncpraw.
+
+praw fetches a new access token every time a Reddit instance is created, so every script start (and every
+new session) pays an extra round trip to Reddit before doing any real work. Creating the instance with
+praw_reddit() / asyncpraw_reddit() instead hands it the access token saved by the last process that used the
+same credentials, as long as it is still valid. Tokens are refreshed REFRESH_MARGIN seconds before they expire,
+and the cache file is locked while a token is refreshed, so concurrent processes end up sharing one token
+instead of each fetching their own.
+
+Usage: replace praw.Reddit(...) with praw_reddit(...) and asyncpraw.Reddit(...) with asyncpraw_reddit(...),
+with the same arguments. The instances also send their requests through the process's shared request
+scheduler (see request_scheduler.py).
+"""
+
+import hashlib
+import inspect
+import json
+import os
+import time
+import weakref
+from contextlib import asynccontextmanager, contextmanager
+
+import request_scheduler
+from bot_logger import get_bot_logger
+
+try:
+    import fcntl
+except ImportError:  # Windows: no locking, processes may occasionally fetch a token each
+    fcntl = None
+
+logger = get_bot_logger()
+
+TOKEN_CACHE_FILE = 'reddit_tokens.json'
+
+# Refresh access tokens this many seconds before they expire
+REFRESH_MARGIN = 300
+
+# Startup-to-first-request latency is measured from when the scripts import this module
+STARTED_AT = time.perf_counter()
+first_request_done = False
+
+# One lock per event loop, shared by all the sessions on it (see cached_refresh below)
+_refresh_locks = weakref.WeakKeyDictionary()
+
+# The cache file locks this process holds
+_held_locks = set()
+
+
+class TokenCache:
+
+    def __init__(self, cache_file: str = TOKEN_CACHE_FILE, refresh_margin: float = REFRESH_MARGIN):
+        self.cache_file = cache_file
+        self.refresh_margin = refresh_margin
+        self.hits = 0
+        self.misses = 0
+
+    def attach(self, reddit):
+        """
+        Makes a praw or asyncpraw Reddit instance get its access tokens through the cache
+        """
+        authorizer = reddit._core._authorizer
+        key = token_key(reddit.config)
+        state = {'last_token': None}
+
+        with self._locked():
+            cached = self._load(key)
+        if cached is not None:
+            self._adopt(authorizer, cached, state)
+
+        def cached_token():
+
+            # Do not adopt the token being replaced: it may have just been rejected by Reddit
+            cached = self._load(key)
+            if cached is not None and cached['access_token'] != state['last_token']:
+                self._adopt(authorizer, cached, state)
+                return True
+            return False
+
+        def store_token():
+            self.misses += 1
+            self._store(key, authorizer.access_token, authorizer._expiration_timestamp, authorizer.scopes)
+            state['last_token'] = authorizer.access_token
+            authorizer._expiration_timestamp -= self.refresh_margin
+
+        refresh = authorizer.refresh
+        request = reddit._core.request
+        if inspect.iscoroutinefunction(refresh):
+
+            # Coroutines of one process (whatever session they use) take turns here, since the file lock does not
+            # keep them apart (see _locked)
+            async def cached_refresh():
+                async with refresh_lock():
+                    if authorizer.is_valid():
+                        return
+                    async with self._locked_async():
+                        if not cached_token():
+                            await refresh()
+                            store_token()
+
+            async def timed_request(*args, **kwargs):
+                response = await request(*args, **kwargs)
+                self._report_first_request()
+                return response
+        else:
+            def cached_refresh():
+                with self._locked():
+                    if not cached_token():
+                        refresh()
+                        store_token()
+
+            def timed_request(*args, **kwargs):
+                response = request(*args, **kwargs)
+                self._report_first_request()
+                return response
+
+        authorizer.refresh = cached_refresh
+        reddit._core.request = timed_request
+        return reddit
+
+    def _adopt(self, authorizer, cached, state):
+        self.hits += 1
+        authorizer.access_token = cached['access_token']
+        authorizer.scopes = set(cached['scopes'])
+        authorizer._expiration_timestamp = cached['expires_at'] - self.refresh_margin
+        state['last_token'] = cached['access_token']
+
+    def _report_first_request(self):
+        global first_request_done
+        if not first_request_done:
+            first_request_done = True
+            logger.info(
+                f"First API request done {time.perf_counter() - STARTED_AT:.2f}s after startup "
+                f"(access token {'from cache' if self.hits else 'fetched from Reddit'})"
+            )
+
+    @contextmanager
+    def _locked(self):
+        lock_path = os.path.abspath(self.cache_file + '.lock')
+
+        # The lock keeps other processes out. Within this process, the holder may be a coroutine waiting on Reddit
+        # for a new token: flocking again from the same thread would block the event loop it needs to finish.
+        if fcntl is None or lock_path in _held_locks:
+            yield
+            return
+        with open(lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            _held_locks.add(lock_path)
+            try:
+                yield
+            finally:
+                _held_locks.discard(lock_path)
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @asynccontextmanager
+    async def _locked_async(self):
+        """
+        Same as _locked(), for coroutines: the lock is waited for in a thread, so the event loop keeps running while
+        another process refreshes the token
+        """
+        import asyncio  # only the asyncpraw sessions need it, and they have already imported it
+
+        lock_path = os.path.abspath(self.cache_file + '.lock')
+        if fcntl is None or lock_path in _held_locks:
+            yield
+            return
+        with open(lock_path, 'a') as lock_file:
+
+            # Claim the lock for this process before waiting, so the sessions created meanwhile on this event loop
+            # do not flock the file from its thread (see _locked)
+            _held_locks.add(lock_path)
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, fcntl.flock, lock_file.fileno(), fcntl.LOCK_EX)
+                yield
+            finally:
+                _held_locks.discard(lock_path)
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read(self) -> dict:
+        try:
+            with open(self.cache_file) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _load(self, key: str):
+        """
+        Returns the cached token for the key if it is valid for longer than the refresh margin, otherwise None
+        """
+        cached = self._read().get(key)
+        if cached is None or cached['expires_at'] - self.refresh_margin <= time.time():
+            return None
+        return cached
+
+    def _store(self, key: str, access_token: str, expires_at: float, scopes):
+        tokens = self._read()
+
+        # Drop the tokens that have expired, whoever they belong to
+        tokens = {token_key: token for token_key, token in tokens.items() if token['expires_at'] > time.time()}
+        tokens[key] = {'access_token': access_token, 'expires_at': expires_at, 'scopes': sorted(scopes or [])}
+
+        # Access tokens are secrets: keep the file private, and write it in one go
+        temp_file = self.cache_file + '.tmp'
+        with os.fdopen(os.open(temp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as f:
+            json.dump(tokens, f)
+        os.replace(temp_file, self.cache_file)
+
+
+def refresh_lock():
+    """
+    Returns the asyncio.Lock that serializes the token refreshes of the running event loop
+    """
+    import asyncio  # only the asyncpraw sessions need it, and they have already imported it
+
+    loop = asyncio.get_running_loop()
+    lock = _refresh_locks.get(loop)
+    if lock is None:
+        lock = _refresh_locks[loop] = asyncio.Lock()
+    return lock
+
+
+def token_key(config) -> str:
+    """
+    Returns the cache key for a Reddit instance's credentials (hashed, so the file does not hold them in clear)
+    """
+    identity = '|'.join(str(value) for value in (
+        config.oauth_url,
+        config.client_id,
+        config.username,
+        config.refresh_token
+    ))
+    return hashlib.sha256(identity.encode()).hexdigest()
+
+
+def praw_reddit(token_cache_file: str = TOKEN_CACHE_FILE, **kwargs):
+    """
+    Returns a praw.Reddit instance (created with kwargs) that shares its access tokens through the cache file.
+    Pass token_cache_file=None to disable the cache.
+    """
+    import praw
+
+    reddit = praw.Reddit(**kwargs)
+    if token_cache_file:
+        TokenCache(token_cache_file).attach(reddit)
+    return request_scheduler.attach(reddit)
+
+
+def asyncpraw_reddit(token_cache_file: str = TOKEN_CACHE_FILE, **kwargs):
+    """
+    Returns an asyncpraw.Reddit instance (created with kwargs) that shares its access tokens through the cache file.
+    Pass token_cache_file=None to disable the cache.
+    """
+    import asyncpraw
+
+    reddit = asyncpraw.Reddit(**kwargs)
+    if token_cache_file:
+        TokenCache(token_cache_file).attach(reddit)
+    return request_scheduler.attach(reddit)
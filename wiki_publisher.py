@@ -0,0 +1,349 @@
+"""
+Publishes the reports of flair_report.py and mod_transparency_report.py to the subreddit wiki, keeping the edits small.
+
+The scripts used to download the whole wiki page, add the new report to it and upload it all again on every run, so
+each edit grew with the years of reports on the page, and a re-run wrote the page even when nothing changed. Two things
+keep the edits bounded instead:
+
+- A PagedReport keeps the reports of each year on their own subpage (e.g. flair-report/2022), and the page itself only
+  holds its intro and the links to the years. The reports still on the page from before are moved to their year
+  subpage the first time it is published, and publishing a report that is already there replaces it.
+- WikiPublisher remembers, in a local cache file, the revision ID and content of every page it read or wrote. If the
+  latest revision of a page is still that one, the content comes from the cache (only the revision ID is requested),
+  and an edit that would not change the page is skipped.
+
+The cache file is set by "wiki_cache_file" in the config file (default: wiki_cache.json).
+"""
+
+import hashlib
+import json
+import os
+import re
+
+from bot_logger import get_bot_logger
+
+logger = get_bot_logger()
+
+
+def content_hash(content: str) -> str:
+    """
+    Returns the hash of a page's content, ignoring the line endings and surrounding whitespace Reddit may change
+    """
+    return hashlib.sha1(content.replace('\r\n', '\n').strip().encode()).hexdigest()
+
+
+def _page_key(subreddit, page_name: str) -> str:
+    return f"{subreddit.display_name.lower()}/{page_name}"
+
+
+class PagedReport:
+    """
+    The layout of a wiki page of reports: an index page linking to one subpage per year of reports
+
+    Parameters
+    ----------
+    page_name : str
+        The index page, e.g. 'flair-report'. The reports for 2022 go on 'flair-report/2022'.
+    entry_pattern : str
+        Regular expression matching the start of a report. Its first group is the report's key (e.g. 'July, 2022'),
+        which must contain the year. Blocks that do not match (e.g. the intro of the page) are left where they are.
+    separator : str
+        What goes between two reports, e.g. '\\n' for a list of links
+    newest_first : bool
+        Whether new reports go at the top of their year page, or at the bottom
+    title : str
+        Heading of the index page when it has no intro yet
+    """
+
+    def __init__(self, page_name: str, entry_pattern: str, separator: str = '\n', newest_first: bool = True, title: str = None):
+        self.page_name = page_name
+        self.entry_pattern = re.compile(entry_pattern)
+        self.separator = separator
+        self.newest_first = newest_first
+        self.title = title or page_name
+        self.link_pattern = re.compile(rf"- \[(\d{{4}})\]\(/r/[^/]+/wiki/{re.escape(page_name)}/\1\)")
+
+    def year_page_name(self, year: int) -> str:
+        return f"{self.page_name}/{year}"
+
+    def entry(self, block: str):
+        """
+        Returns (key, year) if the block is a report, otherwise None
+        """
+        match = self.entry_pattern.match(block.lstrip('\n'))
+        year = re.search(r'\b(\d{4})\b', match.group(1)) if match else None
+        return (match.group(1), int(year.group(1))) if year else None
+
+    def blocks(self, content: str) -> list:
+        return content.split(self.separator) if content else []
+
+    def parse_index(self, content: str):
+        """
+        Splits the index page into (intro blocks, {year: reports still on the index page}, years linked)
+        """
+        intro, reports, years = [], {}, set()
+        for block in self.blocks(content):
+            lines = [line.strip() for line in block.splitlines() if line.strip()]
+            links = [self.link_pattern.fullmatch(line) for line in lines]
+            if lines and all(links):
+                years.update(int(link.group(1)) for link in links)
+                continue
+            entry = self.entry(block)
+            if entry is None:
+                intro.append(block)
+            else:
+                reports.setdefault(entry[1], []).append(block)
+        return intro, reports, years
+
+    def merge(self, content: str, reports: list) -> str:
+        """
+        Returns the content of a year page with the reports added: a report whose key is already on the page replaces
+        it, the others are added at the top (or the bottom) of the reports in the order given
+        """
+        blocks = self.blocks(content)
+        positions = {}
+        for index, block in enumerate(blocks):
+            entry = self.entry(block)
+            if entry is not None:
+                positions[entry[0]] = index
+        added = {}
+        for report in reports:
+            key = self.entry(report)[0]
+            if key in positions:
+                blocks[positions[key]] = report
+            else:
+                added[key] = report
+        if self.newest_first:
+            first_report = next((index for index, block in enumerate(blocks) if self.entry(block)), len(blocks))
+            blocks[first_report:first_report] = added.values()
+        else:
+            blocks.extend(added.values())
+        return self.separator.join(blocks)
+
+    def index_md(self, subreddit_name: str, intro: list, years) -> str:
+        links_md = '\n'.join(
+            f"- [{year}](/r/{subreddit_name}/wiki/{self.year_page_name(year)})" for year in sorted(years, reverse=True)
+        )
+        return self.separator.join((intro or [f"# {self.title}"]) + [links_md])
+
+
+class _Publication:
+    """
+    What one publish() writes: the year pages of the new reports (and of the reports moved off the index page),
+    then the index page
+    """
+
+    def __init__(self, report: PagedReport, subreddit_name: str, index_content: str, reports_md: list, overwrite: bool = False):
+        self.report = report
+        self.subreddit_name = subreddit_name
+        self.overwrite = overwrite
+        self.intro, self.moved, self.years = report.parse_index(index_content)
+        if overwrite:
+            self.intro, self.moved = [], {}
+        self.new = {}
+        for report_md in reports_md:
+            entry = report.entry(report_md)
+            if entry is None:
+                raise ValueError(f"Not a report for {report.page_name}: {report_md.splitlines()[0] if report_md else ''}")
+            self.new.setdefault(entry[1], []).append(report_md)
+
+    def year_pages(self) -> list:
+        """
+        Returns the years whose page needs writing, newest first
+        """
+        return sorted(set(self.moved) | set(self.new), reverse=True)
+
+    def year_page_md(self, year: int, content: str) -> str:
+        content = self.report.merge(None if self.overwrite else content, self.moved.get(year, []))
+        return self.report.merge(content, self.new.get(year, []))
+
+    def index_md(self) -> str:
+        return self.report.index_md(self.subreddit_name, self.intro, self.years | set(self.year_pages()))
+
+
+def open_wiki_publisher(config):
+    """
+    Returns the WikiPublisher caching its pages in the "wiki_cache_file" set in the config file
+    """
+    return WikiPublisher(config.get('wiki_cache_file', 'wiki_cache.json'))
+
+
+class WikiPublisher:
+
+    def __init__(self, cache_file: str = 'wiki_cache.json'):
+        self.cache_file = cache_file
+        self.pages = self._read()  # "subreddit/page" -> {'revision_id': ..., 'hash': ..., 'content': ...}
+        self._latest = set()  # the pages whose cached content was checked to be their latest revision
+
+    def read(self, subreddit, page_name: str):
+        """
+        Returns the content of a wiki page, or None if it does not exist. If the page was not edited since we last
+        read or wrote it, the content comes from the cache and only the page's latest revision ID is requested.
+        """
+        from prawcore import NotFound
+
+        key = _page_key(subreddit, page_name)
+        if key in self.pages and self._is_latest(key, _latest_revision(subreddit.wiki[page_name])):
+            return self.pages[key]['content']
+
+        # Only a missing page reads as None: any other error must not be taken for an empty page and overwritten
+        try:
+            page = subreddit.wiki[page_name]
+            content, revision_id = page.content_md, page.revision_id
+        except NotFound:
+            content, revision_id = None, None
+        self._remember(key, content, revision_id)
+        return content
+
+    def write(self, subreddit, page_name: str, content: str, reason: str = None) -> bool:
+        """
+        Writes a wiki page, unless read() just found it with the same content. Returns True if the page was edited.
+        """
+        key = _page_key(subreddit, page_name)
+        if self._unchanged(key, content):
+            logger.info(f"r/{subreddit.display_name}/wiki/{page_name} is up to date")
+            return False
+        page = subreddit.wiki[page_name]
+        page.edit(content=content, reason=reason)
+        self._remember(key, content, _latest_revision(page))
+        logger.info(f"Updated r/{subreddit.display_name}/wiki/{page_name} ({len(content)} characters)")
+        return True
+
+    def publish(self, subreddit, report: PagedReport, reports_md: list, overwrite: bool = False, reason: str = None) -> int:
+        """
+        Adds reports to the year pages of a PagedReport and links them from its index page
+
+        Parameters
+        ----------
+        subreddit : praw.models.Subreddit
+            The subreddit whose wiki to write
+        report : PagedReport
+            The layout of the wiki page
+        reports_md : list
+            The reports (markdown), in the order they should appear on their year page
+        overwrite : bool (optional)
+            Replace the year pages of the reports instead of adding to them, and drop the reports still on the index page
+
+        Returns
+        -------
+        The number of pages edited
+        """
+        publication = _Publication(report, subreddit.display_name, self.read(subreddit, report.page_name), reports_md, overwrite)
+
+        # Write the year pages first, so the reports moved off the index page are never lost
+        edits = 0
+        for year in publication.year_pages():
+            page_name = report.year_page_name(year)
+            content = None if overwrite else self.read(subreddit, page_name)
+            edits += self.write(subreddit, page_name, publication.year_page_md(year, content), reason)
+        edits += self.write(subreddit, report.page_name, publication.index_md(), reason)
+        return edits
+
+    async def read_async(self, subreddit, page_name: str):
+        """
+        Same as read(), for an asyncpraw subreddit
+        """
+        from asyncprawcore import NotFound
+
+        key = _page_key(subreddit, page_name)
+        if key in self.pages:
+            page = await subreddit.wiki.get_page(page_name, fetch=False)
+            if self._is_latest(key, await _latest_revision_async(page)):
+                return self.pages[key]['content']
+        try:
+            page = await subreddit.wiki.get_page(page_name)
+            content, revision_id = page.content_md, page.revision_id
+        except NotFound:
+            content, revision_id = None, None
+        self._remember(key, content, revision_id)
+        return content
+
+    async def write_async(self, subreddit, page_name: str, content: str, reason: str = None) -> bool:
+        """
+        Same as write(), for an asyncpraw subreddit
+        """
+        key = _page_key(subreddit, page_name)
+        if self._unchanged(key, content):
+            logger.info(f"r/{subreddit.display_name}/wiki/{page_name} is up to date")
+            return False
+        page = await subreddit.wiki.get_page(page_name, fetch=False)
+        await page.edit(content=content, reason=reason)
+        self._remember(key, content, await _latest_revision_async(page))
+        logger.info(f"Updated r/{subreddit.display_name}/wiki/{page_name} ({len(content)} characters)")
+        return True
+
+    async def publish_async(self, subreddit, report: PagedReport, reports_md: list, overwrite: bool = False, reason: str = None) -> int:
+        """
+        Same as publish(), for an asyncpraw subreddit
+        """
+        index_content = await self.read_async(subreddit, report.page_name)
+        publication = _Publication(report, subreddit.display_name, index_content, reports_md, overwrite)
+        edits = 0
+        for year in publication.year_pages():
+            page_name = report.year_page_name(year)
+            content = None if overwrite else await self.read_async(subreddit, page_name)
+            edits += await self.write_async(subreddit, page_name, publication.year_page_md(year, content), reason)
+        edits += await self.write_async(subreddit, report.page_name, publication.index_md(), reason)
+        return edits
+
+    ##############
+    # Page cache #
+    ##############
+    def _is_latest(self, key: str, revision_id) -> bool:
+        if revision_id is None or self.pages[key]['revision_id'] != revision_id:
+            return False
+        self._latest.add(key)
+        return True
+
+    def _unchanged(self, key: str, content: str) -> bool:
+        return key in self._latest and self.pages[key]['hash'] == content_hash(content)
+
+    def _remember(self, key: str, content: str, revision_id):
+        if content is None:
+            self.pages.pop(key, None)
+            self._latest.discard(key)
+        else:
+            self.pages[key] = {'revision_id': revision_id, 'hash': content_hash(content), 'content': content}
+            if revision_id is None:
+                self._latest.discard(key)
+            else:
+                self._latest.add(key)
+        self._save()
+
+    def _read(self) -> dict:
+        try:
+            with open(self.cache_file) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self):
+
+        # Write to a temporary file first so an interrupted run cannot leave a truncated file behind
+        temp_file = self.cache_file + '.tmp'
+        with open(temp_file, 'w') as f:
+            json.dump(self.pages, f)
+        os.replace(temp_file, self.cache_file)
+
+
+def _latest_revision(page):
+    """
+    Returns the ID of the latest revision of a praw WikiPage, or None if the page does not exist
+    """
+    from prawcore import NotFound
+
+    try:
+        return next(iter(page.revisions(limit=1)))['id']
+    except (NotFound, StopIteration):
+        return None
+
+
+async def _latest_revision_async(page):
+    from asyncprawcore import NotFound
+
+    try:
+        async for revision in page.revisions(limit=1):
+            return revision['id']
+    except NotFound:
+        pass
+    return None